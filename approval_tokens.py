@@ -0,0 +1,154 @@
+"""Approval link tokens: one compact token per pending expense.
+
+Each pending expense gets 16 random bytes, stored as the BYTEA primary key
+of approval_tokens. The approve and the reject link carry the same token,
+base64url-encoded (22 characters), so one row covers both. Links sent
+before migration 9 carry a UUID string per action; those rows were
+converted to their 16 bytes and keep their action.
+
+A token is dead once it is used (any link of the expense was clicked, or
+the expense was reviewed from the dashboard) or expired. Dead tokens are
+kept TOKEN_RETENTION_HOURS, so a repeated click still gets its answer,
+then deleted by sweep(). worker.py sweeps every TOKEN_SWEEP_INTERVAL
+seconds; to sweep by hand:
+
+    python approval_tokens.py sweep
+"""
+import argparse
+import base64
+import binascii
+import os
+import secrets
+import uuid
+
+from database import get_db
+
+TOKEN_TTL_HOURS = float(os.getenv("TOKEN_TTL_HOURS", "24"))
+TOKEN_RETENTION_HOURS = float(os.getenv("TOKEN_RETENTION_HOURS", "24"))
+TOKEN_SWEEP_BATCH = int(os.getenv("TOKEN_SWEEP_BATCH", "1000"))
+TOKEN_SWEEP_INTERVAL = float(os.getenv("TOKEN_SWEEP_INTERVAL", "600"))
+
+TOKEN_BYTES = 16
+
+# expires_at / used_at are UTC without a time zone
+NOW_UTC = "(NOW() AT TIME ZONE 'UTC')"
+
+# action: NULL for the one token behind both links; 'approve' / 'reject'
+# on rows carried over from the two-token scheme.
+# LEAST() skips NULLs, so the sweep index holds the moment a token died.
+TABLE_SQL = """
+CREATE TABLE approval_tokens(
+    token BYTEA PRIMARY KEY,
+    pending_id INT NOT NULL,
+    action TEXT,
+    expires_at TIMESTAMP NOT NULL,
+    used_at TIMESTAMP
+);
+CREATE INDEX approval_tokens_pending_id_idx ON approval_tokens (pending_id);
+CREATE INDEX approval_tokens_dead_idx ON approval_tokens (LEAST(used_at, expires_at));
+"""
+
+INSERT_SQL = f"""
+INSERT INTO approval_tokens (token, pending_id, expires_at)
+VALUES (%s, %s, {NOW_UTC} + %s * interval '1 hour')
+"""
+
+
+def new_token():
+    return secrets.token_bytes(TOKEN_BYTES)
+
+
+def encode(token):
+    return base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+
+def decode(text):
+    """Link text -> token bytes, or None when it cannot be a token."""
+    if len(text) == 36:
+        try:
+            return uuid.UUID(text).bytes
+        except ValueError:
+            return None
+    try:
+        token = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    return token if len(token) == TOKEN_BYTES else None
+
+
+# ---------------- migration ----------------
+
+def migrate_table(cur):
+    """Migration 9: two TEXT-token rows per expense -> BYTEA tokens.
+
+    Existing rows keep working: their UUID text becomes its 16 bytes and
+    their action stays set. Rows that are already past retention are not
+    carried over.
+    """
+    cur.execute("ALTER TABLE approval_tokens RENAME TO approval_tokens_old")
+    cur.execute("ALTER INDEX IF EXISTS approval_tokens_pending_id_idx RENAME TO approval_tokens_old_pending_id_idx")
+    # The old table was created ad hoc, so its primary key may be missing or
+    # named otherwise; drop whichever it has, the table goes away anyway.
+    cur.execute("""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'approval_tokens_old'::regclass AND contype = 'p'
+    """)
+    for (name,) in cur.fetchall():
+        cur.execute(f'ALTER TABLE approval_tokens_old DROP CONSTRAINT "{name}"')
+    cur.execute(TABLE_SQL)
+    cur.execute(f"""
+        INSERT INTO approval_tokens (token, pending_id, action, expires_at, used_at)
+        SELECT decode(replace(token, '-', ''), 'hex'), pending_id, action, expires_at,
+               CASE WHEN is_used THEN COALESCE(used_at, {NOW_UTC}) END
+        FROM approval_tokens_old
+        WHERE token ~ '^[0-9a-f]{{8}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{12}}$'
+          AND LEAST(CASE WHEN is_used THEN COALESCE(used_at, {NOW_UTC}) END, expires_at)
+              >= {NOW_UTC} - %s * interval '1 hour'
+    """, (TOKEN_RETENTION_HOURS,))
+    cur.execute("DROP TABLE approval_tokens_old")
+    cur.execute("ANALYZE approval_tokens")
+
+
+# ---------------- sweeper ----------------
+
+def sweep(batch_size=TOKEN_SWEEP_BATCH):
+    """Delete tokens dead for longer than TOKEN_RETENTION_HOURS.
+
+    Each batch is its own short transaction and skips rows a click is
+    holding, so the sweeper never waits on a lock and holds its own only
+    for one batch. ANY(ARRAY(...)) keeps the delete on the primary key; an
+    IN (subquery) is planned as a hash join over the whole table. Returns
+    how many tokens were deleted.
+    """
+    total = 0
+    while True:
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                DELETE FROM approval_tokens
+                WHERE token = ANY(ARRAY(
+                    SELECT token FROM approval_tokens
+                    WHERE LEAST(used_at, expires_at) < {NOW_UTC} - %s * interval '1 hour'
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ))
+            """, (TOKEN_RETENTION_HOURS, batch_size))
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage approval link tokens")
+    parser.add_argument("command", choices=["sweep"])
+    parser.parse_args()
+
+    print(f"deleted {sweep()} dead approval tokens")
+
+
+if __name__ == "__main__":
+    main()
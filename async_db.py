@@ -0,0 +1,209 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from psycopg import AsyncCursor
+from psycopg.pq import TransactionStatus
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+import metrics
+
+from database import (
+    DATABASE_URL,
+    ASYNC_DB_POOL_MIN,
+    ASYNC_DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_CHECK_IDLE,
+)
+
+# Async counterpart of database.py, built on psycopg 3. It uses the same
+# DATABASE_URL and %s placeholders, so SQL moves between the sync and async
+# handlers unchanged. Its pool is sized on its own (ASYNC_DB_POOL_MIN /
+# ASYNC_DB_POOL_MAX, see database.py).
+
+_pool = None
+_pool_pid = None
+_last_used = {}
+
+
+class TimedAsyncCursor(AsyncCursor):
+    """Records every statement in the current request's metrics.
+
+    Inside a pipeline execute() only queues the statement; read_snapshot()
+    records the pipeline as a whole instead.
+    """
+
+    async def execute(self, query, params=None, **kwargs):
+        if self.connection.pgconn.pipeline_status:
+            return await super().execute(query, params, **kwargs)
+        with metrics.timed(query):
+            return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        with metrics.timed(query):
+            return await super().executemany(query, params_seq, **kwargs)
+
+    @asynccontextmanager
+    async def copy(self, statement, params=None, **kwargs):
+        with metrics.timed(statement):
+            async with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+
+
+async def _check(conn):
+    # Same policy as the sync pool: only ping connections that sat idle.
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return
+    await AsyncConnectionPool.check_connection(conn)
+
+
+def _get_pool():
+    global _pool, _pool_pid, _last_used
+
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        _pool = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=ASYNC_DB_POOL_MIN,
+            max_size=ASYNC_DB_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            check=_check,
+            kwargs={"cursor_factory": TimedAsyncCursor},
+            open=False,
+        )
+        _pool_pid = pid
+        _last_used = {}
+    return _pool
+
+
+async def open_pool():
+    await _get_pool().open()
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        await _pool.close()
+    _pool = None
+
+
+@asynccontextmanager
+async def get_async_db():
+    """Borrow a pooled async connection; it is always returned to the pool.
+
+    Like get_db(), nothing is committed implicitly: handlers call
+    ``await conn.commit()`` and anything left open is rolled back.
+    """
+    pool = _get_pool()
+    await pool.open()
+
+    start = time.perf_counter()
+    try:
+        conn = await pool.getconn()
+    except PoolTimeout:
+        metrics.DB_POOL_TIMEOUTS.labels("async").inc()
+        raise
+    finally:
+        metrics.DB_POOL_WAIT_SECONDS.labels("async").observe(time.perf_counter() - start)
+
+    metrics.DB_POOL_IN_USE.labels("async").inc()
+    try:
+        yield conn
+    finally:
+        if conn.info.transaction_status != TransactionStatus.IDLE and not conn.closed:
+            await conn.rollback()
+        _last_used[id(conn)] = time.monotonic()
+        await pool.putconn(conn)
+        metrics.DB_POOL_IN_USE.labels("async").dec()
+
+
+@asynccontextmanager
+async def request_db():
+    """get_async_db() inside a handler: no free connection -> 503.
+
+    For handlers that should hold a connection only around their queries,
+    not while they wait on something else (see login in main.py).
+    """
+    try:
+        async with get_async_db() as conn:
+            yield conn
+    except PoolTimeout:
+        raise HTTPException(503, "Database busy, please retry")
+
+
+async def async_db_conn():
+    """FastAPI dependency: one pooled async connection per request."""
+    async with request_db() as conn:
+        yield conn
+
+
+# ---------------- cursor helpers ----------------
+# prepare=True makes psycopg PREPARE the statement on this connection the
+# first time its text is seen and reuse it afterwards (see queries.py).
+
+async def execute(conn, sql, params=None, prepare=None):
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params, prepare=prepare)
+        return cur.rowcount
+
+
+async def fetchone(conn, sql, params=None, prepare=None):
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params, prepare=prepare)
+        return await cur.fetchone()
+
+
+async def fetchval(conn, sql, params=None, prepare=None):
+    row = await fetchone(conn, sql, params, prepare)
+    return row[0] if row else None
+
+
+async def fetchall(conn, sql, params=None, prepare=None):
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params, prepare=prepare)
+        return await cur.fetchall()
+
+
+async def read(conn, sql, params=None):
+    """fetchall() as a prepared statement, for read-only queries.
+
+    psycopg forgets a connection's prepared statements on ROLLBACK, which
+    is how get_async_db() ends a transaction left open. So when read()
+    starts the transaction it also commits it (free, nothing was written),
+    and the statements stay prepared for the next request.
+    """
+    opened = conn.info.transaction_status == TransactionStatus.IDLE
+    rows = await fetchall(conn, sql, params, prepare=True)
+    if opened:
+        await conn.commit()
+    return rows
+
+
+async def read_snapshot(conn, statements):
+    """read() for several queries at once: [(sql, params), ...] -> [rows, ...].
+
+    The statements go out in one pipeline (all sent before the first
+    result is awaited, so N queries cost about one round trip) and, when
+    this starts the transaction, share one REPEATABLE READ snapshot: the
+    results are consistent with each other even while writes land.
+    """
+    opened = conn.info.transaction_status == TransactionStatus.IDLE
+    cursors = []
+    with metrics.timed("pipeline: " + "; ".join(sql for sql, _ in statements)):
+        async with conn.pipeline():
+            if opened:
+                await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            for sql, params in statements:
+                cur = conn.cursor()
+                await cur.execute(sql, params, prepare=True)
+                cursors.append(cur)
+
+    results = []
+    for cur in cursors:
+        results.append(await cur.fetchall())
+        await cur.close()
+    if opened:
+        await conn.commit()
+    return results
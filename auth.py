@@ -1,19 +1,61 @@
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 import os
-from database import get_db
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import time
+from cache import TTLCache
 
 SECRET = os.getenv("JWT_SECRET")
 ALGO = "HS256"
 
-def hash_password(password):
-    return pwd_context.hash(password)
+# Per-process cache of the users row behind a token, keyed by
+# (generation, user_id). The generation is the users_generation sequence,
+# which a trigger on users bumps on every insert, delete and
+# name/email/role change (USERS_TRIGGER_SQL). Each process re-reads it at
+# most every USER_GENERATION_INTERVAL seconds, so a cache hit costs no
+# query and a demoted or deleted user drops out of every worker's cache
+# within that interval.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_GENERATION_INTERVAL = float(os.getenv("USER_GENERATION_INTERVAL", "5"))
+# When enabled, name/email/role travel inside the signed token, with the
+# generation they were read at; requests skip the users lookup while that
+# generation is current.
+AUTH_CLAIMS_IN_TOKEN = os.getenv("AUTH_CLAIMS_IN_TOKEN", "false").lower() == "true"
+
+GENERATION_SQL = "SELECT last_value FROM users_generation"
+
+USERS_TRIGGER_SQL = """
+CREATE SEQUENCE IF NOT EXISTS users_generation;
+
+CREATE OR REPLACE FUNCTION users_bump_generation() RETURNS trigger AS $$
+BEGIN
+    PERFORM nextval('users_generation');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class UserGeneration:
+    """This process's copy of users_generation; stale() once it is
+    USER_GENERATION_INTERVAL seconds old, then the caller re-reads it
+    with GENERATION_SQL and update()s it."""
 
-def verify_password(password, hashed):
-    return pwd_context.verify(password, hashed)
+    def __init__(self, interval):
+        self.interval = interval
+        self.value = None
+        self.read_at = 0.0
+
+    def stale(self):
+        return self.value is None or time.monotonic() - self.read_at >= self.interval
+
+    def update(self, value):
+        self.value = value
+        self.read_at = time.monotonic()
+
+
+user_generation = UserGeneration(USER_GENERATION_INTERVAL)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL, name="user")
 
 def create_token(data):
     expire = datetime.utcnow() + timedelta(hours=8)
@@ -25,4 +67,17 @@ def decode_token(token: str):
         payload = jwt.decode(token, SECRET, algorithms=[ALGO])
         return payload
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+def user_from_claims(payload, generation):
+    if not AUTH_CLAIMS_IN_TOKEN or "role" not in payload or payload.get("gen") != generation:
+        return None
+    return {
+        "id": payload["user_id"],
+        "name": payload["name"],
+        "email": payload["email"],
+        "role": payload["role"],
+    }
+
+def cached_user(payload, generation):
+    return user_from_claims(payload, generation) or user_cache.get((generation, payload.get("user_id")))
@@ -0,0 +1,47 @@
+"""Load-test and benchmark harnesses against a local Postgres, one module
+per area. Seed a throwaway database, start the app, then drive it:
+
+    python -m bench.seed --users 50 --rows 200000
+    gunicorn main:app -k uvicorn.workers.UvicornWorker -w 2 &
+    python -m bench.web load --url http://127.0.0.1:8000 --concurrency 200
+
+- bench.seed       synthetic users, expenses and approval tokens
+- bench.web        HTTP load, login bursts, bulk import
+- bench.kpis       KPI query strategies
+- bench.serialize  JSON encoding of large row lists
+- bench.mail       email rendering and sending
+
+Query plans are checked by tests/test_explain.py (TEST_DATABASE_URL).
+
+Run a harness against two builds (e.g. before/after a change) with the
+same seed and flags to compare them.
+"""
+import statistics
+import time
+
+import requests
+
+BENCH_PASSWORD = "bench-password"
+BENCH_ADMIN_EMAIL = "bench-admin@example.com"
+
+
+def login(url, email, password):
+    session = requests.Session()
+    r = session.post(f"{url}/login", json={"email": email, "password": password})
+    r.raise_for_status()
+    return session
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def median_ms(fn, repeat):
+    fn()  # warm up caches and plans
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
@@ -0,0 +1,117 @@
+"""KPI query strategies, on whatever bench.seed put in the database:
+
+    python -m bench.kpis --repeat 20
+
+Compares the four-query KPI path dashboard_kpis used to run with the
+same five numbers computed in one pass over expense_items and with
+the rollup-backed query it uses now (use --rows 1000000 when seeding for
+the 1M-row case). The four queries read the three per-status tables,
+which are only views over expense_items since migration 5; they are
+snapshotted into temp tables with migration 2's indexes first, so the
+baseline runs against the layout it was written for.
+"""
+import argparse
+
+import migrations
+from bench import median_ms
+from database import get_db
+
+# dashboard_kpis before it became one query: a statement per number, on
+# the tables of _snapshot_legacy_tables()
+LEGACY_KPI_SQL = [
+    "SELECT COALESCE(SUM(amount),0) FROM pg_temp.expenses {where}",
+    "SELECT COUNT(*) FROM pg_temp.pending_expenses {where}",
+    "SELECT COUNT(*) FROM pg_temp.expenses {where}",
+    "SELECT COUNT(*) FROM pg_temp.rejected_expenses {where}",
+]
+
+ITEMS_KPI_SQL = """
+    SELECT
+        COALESCE(SUM(amount) FILTER (WHERE status = 'approved'), 0),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE status = 'approved'),
+        COUNT(*) FILTER (WHERE status = 'rejected'),
+        COUNT(*) FILTER (WHERE status = 'pending')
+    FROM expense_items {where}
+"""
+
+ROLLUP_KPI_SQL = """
+    SELECT
+        COALESCE(SUM(total) FILTER (WHERE status = 'approved'), 0),
+        COALESCE(SUM(cnt), 0),
+        COALESCE(SUM(cnt) FILTER (WHERE status = 'approved'), 0),
+        COALESCE(SUM(cnt) FILTER (WHERE status = 'rejected'), 0),
+        COALESCE(SUM(cnt) FILTER (WHERE status = 'pending'), 0)
+    FROM expense_rollup {where}
+"""
+
+
+def _snapshot_legacy_tables(cur):
+    """The pre-migration-5 tables, one per status, as temp tables of this
+    session with the index migration 2 gave them."""
+    for table, status in migrations._LEGACY_TABLES.items():
+        cur.execute(f"""
+            CREATE TEMP TABLE {table} AS
+            SELECT id, {migrations._ITEM_COLUMNS}, created_at
+            FROM expense_items WHERE status = %s
+        """, (status,))
+        cur.execute(f"""
+            CREATE INDEX ON pg_temp.{table} (created_by, expense_date DESC, id DESC)
+            INCLUDE (head, subhead, amount)
+        """)
+        cur.execute(f"ANALYZE pg_temp.{table}")
+
+
+def bench_kpis(args):
+    with get_db() as conn:
+        cur = conn.cursor()
+        _snapshot_legacy_tables(cur)
+        cur.execute("""
+            SELECT MIN(created_by), MIN(office_name), MIN(expense_date)
+            FROM expense_items WHERE status = 'approved'
+        """)
+        user_id, office, date = cur.fetchone()
+
+        cases = [
+            ("no filter", [], []),
+            ("user", ["created_by = %s"], [user_id]),
+            ("office", ["office_name = %s"], [office]),
+            ("office+head", ["office_name = %s", "head = %s"], [office, "Porter"]),
+            ("date", ["expense_date = %s"], [date]),
+        ]
+
+        print(f"{'filter':14} {'4 queries ms':>13} {'expense_items ms':>17} {'rollup ms':>10}")
+        for name, conditions, values in cases:
+            where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+            def legacy():
+                for sql in LEGACY_KPI_SQL:
+                    cur.execute(sql.format(where=where), values)
+                    cur.fetchone()
+
+            def items():
+                cur.execute(ITEMS_KPI_SQL.format(where=where), values)
+                cur.fetchone()
+
+            def rollup():
+                cur.execute(ROLLUP_KPI_SQL.format(where=where), values)
+                cur.fetchone()
+
+            print(
+                f"{name:14} {median_ms(legacy, args.repeat):13.1f} "
+                f"{median_ms(items, args.repeat):17.1f} "
+                f"{median_ms(rollup, args.repeat):10.1f}"
+            )
+
+        conn.rollback()
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    bench_kpis(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Approval email harnesses:
+
+    python -m bench.mail render --count 5000
+
+`render` times rendering approval emails (text + HTML): --count single
+ones, and digests of outbox.DIGEST_MAX_EXPENSES expenses.
+
+`mail` sends --count approval emails one after another through
+mail_transport (MAIL_BACKEND, e.g. against the stub) and reports the send
+rate and latency; the stub's output shows how many connections that took.
+
+The stub is tests/sendgrid_stub.py; run it on its own to send to it:
+
+    python -m tests.sendgrid_stub --port 8025 &
+    MAIL_BACKEND=sendgrid SENDGRID_API_URL=http://127.0.0.1:8025/v3/mail/send SENDGRID_API_KEY=stub \
+        python -m bench.mail mail --count 500
+"""
+import argparse
+import statistics
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import email_utils
+import mail_transport
+import outbox
+from bench import median_ms, percentile
+
+
+# ---------------- render ----------------
+
+def render(args):
+    expense = SimpleNamespace(
+        client="client-1", office_name="office-1", expense_date=date.today(), head="Fuel",
+        subhead="subhead-1", from_location="A", to_location="B", weight=Decimal("12.5"),
+        amount=Decimal("1234.50"), awb="AWB-1", vehicle_type="Truck", remark="<b>remark</b>",
+    )
+    item = {
+        "expense": expense,
+        "approve_url": "https://example.com/review/approve/token",
+        "reject_url": "https://example.com/review/reject/token",
+        "submitted_by_name": "bench-user-1",
+        "submitted_by_email": "bench-user-1@example.com",
+    }
+    digest = [item] * outbox.DIGEST_MAX_EXPENSES
+
+    def singles():
+        for _ in range(args.count):
+            email_utils.render_email("New Expense Submitted", [item])
+
+    def digests():
+        for _ in range(args.count // len(digest) or 1):
+            email_utils.render_email(f"{len(digest)} Expenses Awaiting Approval", digest)
+
+    ms = median_ms(singles, args.repeat)
+    print(f"{'single':10} {ms * 1000 / args.count:8.1f} us/email")
+    ms = median_ms(digests, args.repeat)
+    per_digest = ms * 1000 / (args.count // len(digest) or 1)
+    print(f"{'digest':10} {per_digest:8.1f} us/email  ({per_digest / len(digest):.1f} us per expense)")
+
+
+# ---------------- mail ----------------
+
+def mail(args):
+    expense = SimpleNamespace(client="client-1", office_name="office-1", head="Fuel", amount=100)
+    latencies = []
+    failures = defaultdict(int)
+
+    start = time.monotonic()
+    for i in range(args.count):
+        t = time.perf_counter()
+        try:
+            email_utils.send_approval_email(
+                [args.to], f"https://example.com/review/approve/{i}",
+                f"https://example.com/review/reject/{i}", expense,
+                submitted_by_name="bench-user-1", submitted_by_email="bench-user-1@example.com",
+            )
+        except Exception as e:
+            failures[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.monotonic() - start
+
+    print(f"{args.count} emails via {mail_transport.MAIL_BACKEND} in {elapsed:.2f}s "
+          f"({args.count / elapsed:.0f}/s), failures {dict(failures)}")
+    print(f"p50 {statistics.median(latencies) * 1000:.1f} ms  p99 {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("render", help="time approval email rendering")
+    p.add_argument("--count", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=render)
+
+    p = sub.add_parser("mail", help="send approval emails through mail_transport")
+    p.add_argument("--count", type=int, default=500)
+    p.add_argument("--to", default="admin@example.com")
+    p.set_defaults(func=mail)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Insert synthetic users, expenses and approval tokens:
+
+    python -m bench.seed --users 50 --rows 200000
+
+70% of the rows are approved, 20% pending and 10% rejected, spread over
+the last two years. Every user's password is bench.BENCH_PASSWORD.
+"""
+import argparse
+
+import partitions
+from bench import BENCH_ADMIN_EMAIL, BENCH_PASSWORD
+from database import get_db
+from hashing import hash_password
+
+
+def seed(users=50, offices=50, rows=200_000):
+    """Seed the database and return the bench users' ids."""
+    with get_db() as conn:
+        cur = conn.cursor()
+        hashed = hash_password(BENCH_PASSWORD)
+
+        cur.execute("""
+            INSERT INTO users (name, email, password, role)
+            VALUES ('bench-admin', %s, %s, 'admin')
+            ON CONFLICT (email) DO NOTHING
+        """, (BENCH_ADMIN_EMAIL, hashed))
+        cur.execute("""
+            INSERT INTO users (name, email, password, role)
+            SELECT 'bench-user-' || i, 'bench-user-' || i || '@example.com', %s, 'user'
+            FROM generate_series(1, %s) i
+            ON CONFLICT (email) DO NOTHING
+        """, (hashed, users))
+        cur.execute("SELECT id FROM users WHERE email LIKE 'bench-%%'")
+        user_ids = [r[0] for r in cur.fetchall()]
+
+        for status, share in (
+            ("approved", 0.7),
+            ("pending", 0.2),
+            ("rejected", 0.1),
+        ):
+            cur.execute("""
+                INSERT INTO expense_items (
+                    status, expense_date, client, office_name, head, subhead,
+                    amount, created_by
+                )
+                SELECT
+                    %s,
+                    CURRENT_DATE - (random() * 730)::int,
+                    'client-' || (i %% 200),
+                    'office-' || (i %% %s),
+                    (ARRAY['Porter','Urgent Delivery','Pickup & Delivery',
+                           'Connections','Fuel','Stationery'])[1 + i %% 6],
+                    'subhead-' || (i %% 25),
+                    round((random() * 5000)::numeric, 2),
+                    (%s::int[])[1 + i %% %s]
+                FROM generate_series(1, %s) i
+            """, (status, offices, user_ids, len(user_ids), int(rows * share)))
+
+        # rows older than the existing partitions landed in the default one
+        partitions.ensure(cur)
+
+        cur.execute("""
+            INSERT INTO approval_tokens (token, pending_id, expires_at)
+            SELECT uuid_send(gen_random_uuid()), p.id, NOW() AT TIME ZONE 'UTC' + interval '24 hours'
+            FROM expense_items p
+            WHERE p.status = 'pending' AND p.created_by = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM approval_tokens t WHERE t.pending_id = p.id)
+        """, (user_ids,))
+
+        conn.commit()
+        cur.execute("ANALYZE")
+        conn.commit()
+        cur.close()
+
+    return user_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--offices", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    user_ids = seed(args.users, args.offices, args.rows)
+    print(f"seeded {args.rows} expenses for {len(user_ids)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""JSON encoding of large row lists:
+
+    python -m bench.serialize --rows 50000
+
+Times turning --rows expense rows into a JSON body three ways:
+jsonable_encoder + json (the old path), pydantic response_model, and
+fast_json (orjson when installed).
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import fast_json
+from bench import median_ms
+from schemas import ExpenseRowOut
+
+
+def serialize(args):
+    fields = ("date", "head", "subhead", "amount")
+    today = date.today()
+    rows = [
+        (today - timedelta(days=i % 730), f"head-{i % 6}", f"subhead-{i % 25}",
+         Decimal(random.randint(100, 500000)) / 100)
+        for i in range(args.rows)
+    ]
+    adapter = TypeAdapter(list[ExpenseRowOut])
+
+    def legacy():
+        items = [dict(zip(fields, r)) for r in rows]
+        return json.dumps(jsonable_encoder(items)).encode()
+
+    def response_model():
+        return adapter.dump_json(adapter.validate_python([dict(zip(fields, r)) for r in rows]))
+
+    def fast():
+        return fast_json.dumps(fast_json.rows_to_dicts(fields, rows))
+
+    backend = "orjson" if fast_json.orjson else "stdlib json"
+    print(f"{args.rows} rows, median of {args.repeat} runs")
+    for name, fn in (
+        ("jsonable_encoder + json", legacy),
+        ("pydantic response_model", response_model),
+        (f"fast_json ({backend})", fast),
+    ):
+        print(f"{name:28} {median_ms(fn, args.repeat):8.1f} ms  {len(fn()) / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    serialize(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
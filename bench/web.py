@@ -0,0 +1,200 @@
+"""HTTP harnesses, run against a server started on a seeded database
+(see bench.seed):
+
+    python -m bench.web load --url http://127.0.0.1:8000 --concurrency 200
+
+`logins` fires --concurrency logins at once (a shift-start burst) while
+another client keeps hitting --probe, and reports latency and status codes
+for both. Every bench client shares one IP; to see queueing rather than
+the per-IP limit, let the server trust the bench as a proxy and spread the
+logins over --clients forwarded addresses:
+
+    TRUSTED_PROXIES=127.0.0.1 gunicorn main:app -c gunicorn.conf.py &
+    python -m bench.web logins --url http://127.0.0.1:8000 --concurrency 200 --clients 50
+
+`bulk` times a CSV upload of --rows expenses to /api/expenses/bulk:
+
+    python -m bench.web bulk --url http://127.0.0.1:8000 --rows 100000
+
+The email link race (approve and reject clicked at once) is covered by
+tests/test_review_clicks.py.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import BENCH_ADMIN_EMAIL, BENCH_PASSWORD, login, percentile
+
+HOT_ENDPOINTS = [
+    "/me",
+    "/api/dashboard/kpis",
+    "/api/dashboard/admin/filters",
+    "/api/dashboard/admin/pie/head",
+    "/api/dashboard/admin/pie/office",
+]
+
+
+# ---------------- load ----------------
+
+def report(latencies, errors, elapsed):
+    print(f"{'endpoint':40} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    total = 0
+    for name, values in sorted(latencies.items()):
+        total += len(values)
+        print(
+            f"{name:40} {len(values) / elapsed:8.1f} "
+            f"{statistics.median(values) * 1000:8.1f} "
+            f"{percentile(values, 99) * 1000:8.1f} {errors[name]:7}"
+        )
+    print(f"{'TOTAL':40} {total / elapsed:8.1f}")
+
+
+def load(args):
+    endpoints = args.endpoint or HOT_ENDPOINTS
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        sessions = list(pool.map(
+            lambda _: login(args.url, args.email, args.password),
+            range(args.concurrency),
+        ))
+
+    deadline = time.monotonic() + args.duration
+
+    def worker(n):
+        session = sessions[n]
+        i = n
+        while time.monotonic() < deadline:
+            path = endpoints[i % len(endpoints)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                ok = session.get(f"{args.url}{path}", timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            took = time.perf_counter() - start
+            with lock:
+                latencies[path].append(took)
+                if not ok:
+                    errors[path] += 1
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    report(latencies, errors, time.monotonic() - start)
+
+
+# ---------------- logins ----------------
+
+def logins(args):
+    probe = login(args.url, args.email, args.password)
+    statuses = defaultdict(int)
+    login_latencies = []
+    probe_latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def login_once(n):
+        start = time.perf_counter()
+        try:
+            status = requests.post(f"{args.url}/login", json={
+                "email": f"bench-user-{n % args.users + 1}@example.com",
+                "password": BENCH_PASSWORD,
+            }, headers={
+                "X-Forwarded-For": f"10.0.{n % args.clients // 256}.{n % args.clients % 256}",
+            }, timeout=120).status_code
+        except requests.RequestException:
+            status = "error"
+        with lock:
+            login_latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    def probe_loop():
+        while not done.is_set():
+            start = time.perf_counter()
+            probe.get(f"{args.url}{args.probe}", timeout=30)
+            probe_latencies.append(time.perf_counter() - start)
+
+    prober = threading.Thread(target=probe_loop)
+    prober.start()
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(login_once, range(args.concurrency)))
+    elapsed = time.monotonic() - start
+    done.set()
+    prober.join()
+
+    print(f"{args.concurrency} logins in {elapsed:.1f}s, status codes {dict(statuses)}")
+    for name, values in (("POST /login", login_latencies), (f"GET {args.probe}", probe_latencies)):
+        print(
+            f"{name:40} {len(values):6} req  p50 {statistics.median(values) * 1000:8.1f} ms"
+            f"  p99 {percentile(values, 99) * 1000:8.1f} ms"
+        )
+
+
+# ---------------- bulk import ----------------
+
+def bulk(args):
+    session = login(args.url, BENCH_ADMIN_EMAIL, BENCH_PASSWORD)
+
+    lines = ["expense_date,client,office_name,head,subhead,from_location,to_location,weight,amount,awb"]
+    for i in range(args.rows):
+        lines.append(
+            f"2026-01-{1 + i % 28:02},client-{i % 200},office-{i % 20},Porter,"
+            f"subhead-{i % 25},A,B,{1 + i % 40},{round(1 + random.random() * 5000, 2)},AWB{i}"
+        )
+    body = "\n".join(lines).encode()
+
+    start = time.perf_counter()
+    r = session.post(
+        f"{args.url}/api/expenses/bulk", data=body, headers={"Content-Type": "text/csv"}
+    )
+    elapsed = time.perf_counter() - start
+
+    print(r.status_code, r.text[:200])
+    print(f"{args.rows} rows ({len(body) / 1e6:.1f} MB) in {elapsed:.2f}s "
+          f"= {args.rows / elapsed:.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("load", help="drive the hot endpoints concurrently")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--email", default=BENCH_ADMIN_EMAIL)
+    p.add_argument("--password", default=BENCH_PASSWORD)
+    p.add_argument("--concurrency", type=int, default=100)
+    p.add_argument("--duration", type=float, default=20)
+    p.add_argument("--endpoint", action="append", help="path to hit (repeatable)")
+    p.set_defaults(func=load)
+
+    p = sub.add_parser("logins", help="burst of concurrent logins next to other traffic")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--email", default=BENCH_ADMIN_EMAIL)
+    p.add_argument("--password", default=BENCH_PASSWORD)
+    p.add_argument("--concurrency", type=int, default=200)
+    p.add_argument("--users", type=int, default=50, help="bench users seeded")
+    p.add_argument("--clients", type=int, default=1, help="forwarded client addresses to spread logins over")
+    p.add_argument("--probe", default="/api/dashboard/kpis")
+    p.set_defaults(func=logins)
+
+    p = sub.add_parser("bulk", help="time a CSV bulk import")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--rows", type=int, default=100000)
+    p.set_defaults(func=bulk)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from fastapi import Response
+from psycopg.pq import TransactionStatus
+
+import async_db
+import metrics
+from fast_json import dumps
+
+# memory: entries per process, generation in the Postgres sequence below
+#         (one extra small read per cached request).
+# redis: entries and generation in Redis (the `redis` package, in requirements.txt).
+# none: disabled.
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    A ttl or maxsize of 0 disables caching (every get is a miss). With a
+    name, lookups are also counted in metrics.CACHE_LOOKUPS.
+    """
+
+    def __init__(self, maxsize, ttl, name=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    self._count("hit")
+                    return value
+                del self._data[key]
+            self.misses += 1
+            self._count("miss")
+            return default
+
+    def _count(self, result):
+        if self.name:
+            metrics.CACHE_LOOKUPS.labels(self.name, result).inc()
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# ---------------- response cache ----------------
+# Entries are keyed by (generation, endpoint, scope, filters). Every write to
+# the expense tables bumps the generation, which orphans all older entries
+# at once; they then age out through the TTL/LRU. The generation is shared
+# by all workers, so a write on one of them invalidates every worker's
+# entries straight away.
+
+# A fresh sequence's first nextval() leaves last_value as it was, so the
+# migration takes it.
+GENERATION_SEQUENCE_SQL = """
+CREATE SEQUENCE IF NOT EXISTS response_cache_generation;
+SELECT nextval('response_cache_generation');
+"""
+
+
+class MemoryBackend:
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize, ttl)
+        self.enabled = maxsize > 0 and ttl > 0
+        # last generation read, for stats()
+        self._generation = 0
+
+    async def generation(self, conn):
+        self._generation = (await async_db.read(
+            conn, "SELECT last_value FROM response_cache_generation"
+        ))[0][0]
+        return self._generation
+
+    async def bump(self, conn):
+        await async_db.execute(conn, "SELECT nextval('response_cache_generation')")
+        await conn.commit()
+
+    def bump_sync(self, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT nextval('response_cache_generation')")
+        conn.commit()
+        cur.close()
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, value):
+        self._cache.set(key, value)
+
+    def stats(self):
+        return {"backend": "memory", "generation": self._generation, **self._cache.stats()}
+
+
+class RedisBackend:
+    GENERATION_KEY = "response-cache:generation"
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND=redis needs the redis package (pip install redis)"
+            ) from e
+
+        self.enabled = ttl > 0
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis.asyncio.Redis.from_url(url)
+        # bump_sync() runs in the threadpool or outside the app (partitions.py)
+        self._redis_sync = redis.Redis.from_url(url)
+
+    async def generation(self, conn):
+        return int(await self._redis.get(self.GENERATION_KEY) or 0)
+
+    async def bump(self, conn):
+        await self._redis.incr(self.GENERATION_KEY)
+
+    def bump_sync(self, conn):
+        self._redis_sync.incr(self.GENERATION_KEY)
+
+    async def get(self, key):
+        raw = await self._redis.get(f"response-cache:{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, body = raw.split(b"\n", 1)
+        return body, etag.decode()
+
+    async def set(self, key, value):
+        body, etag = value
+        await self._redis.set(
+            f"response-cache:{key}", etag.encode() + b"\n" + body, ex=int(self.ttl)
+        )
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _make_backend():
+    if RESPONSE_CACHE_BACKEND == "redis":
+        return RedisBackend(REDIS_URL, RESPONSE_CACHE_TTL)
+    if RESPONSE_CACHE_BACKEND == "none":
+        return MemoryBackend(0, 0)
+    return MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+response_cache = _make_backend()
+
+
+# A failed bump is logged, not raised: the write it follows is committed
+# already. Entries it should have orphaned live on until the TTL.
+
+async def invalidate_responses(conn):
+    """Call right after committing any write that changes dashboard data,
+    with the handler's async connection."""
+    if not response_cache.enabled:
+        return
+    try:
+        await response_cache.bump(conn)
+    except Exception as e:
+        print(f"⚠️ Response cache invalidation failed: {e}")
+
+
+def invalidate_responses_sync(conn):
+    """invalidate_responses() for sync handlers and scripts (partitions.py),
+    with their psycopg2 connection."""
+    if not response_cache.enabled:
+        return
+    try:
+        response_cache.bump_sync(conn)
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️ Response cache invalidation failed: {e}")
+
+
+def role_scope(current_user):
+    if current_user["role"] == "admin":
+        return "admin"
+    return f"user:{current_user['id']}"
+
+
+async def _lookup(conn, key):
+    """(generation-qualified key, entry or None); the backend may raise."""
+    key = f"{await response_cache.generation(conn)}|{key}"
+    return key, await response_cache.get(key)
+
+
+def _filters_key(params):
+    """params as a cache key part. Empty values are dropped, and list
+    values are sets of alternatives: ?office=A&office=B and
+    ?office=B&office=A match the same rows, so they share a key."""
+    def value(v):
+        return str(sorted(set(v), key=str)) if isinstance(v, (list, tuple)) else str(v)
+
+    return urlencode(sorted((k, value(v)) for k, v in params.items() if v not in (None, "")))
+
+
+async def cached_response(request, conn, endpoint, scope, params, compute):
+    """Serve compute()'s JSON from the cache, with ETag / 304 support.
+
+    conn is the handler's async connection (the memory backend reads the
+    generation through it). params are the filters that shape the result
+    (see _filters_key()). When the cache backend fails, compute() is served
+    uncached.
+    """
+    filters = _filters_key(params)
+    key, entry = None, None
+    if response_cache.enabled:
+        try:
+            key, entry = await _lookup(conn, f"{endpoint}|{scope}|{filters}")
+        except Exception as e:
+            key = None
+            print(f"⚠️ Response cache unavailable: {e}")
+            if conn.info.transaction_status == TransactionStatus.INERROR:
+                await conn.rollback()
+        metrics.CACHE_LOOKUPS.labels("response", "miss" if entry is None else "hit").inc()
+
+    if entry is None:
+        body = dumps(await compute())
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        entry = (body, etag)
+        if key is not None:
+            try:
+                await response_cache.set(key, entry)
+            except Exception as e:
+                print(f"⚠️ Response cache unavailable: {e}")
+
+    body, etag = entry
+    # no-cache: the browser may keep the body but must revalidate each time
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
@@ -1,10 +1,178 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions, pool
 from dotenv import load_dotenv
+from fastapi import HTTPException
+
+import metrics
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Pool sizing is per process, and each web process has two pools: this one
+# for the sync handlers and async_db.py's for the async ones. Under gunicorn
+# the effective total is workers * (DB_POOL_MAX + ASYNC_DB_POOL_MAX), plus
+# the outbox / export workers, which must stay below Postgres
+# max_connections.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", "1"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "10"))
+# Seconds to wait for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Connections idle longer than this are pinged before being handed out.
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+
+
+class PoolTimeout(pool.PoolError):
+    pass
+
+
+class TimedCursor(extensions.cursor):
+    """Records every statement in the current request's metrics."""
+
+    def execute(self, query, vars=None):
+        with metrics.timed(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with metrics.timed(query):
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with metrics.timed(sql):
+            return super().copy_expert(sql, file, size)
+
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = None
+_last_used = {}
+
+
+def _get_pool():
+    """Return this process's pool, creating it on first use.
+
+    The pool is keyed by pid so a gunicorn worker forked from a master that
+    already touched the database never shares sockets with its parent.
+    """
+    global _pool, _pool_pid, _slots, _last_used
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = pool.ThreadedConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL, cursor_factory=TimedCursor
+            )
+            _pool_pid = pid
+            _slots = threading.BoundedSemaphore(DB_POOL_MAX)
+            _last_used = {}
+    return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    p = _get_pool()
+    slots = _slots
+
+    start = time.perf_counter()
+    acquired = slots.acquire(timeout=DB_POOL_TIMEOUT)
+    metrics.DB_POOL_WAIT_SECONDS.labels("sync").observe(time.perf_counter() - start)
+    if not acquired:
+        metrics.DB_POOL_TIMEOUTS.labels("sync").inc()
+        raise PoolTimeout(f"no database connection available after {DB_POOL_TIMEOUT}s")
+
+    try:
+        # Replace broken connections (server restart, idle timeout, ...)
+        # instead of handing them to a request.
+        for _ in range(DB_POOL_MAX + 1):
+            conn = p.getconn()
+            if _is_healthy(conn):
+                metrics.DB_POOL_IN_USE.labels("sync").inc()
+                return conn
+            _last_used.pop(id(conn), None)
+            p.putconn(conn, close=True)
+        raise pool.PoolError("could not obtain a healthy database connection")
+    except Exception:
+        slots.release()
+        raise
+
+
+def _checkin(conn):
+    p = _get_pool()
+    _last_used[id(conn)] = time.monotonic()
+    # putconn rolls back any open transaction and drops closed connections.
+    p.putconn(conn, close=conn.closed != 0)
+    _slots.release()
+    metrics.DB_POOL_IN_USE.labels("sync").dec()
+
+
+@contextmanager
 def get_db():
-    return psycopg2.connect(DATABASE_URL)
+    """Borrow a pooled connection; it is always returned to the pool.
+
+    An exception inside the block rolls back the open transaction.
+    """
+    conn = _checkout()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _checkin(conn)
+
+
+@contextmanager
+def request_db():
+    """get_db() inside a handler or dependency: no free connection -> 503.
+
+    For code that should hold a connection only around its queries, not for
+    the whole request (see get_current_user in main.py).
+    """
+    try:
+        with get_db() as conn:
+            yield conn
+    except PoolTimeout:
+        raise HTTPException(503, "Database busy, please retry")
+
+
+def db_conn():
+    """FastAPI dependency: one pooled connection shared by the whole request."""
+    with request_db() as conn:
+        yield conn
+
+
+def close_pool():
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
@@ -1,9 +1,82 @@
 import os
-import requests
 
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-FROM_EMAIL = os.getenv("SMTP_USER")  # verified sender email in SendGrid
+import jinja2
+from markupsafe import Markup, escape
 
+import mail_transport
+from approval_tokens import TOKEN_TTL_HOURS
+
+
+# ---------------- rendering ----------------
+# Templates live in templates/email/ and are compiled once per process (the
+# bytecode cache also spares new worker processes the compile). The page
+# shell does not depend on the expense, so it is rendered once, here, and
+# split around the title and body; each email only renders expenses.<fmt>,
+# once for all its expenses. .html templates autoescape every value, .txt
+# ones do not.
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+
+EXPENSE_FIELDS = [
+    ("Client", "client"),
+    ("Office", "office_name"),
+    ("Expense Date", "expense_date"),
+    ("Head", "head"),
+    ("Subhead", "subhead"),
+    ("From Location", "from_location"),
+    ("To Location", "to_location"),
+    ("Weight", "weight"),
+    ("Amount", "amount"),
+    ("AWB", "awb"),
+    ("Vehicle Type", "vehicle_type"),
+    ("Remark", "remark"),
+]
+
+_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+    autoescape=jinja2.select_autoescape(["html"]),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+_env.filters["dash"] = lambda value: "-" if value in (None, "") else value
+
+_TITLE = "\x00title\x00"
+_BODY = "\x00body\x00"
+
+
+def _shell(fmt):
+    """page.<fmt> rendered once -> (before title, between title and body, after body)."""
+    page = _env.get_template(f"page.{fmt}").render(
+        title=Markup(_TITLE), body=Markup(_BODY), ttl_hours=f"{TOKEN_TTL_HOURS:g}",
+    )
+    head, rest = page.split(_TITLE)
+    middle, tail = rest.split(_BODY)
+    return head, middle, tail
+
+
+_SHELLS = {fmt: _shell(fmt) for fmt in ("html", "txt")}
+_EXPENSES = {fmt: _env.get_template(f"expenses.{fmt}") for fmt in ("html", "txt")}
+
+
+def _page(fmt, title, items):
+    head, middle, tail = _SHELLS[fmt]
+    body = _EXPENSES[fmt].render(items=items)
+    return head + (str(escape(title)) if fmt == "html" else title) + middle + body + tail
+
+
+def render_email(title, items):
+    """(plain text, html) for an email listing items (see send_digest_email)."""
+    items = [
+        {**item, "rows": [(label, getattr(item["expense"], field, None)) for label, field in EXPENSE_FIELDS]}
+        for item in items
+    ]
+    return _page("txt", title, items), _page("html", title, items)
+
+
+# ---------------- sending ----------------
+# Delivery (SendGrid / SMTP / file sink, timeouts, rate limit, circuit
+# breaker) is mail_transport's job.
 
 def send_approval_email(
     to_emails,
@@ -13,104 +86,29 @@ def send_approval_email(
     submitted_by_name,
     submitted_by_email
 ):
-    if not SENDGRID_API_KEY:
-        raise RuntimeError("SENDGRID_API_KEY not set")
-
     subject = "Expense Approval Required"
 
-    def row(label, value):
-        return f"""
-        <tr>
-            <td style="padding:8px;border:1px solid #ddd;"><b>{label}</b></td>
-            <td style="padding:8px;border:1px solid #ddd;">{value if value not in (None, "") else "-"}</td>
-        </tr>
-        """
-
-    html_content = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; color: #333;">
-        <h2>New Expense Submitted</h2>
-
-        <p>
-            <b>Submitted by:</b> {submitted_by_name}<br>
-            <b>Email:</b> {submitted_by_email}
-        </p>
-
-        <table style="border-collapse: collapse; width: 100%; margin-top: 15px;">
-            {row("Client", expense.client)}
-            {row("Office", expense.office_name)}
-            {row("Expense Date", expense.expense_date)}
-            {row("Head", expense.head)}
-            {row("Subhead", expense.subhead)}
-            {row("From Location", expense.from_location)}
-            {row("To Location", expense.to_location)}
-            {row("Weight", expense.weight)}
-            {row("Amount", expense.amount)}
-            {row("AWB", expense.awb)}
-            {row("Vehicle Type", expense.vehicle_type)}
-            {row("Remark", expense.remark)}
-        </table>
-
-        <div style="margin-top: 25px;">
-            <a href="{approve_url}"
-               style="
-                   padding:10px 16px;
-                   background:#28a745;
-                   color:white;
-                   text-decoration:none;
-                   border-radius:5px;
-                   font-weight:bold;
-                   margin-right:10px;
-               ">
-                ✅ APPROVE
-            </a>
-
-            <a href="{reject_url}"
-               style="
-                   padding:10px 16px;
-                   background:#dc3545;
-                   color:white;
-                   text-decoration:none;
-                   border-radius:5px;
-                   font-weight:bold;
-               ">
-                ❌ REJECT
-            </a>
-        </div>
-
-        <p style="margin-top:20px; font-size:12px; color:#777;">
-            Note: This approval link is valid for 24 hours.
-        </p>
-    </body>
-    </html>
+    text_content, html_content = render_email("New Expense Submitted", [{
+        "expense": expense,
+        "approve_url": approve_url,
+        "reject_url": reject_url,
+        "submitted_by_name": submitted_by_name,
+        "submitted_by_email": submitted_by_email,
+    }])
+
+    mail_transport.send([list(to_emails)], subject, text_content, html_content)
+
+
+def send_digest_email(to_emails, items):
+    """Send one email listing several pending expenses to every admin.
+
+    Each item is a dict with approve_url, reject_url, expense,
+    submitted_by_name and submitted_by_email. The body is rendered once and
+    every admin gets their own copy; with SendGrid that costs
+    ceil(len(to_emails) / 1000) API calls regardless of len(items).
     """
+    subject = f"{len(items)} Expenses Awaiting Approval"
 
-    payload = {
-        "personalizations": [
-            {
-                "to": [{"email": e} for e in to_emails],
-                "subject": subject
-            }
-        ],
-        "from": {"email": FROM_EMAIL},
-        "content": [
-            {
-                "type": "text/html",
-                "value": html_content
-            }
-        ]
-    }
-
-    response = requests.post(
-        "https://api.sendgrid.com/v3/mail/send",
-        headers={
-            "Authorization": f"Bearer {SENDGRID_API_KEY}",
-            "Content-Type": "application/json"
-        },
-        json=payload
-    )
+    text_content, html_content = render_email(subject, items)
 
-    if response.status_code not in (200, 202):
-        raise RuntimeError(
-            f"SendGrid error: {response.status_code} {response.text}"
-        )
+    mail_transport.send([[e] for e in to_emails], subject, text_content, html_content)
@@ -0,0 +1,368 @@
+"""CSV / XLSX exports of reviewed expenses.
+
+Exports up to EXPORT_INLINE_MAX_ROWS rows, EXPORT_INLINE_MAX_XLSX_ROWS for
+XLSX (counted from the rollup, so the check is instant), are generated
+while the request waits: CSV streams straight out of a server-side cursor,
+XLSX is written to a temp file first.
+Bigger exports become a row in export_jobs. A separate process turns each
+job into a file under EXPORT_DIR:
+
+    python exports.py worker    # run export jobs as they are queued
+    python exports.py once      # run what is queued now and exit
+
+Every path reads rows EXPORT_FETCH_SIZE at a time through a named cursor,
+so memory stays flat however many rows match. EXPORT_DIR must be shared
+with the web workers that serve the downloads. Files and jobs are deleted
+after EXPORT_RETENTION_HOURS. Errors, such as the database restarting, are
+logged and retried with a growing delay, up to EXPORT_BACKOFF_MAX seconds.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import select
+import tempfile
+import time
+import uuid
+
+import psycopg2
+
+import queries
+from database import DATABASE_URL, get_db
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "expense-exports"))
+EXPORT_INLINE_MAX_ROWS = int(os.getenv("EXPORT_INLINE_MAX_ROWS", "50000"))
+# XLSX costs ~0.35 ms a row and blocks a web thread while it is written
+EXPORT_INLINE_MAX_XLSX_ROWS = int(os.getenv("EXPORT_INLINE_MAX_XLSX_ROWS", "5000"))
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "5000"))
+EXPORT_RETENTION_HOURS = float(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+EXPORT_POLL_INTERVAL = float(os.getenv("EXPORT_POLL_INTERVAL", "30"))
+# Longest wait between attempts while the database keeps failing
+EXPORT_BACKOFF_MAX = float(os.getenv("EXPORT_BACKOFF_MAX", "300"))
+
+NOTIFY_CHANNEL = "export_jobs"
+
+FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXPORT_STATUSES = ("approved", "rejected")
+
+# Excel stops at 1,048,576 rows per sheet; bigger exports get more sheets
+XLSX_SHEET_ROWS = 1_000_000
+
+COLUMNS = [
+    ("ID", "e.id"),
+    ("Status", "e.status"),
+    ("Expense Date", "e.expense_date"),
+    ("Client", "e.client"),
+    ("Office", "e.office_name"),
+    ("Head", "e.head"),
+    ("Subhead", "e.subhead"),
+    ("From Location", "e.from_location"),
+    ("To Location", "e.to_location"),
+    ("Weight", "e.weight"),
+    ("Amount", "e.amount"),
+    ("AWB", "e.awb"),
+    ("Vehicle Type", "e.vehicle_type"),
+    ("Remark", "e.remark"),
+    ("Submitted By", "u.name"),
+    ("Submitted By Email", "u.email"),
+    ("Submitted At", "e.created_at"),
+    ("Reviewed At", "e.reviewed_at"),
+]
+
+HEADERS = [h for h, _ in COLUMNS]
+
+# status: queued -> done | failed
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS export_jobs(
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    requested_by INT REFERENCES users(id),
+    format TEXT NOT NULL,
+    filters JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    row_count BIGINT,
+    file_path TEXT,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS export_jobs_queued_idx
+    ON export_jobs (created_at) WHERE status = 'queued';
+"""
+
+
+def _where(filters):
+    """queries.where(), limited to EXPORT_STATUSES unless a status is given.
+
+    The columns exist under the same names in expense_items and
+    expense_rollup, so one WHERE serves both.
+    """
+    return queries.where({**filters, "status": filters.get("status") or list(EXPORT_STATUSES)})
+
+
+def count_rows(cur, filters):
+    where, values = _where(filters)
+    cur.execute(f"SELECT COALESCE(SUM(cnt), 0) FROM expense_rollup WHERE {where}", values)
+    return cur.fetchone()[0]
+
+
+def rows_query(filters):
+    where, values = _where(filters)
+    return f"""
+        SELECT {", ".join(expr for _, expr in COLUMNS)}
+        FROM expense_items e
+        LEFT JOIN users u ON u.id = e.created_by
+        WHERE {where}
+        ORDER BY e.expense_date, e.id
+    """, values
+
+
+def iter_rows(conn, filters):
+    cur = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+    cur.itersize = EXPORT_FETCH_SIZE
+    try:
+        cur.execute(*rows_query(filters))
+        yield from cur
+    finally:
+        cur.close()
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_safe(row):
+    """Quote user text that a spreadsheet would take for a formula."""
+    return [
+        "'" + v if isinstance(v, str) and v.startswith(FORMULA_PREFIXES) else v
+        for v in row
+    ]
+
+
+def iter_csv(rows):
+    """Yield the CSV as byte chunks of roughly EXPORT_FETCH_SIZE rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HEADERS)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow(_csv_safe(row))
+        if i % EXPORT_FETCH_SIZE == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue().encode()
+
+
+def stream_csv(filters):
+    """iter_csv() over iter_rows() on a connection borrowed for the stream.
+
+    For StreamingResponse, as the stream's only connection. The first chunk
+    is empty and comes right after the checkout, so the caller can run the
+    generator that far before it commits to a 200.
+    """
+    with get_db() as conn:
+        yield b""
+        yield from iter_csv(iter_rows(conn, filters))
+
+
+def write_xlsx(path, rows):
+    import xlsxwriter
+
+    # constant_memory flushes each row to disk as soon as the next one starts.
+    # Text is always written as text: user input must never become a
+    # formula or a hyperlink.
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "default_date_format": "yyyy-mm-dd",
+        "remove_timezone": True,
+    })
+    sheet = None
+    line = XLSX_SHEET_ROWS
+
+    for row in rows:
+        if line == XLSX_SHEET_ROWS:
+            sheet = workbook.add_worksheet()
+            sheet.write_row(0, 0, HEADERS)
+            line = 0
+        line += 1
+        sheet.write_row(line, 0, row)
+
+    if sheet is None:
+        workbook.add_worksheet().write_row(0, 0, HEADERS)
+    workbook.close()
+
+
+def write_file(conn, fmt, filters, path):
+    """Write the export to path (atomically) and return the row count."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in iter_rows(conn, filters):
+            count += 1
+            yield row
+
+    tmp_path = f"{path}.part"
+    try:
+        if fmt == "xlsx":
+            write_xlsx(tmp_path, counted())
+        else:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter_csv(counted()):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return count
+
+
+def inline_max_rows(fmt):
+    return EXPORT_INLINE_MAX_XLSX_ROWS if fmt == "xlsx" else EXPORT_INLINE_MAX_ROWS
+
+
+# ---------------- jobs ----------------
+
+def create_job(cur, user_id, fmt, filters):
+    cur.execute("""
+        INSERT INTO export_jobs (requested_by, format, filters)
+        VALUES (%s, %s, %s::jsonb)
+        RETURNING id
+    """, (user_id, fmt, json.dumps(filters, default=str)))
+    job_id = cur.fetchone()[0]
+    cur.execute(f"NOTIFY {NOTIFY_CHANNEL}")
+    return job_id
+
+
+def run_next_job():
+    """Run the oldest queued job, if any. Returns False when none is queued.
+
+    The job row stays locked (SKIP LOCKED for other workers) until the file
+    is written; if this process dies the lock goes away and the job is
+    picked up again.
+    """
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, format, filters
+            FROM export_jobs
+            WHERE status = 'queued'
+            ORDER BY created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        job = cur.fetchone()
+        if not job:
+            conn.rollback()
+            cur.close()
+            return False
+
+        job_id, fmt, filters = job
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, f"{job_id}.{fmt}")
+
+        try:
+            with get_db() as data_conn:
+                count = write_file(data_conn, fmt, filters, path)
+                data_conn.rollback()
+        except Exception as e:
+            print(f"⚠️ Export job {job_id} failed:", e)
+            cur.execute("""
+                UPDATE export_jobs SET status = 'failed', error = %s, finished_at = clock_timestamp()
+                WHERE id = %s
+            """, (str(e), job_id))
+        else:
+            cur.execute("""
+                UPDATE export_jobs
+                SET status = 'done', row_count = %s, file_path = %s, finished_at = clock_timestamp()
+                WHERE id = %s
+            """, (count, path, job_id))
+
+        conn.commit()
+        cur.close()
+        return True
+
+
+def purge_expired():
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM export_jobs
+            WHERE created_at < NOW() - %s * interval '1 hour'
+              AND status <> 'queued'
+            RETURNING file_path
+        """, (EXPORT_RETENTION_HOURS,))
+        paths = [r[0] for r in cur.fetchall() if r[0]]
+        conn.commit()
+        cur.close()
+
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def listen():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+    cur.close()
+    return conn
+
+
+def run_worker():
+    listen_conn = None
+    failures = 0
+    try:
+        while True:
+            try:
+                if listen_conn is None:
+                    listen_conn = listen()
+                while run_next_job():
+                    pass
+                purge_expired()
+                if select.select([listen_conn], [], [], EXPORT_POLL_INTERVAL)[0]:
+                    listen_conn.poll()
+                    listen_conn.notifies.clear()
+                failures = 0
+            except Exception as e:
+                # e.g. the database restarting: wait, then listen again
+                failures += 1
+                delay = min(EXPORT_POLL_INTERVAL * 2 ** (failures - 1), EXPORT_BACKOFF_MAX)
+                print(f"⚠️ Export worker failed, retrying in {delay:g}s:", e)
+                if listen_conn is not None:
+                    listen_conn.close()
+                    listen_conn = None
+                time.sleep(delay)
+    finally:
+        if listen_conn is not None:
+            listen_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued expense export jobs")
+    parser.add_argument("command", choices=["worker", "once"])
+    args = parser.parse_args()
+
+    if args.command == "once":
+        while run_next_job():
+            pass
+        purge_expired()
+    else:
+        run_worker()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""JSON encoding for large row lists, without fastapi's jsonable_encoder.
+
+Rows straight from the database (dates, Decimals, str) are encoded with
+orjson when it is installed, in one native call instead of a Python-level
+walk over every field. Output matches jsonable_encoder's: Decimals become
+int or float the same way, dates ISO strings.
+
+Without orjson the stdlib json module is used with the same rules.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        # same rule as fastapi's decimal_encoder
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def rows_to_dicts(fields, rows):
+    """[(a, b), ...] -> [{"f1": a, "f2": b}, ...] with no per-value work."""
+    return [dict(zip(fields, r)) for r in rows]
+
+
+class FastJSONResponse(JSONResponse):
+    """Return this from a handler to bypass response_model validation and
+    jsonable_encoder for big payloads; the response_model still documents
+    the shape in OpenAPI."""
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,45 @@
+"""gunicorn settings: `gunicorn main:app -c gunicorn.conf.py`.
+
+Workers share PROMETHEUS_MULTIPROC_DIR so /metrics (metrics.py) reports
+the whole server, whichever worker answers the scrape.
+"""
+import glob
+import os
+import tempfile
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Must be in the environment before the workers import prometheus_client
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "expense-metrics")
+)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def on_starting(server):
+    # Counters left over from a previous run would be added to the new ones.
+    # Only the files of processes that are gone are removed: the outbox and
+    # export workers may share the directory and still have theirs open.
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for db_file in glob.glob(os.path.join(path, "*_*.db")):
+        pid = os.path.basename(db_file)[:-len(".db")].rsplit("_", 1)[1]
+        if pid.isdigit() and not _is_alive(int(pid)):
+            os.remove(db_file)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,157 @@
+"""Password hashing off the event loop.
+
+One bcrypt call costs ~250 ms of CPU at cost 12. The async handlers send
+them to a small process pool instead, so a burst of logins queues for the
+hashing processes while every other request keeps being served:
+
+    ok, new_hash = await hashing.verify_and_update_async(request, password, stored_hash)
+    stored_hash = await hashing.hash_password_async(request, password)
+
+Each web process gets HASH_WORKERS hashing processes (so gunicorn runs
+workers * HASH_WORKERS of them). At most HASH_QUEUE_MAX calls wait for
+them; beyond that the request gets 503 straight away. One client IP may
+have HASH_PER_IP calls in flight, more get 429. Behind a reverse proxy,
+list it in TRUSTED_PROXIES so the client address comes from
+X-Forwarded-For.
+
+A pool that loses a process (OOM kill...) is replaced and the call
+retried once, instead of failing every login until a restart.
+
+Hashes made with a different cost than BCRYPT_ROUNDS are replaced on the
+next successful login (verify_and_update_async() returns the new hash).
+
+This module is imported by the hashing processes, so it must stay light.
+"""
+import asyncio
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_MAX = int(os.getenv("HASH_QUEUE_MAX", "64"))
+HASH_PER_IP = int(os.getenv("HASH_PER_IP", "16"))
+# Comma-separated addresses of reverse proxies whose X-Forwarded-For is
+# believed; without it every login behind the proxy shares its address.
+TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip()}
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# ---------------- in-process (scripts, and the pool's workers) ----------------
+
+def hash_password(password):
+    return pwd_context.hash(password)
+
+
+def verify_password(password, hashed):
+    return pwd_context.verify(password, hashed)
+
+
+def verify_and_update(password, hashed):
+    """(matches, new hash or None when the stored one is fine)."""
+    return pwd_context.verify_and_update(password, hashed)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+# ---------------- process pool ----------------
+# Only touched from the event loop thread, so the counters need no lock.
+
+_executor = None
+_executor_pid = None
+_in_flight = 0
+_per_ip = defaultdict(int)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        # spawn, not fork: the web process has threads (DB pools, threadpool)
+        _executor = ProcessPoolExecutor(
+            HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        _executor_pid = pid
+    return _executor
+
+
+async def start():
+    """Start the hashing processes now rather than on the first login."""
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, _warm_up) for _ in range(HASH_WORKERS)
+    ))
+
+
+def _replace_broken(executor):
+    """Swap out a pool that lost a process (e.g. OOM-killed). Every call
+    in flight on it fails at once; only the first one replaces it."""
+    global _executor
+    if _executor is executor:
+        print("⚠️ Hashing process died, restarting the hashing pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown():
+    global _executor
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def client_ip(request):
+    """The caller's address: the nearest X-Forwarded-For hop that is not a
+    trusted proxy, when the request came through one."""
+    ip = request.client.host if request.client else "unknown"
+    if ip not in TRUSTED_PROXIES:
+        return ip
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if hop not in TRUSTED_PROXIES:
+            return hop
+    return ip
+
+
+async def _run(request, fn, *args):
+    global _in_flight
+
+    ip = client_ip(request)
+    if _per_ip[ip] >= HASH_PER_IP:
+        raise HTTPException(429, "Too many attempts at once, please retry", headers={"Retry-After": "1"})
+    if _in_flight >= HASH_WORKERS + HASH_QUEUE_MAX:
+        raise HTTPException(503, "Server busy, please retry", headers={"Retry-After": "1"})
+
+    _in_flight += 1
+    _per_ip[ip] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            _replace_broken(executor)
+            return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _in_flight -= 1
+        _per_ip[ip] -= 1
+        if not _per_ip[ip]:
+            del _per_ip[ip]
+
+
+async def hash_password_async(request, password):
+    return await _run(request, hash_password, password)
+
+
+async def verify_and_update_async(request, password, hashed):
+    return await _run(request, verify_and_update, password, hashed)
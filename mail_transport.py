@@ -0,0 +1,344 @@
+"""Mail transports: SendGrid, SMTP, or a local file sink.
+
+MAIL_BACKEND picks one per process:
+
+    MAIL_BACKEND=sendgrid   # default; SENDGRID_API_KEY, SENDGRID_API_URL
+    MAIL_BACKEND=smtp       # SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD
+    MAIL_BACKEND=file       # one .eml per email under MAIL_FILE_DIR (dev, tests)
+
+Every backend keeps its connection open between sends (a keep-alive
+requests.Session for SendGrid, one SMTP session), bounds each call with
+MAIL_CONNECT_TIMEOUT / MAIL_READ_TIMEOUT, and is shared by:
+
+- a rate limit of MAIL_RATE_LIMIT sends per second (0 = none), so a
+  backlog drains at a pace the provider accepts;
+- a circuit breaker: after MAIL_BREAKER_FAILURES provider failures in a
+  row, sends fail at once with CircuitOpen for MAIL_BREAKER_RESET seconds
+  instead of each waiting out its timeouts. Then one send is let through
+  to probe the provider.
+
+send() is the entry point (worker.py drains the outbox through it).
+"""
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "sendgrid")
+FROM_EMAIL = os.getenv("SMTP_USER")  # verified sender email in SendGrid
+
+MAIL_CONNECT_TIMEOUT = float(os.getenv("MAIL_CONNECT_TIMEOUT", "5"))
+MAIL_READ_TIMEOUT = float(os.getenv("MAIL_READ_TIMEOUT", os.getenv("SENDGRID_TIMEOUT", "10")))
+MAIL_RATE_LIMIT = float(os.getenv("MAIL_RATE_LIMIT", "0"))
+# max open connections to the provider, per process
+MAIL_MAX_CONNECTIONS = int(os.getenv("MAIL_MAX_CONNECTIONS", "4"))
+MAIL_BREAKER_FAILURES = int(os.getenv("MAIL_BREAKER_FAILURES", "5"))
+MAIL_BREAKER_RESET = float(os.getenv("MAIL_BREAKER_RESET", "30"))
+
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+# SendGrid accepts at most 1000 personalizations per request
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+
+MAIL_FILE_DIR = os.getenv("MAIL_FILE_DIR", os.path.join(tempfile.gettempdir(), "expense-mail"))
+
+
+class MailError(RuntimeError):
+    """The provider failed, or we cannot use it (missing key, login
+    refused...); counts towards opening the circuit."""
+
+
+class MailRejected(RuntimeError):
+    """The provider refused this message (bad address, 4xx API reply...);
+    sending it again will not help, and the provider itself is fine."""
+
+
+class CircuitOpen(MailError):
+    """Not sent: the provider failed repeatedly and is given a rest."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"mail provider unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# ---------------- rate limit / circuit breaker ----------------
+
+class RateLimiter:
+    """Token bucket: rate sends per second, bursts of up to one second's worth."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = max(rate, 1)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _wait_time(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while self.rate > 0 and (wait := self._wait_time()):
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, max_failures, reset_after):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        """Raise CircuitOpen while open; once reset_after has passed, let
+        one caller through (the probe) and keep the rest out."""
+        with self.lock:
+            if self.failures < self.max_failures:
+                return
+            now = time.monotonic()
+            if now < self.open_until:
+                metrics.EMAIL_SEND_FAILURES.labels("circuit_open").inc()
+                raise CircuitOpen(self.open_until - now)
+            self.open_until = now + self.reset_after
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures == self.max_failures:
+                print(f"⚠️ Mail provider failed {self.failures} times in a row, "
+                      f"pausing sends for {self.reset_after:g}s")
+            if self.failures >= self.max_failures:
+                self.open_until = time.monotonic() + self.reset_after
+
+
+# ---------------- backends ----------------
+# send_groups(groups, subject, text, html): one email per group, every
+# address of a group in its To. Raise MailError for provider or setup
+# trouble and MailRejected when the provider refuses the message itself.
+# send() counts anything but MailRejected as a provider failure.
+
+class SendGridTransport:
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=MAIL_MAX_CONNECTIONS, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {SENDGRID_API_KEY}"
+
+    def _payloads(self, groups, subject, text, html):
+        if not SENDGRID_API_KEY:
+            metrics.EMAIL_SEND_FAILURES.labels("not_configured").inc()
+            raise MailError("SENDGRID_API_KEY not set")
+        for i in range(0, len(groups), SENDGRID_MAX_PERSONALIZATIONS):
+            yield {
+                "personalizations": [
+                    {"to": [{"email": e} for e in group], "subject": subject}
+                    for group in groups[i:i + SENDGRID_MAX_PERSONALIZATIONS]
+                ],
+                "from": {"email": FROM_EMAIL},
+                # SendGrid wants text/plain before text/html
+                "content": [
+                    {"type": "text/plain", "value": text},
+                    {"type": "text/html", "value": html},
+                ],
+            }
+
+    @staticmethod
+    def _check(status, body):
+        if status in (200, 202):
+            return
+        metrics.EMAIL_SEND_FAILURES.labels(f"http_{status}").inc()
+        error = f"SendGrid error: {status} {body}"
+        # 429 / 5xx: the provider is struggling; other 4xx: this request is wrong
+        raise (MailError if status == 429 or status >= 500 else MailRejected)(error)
+
+    def send_groups(self, groups, subject, text, html):
+        for payload in self._payloads(groups, subject, text, html):
+            try:
+                response = self.session.post(
+                    SENDGRID_API_URL, json=payload,
+                    timeout=(MAIL_CONNECT_TIMEOUT, MAIL_READ_TIMEOUT),
+                )
+            except requests.RequestException as e:
+                metrics.EMAIL_SEND_FAILURES.labels(type(e).__name__).inc()
+                raise MailError(f"SendGrid unreachable: {e}") from e
+            self._check(response.status_code, response.text)
+
+
+def _message(group, subject, text, html):
+    msg = EmailMessage()
+    msg["From"] = FROM_EMAIL or "noreply@localhost"
+    msg["To"] = ", ".join(group)
+    msg["Subject"] = subject
+    msg.set_content(text)
+    msg.add_alternative(html, subtype="html")
+    return msg
+
+
+class SMTPTransport:
+    def __init__(self):
+        self.smtp = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """A logged-in session. A refusal here is about the server or our
+        configuration (bad credentials, STARTTLS not offered...), never
+        about a message, so it is always a MailError."""
+        smtp = None
+        try:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=MAIL_CONNECT_TIMEOUT)
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if FROM_EMAIL and SMTP_PASSWORD:
+                smtp.login(FROM_EMAIL, SMTP_PASSWORD)
+        except smtplib.SMTPResponseException as e:
+            if smtp is not None:
+                smtp.close()
+            metrics.EMAIL_SEND_FAILURES.labels(f"smtp_{e.smtp_code}").inc()
+            if 400 <= e.smtp_code < 500:
+                raise MailError(f"SMTP server busy: {e}") from e
+            raise MailError(f"SMTP session refused: {e}") from e
+        except smtplib.SMTPException as e:
+            if smtp is not None:
+                smtp.close()
+            metrics.EMAIL_SEND_FAILURES.labels(type(e).__name__).inc()
+            raise MailError(f"SMTP session refused: {e}") from e
+        except BaseException:
+            if smtp is not None:
+                smtp.close()
+            raise
+        # connected: from now on the socket timeout bounds each reply
+        smtp.sock.settimeout(MAIL_READ_TIMEOUT)
+        return smtp
+
+    def _close(self, quit=True):
+        # quit() leaves the socket open when the QUIT itself fails
+        try:
+            if quit:
+                self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            self.smtp.close()
+            self.smtp = None
+
+    def send_groups(self, groups, subject, text, html):
+        with self.lock:
+            for group in groups:
+                msg = _message(group, subject, text, html)
+                # a kept-alive session may have been dropped by the server
+                for retry in (True, False):
+                    try:
+                        if self.smtp is None:
+                            self.smtp = self._connect()
+                        self.smtp.send_message(msg)
+                        break
+                    except smtplib.SMTPServerDisconnected as e:
+                        if self.smtp is not None:
+                            self._close(quit=False)
+                        if not retry:
+                            raise MailError(f"SMTP server disconnected: {e}") from e
+                    except smtplib.SMTPRecipientsRefused as e:
+                        # every recipient refused; 4xx ones may pass later
+                        codes = [code for code, _ in e.recipients.values()]
+                        self._reply_error(min(codes), e)
+                    except smtplib.SMTPResponseException as e:
+                        self._reply_error(e.smtp_code, e)
+                    except smtplib.SMTPException as e:
+                        # e.g. the message needs SMTPUTF8 and the server lacks it
+                        raise MailRejected(f"SMTP cannot send the message: {e}") from e
+                    except OSError as e:
+                        metrics.EMAIL_SEND_FAILURES.labels(type(e).__name__).inc()
+                        if self.smtp is not None:
+                            self._close()
+                        raise MailError(f"SMTP unavailable: {e}") from e
+
+    def _reply_error(self, code, e):
+        """An SMTP error reply: 4xx is the server's trouble (421 also ends
+        the session), 5xx refuses this message only."""
+        metrics.EMAIL_SEND_FAILURES.labels(f"smtp_{code}").inc()
+        if 400 <= code < 500:
+            if code == 421 and self.smtp is not None:
+                self._close(quit=False)
+            raise MailError(f"SMTP server busy: {e}") from e
+        raise MailRejected(f"SMTP rejected the message: {e}") from e
+
+
+class FileTransport:
+    def send_groups(self, groups, subject, text, html):
+        os.makedirs(MAIL_FILE_DIR, exist_ok=True)
+        for group in groups:
+            path = os.path.join(MAIL_FILE_DIR, f"{time.time():.6f}-{uuid.uuid4().hex[:8]}.eml")
+            with open(path, "wb") as f:
+                f.write(_message(group, subject, text, html).as_bytes())
+
+
+BACKENDS = {
+    "sendgrid": SendGridTransport,
+    "smtp": SMTPTransport,
+    "file": FileTransport,
+}
+
+
+# ---------------- entry points ----------------
+
+_transport = None
+_transport_pid = None
+_limiter = RateLimiter(MAIL_RATE_LIMIT)
+_breaker = CircuitBreaker(MAIL_BREAKER_FAILURES, MAIL_BREAKER_RESET)
+
+
+def get_transport():
+    """This process's transport (connections are never shared across a fork)."""
+    global _transport, _transport_pid
+
+    pid = os.getpid()
+    if _transport is None or _transport_pid != pid:
+        if MAIL_BACKEND not in BACKENDS:
+            raise RuntimeError(f"MAIL_BACKEND must be one of {', '.join(BACKENDS)}")
+        _transport = BACKENDS[MAIL_BACKEND]()
+        _transport_pid = pid
+    return _transport
+
+
+def send(groups, subject, text, html):
+    """Send one email per recipient group (a list of addresses)."""
+    transport = get_transport()
+    _breaker.check()
+    _limiter.acquire()
+
+    start = time.perf_counter()
+    ok = False
+    try:
+        transport.send_groups(groups, subject, text, html)
+        ok = True
+    except MailRejected:
+        # the provider answered; the message itself was at fault
+        ok = True
+        raise
+    finally:
+        # always, so a half-open probe never leaves the circuit stuck open
+        _breaker.record(ok)
+        metrics.EMAIL_SEND_SECONDS.observe(time.perf_counter() - start)
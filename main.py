@@ -1,29 +1,68 @@
 from fastapi import FastAPI, HTTPException, Response
-from pydantic import BaseModel
-from database import get_db
-from auth import hash_password, verify_password, create_token
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from database import get_db, db_conn, request_db, close_pool, PoolTimeout
+import async_db
+from async_db import async_db_conn
+from auth import create_token
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from fastapi import Request, Depends
-from auth import decode_token
+from cache import (
+    cached_response, invalidate_responses, invalidate_responses_sync, role_scope, response_cache,
+)
+from auth import decode_token, user_cache, user_generation, cached_user, AUTH_CLAIMS_IN_TOKEN, GENERATION_SQL
 from pydantic import BaseModel
-from auth import hash_password
+import hashing
 import uuid
 from datetime import datetime, timedelta
-from email_utils import send_approval_email
+import base64
+import csv
+import io
+import itertools
+import json
+import psycopg
+import approval_tokens
+import outbox
+import exports
+import metrics
+import migrations
+import partitions
+import queries
 import os
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import tempfile
+from fast_json import FastJSONResponse, dumps as json_dumps, rows_to_dicts
+from schemas import (
+    BulkImportOut, BulkReviewOut, CacheStatsOut, DashboardSummaryOut, ExpensePageOut,
+    ExportJobOut, FiltersOut, KpisOut, MessageOut, PendingExpenseOut, PieSliceOut,
+    ReviewOut, TimeSeriesOut, UserOut,
+)
 
-BASE_URL = os.getenv("BASE_URL", "")
 ENV = os.getenv("ENV", "development")
 IS_PROD = ENV == "production"
 
+EXPENSES_PAGE_SIZE = int(os.getenv("EXPENSES_PAGE_SIZE", "50"))
+EXPENSES_MAX_PAGE_SIZE = int(os.getenv("EXPENSES_MAX_PAGE_SIZE", "500"))
+EXPENSES_STREAM_BATCH = int(os.getenv("EXPENSES_STREAM_BATCH", "1000"))
+BULK_IMPORT_MAX_ROWS = int(os.getenv("BULK_IMPORT_MAX_ROWS", "100000"))
+BULK_IMPORT_MAX_BYTES = int(os.getenv("BULK_IMPORT_MAX_BYTES", str(64 * 1024 * 1024)))
+BULK_IMPORT_MAX_ERRORS = 50
+
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.get("/")
 def root():
     return RedirectResponse(url="/static/login.html")
 
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
 class CreateUserIn(BaseModel):
     name: str
     email: str
@@ -45,68 +84,97 @@ class ExpenseIn(BaseModel):
     remark: str | None = None
     vehicle_type: str | None = None
 
-# Create users table
+# Heads that need from/to/weight/amount/AWB filled in
+DELIVERY_HEADS = ["Porter", "Urgent Delivery", "Pickup & Delivery","Connections"]
+
+# Create / migrate tables
 @app.on_event("startup")
 def create_tables():
-    conn = get_db()
-    cur = conn.cursor()
+    with get_db() as conn:
+        migrations.migrate(conn)
 
-    # Create users table (fresh DB)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-        id SERIAL PRIMARY KEY,
-        name TEXT,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL DEFAULT 'user'
-    )
-    """)
+        cur = conn.cursor()
+        partitions.ensure(cur)
+        conn.commit()
+        cur.close()
 
-    # 🔥 MIGRATION for existing DB (THIS WAS MISSING)
-    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS name TEXT")
-    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS role TEXT DEFAULT 'user'")
 
-    conn.commit()
-    cur.close()
-    conn.close()
+@app.on_event("startup")
+async def open_async_pool():
+    await async_db.open_pool()
+
+
+@app.on_event("startup")
+async def start_hashing():
+    await hashing.start()
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    await async_db.close_pool()
+    close_pool()
+    hashing.shutdown()
 
 
 class User(BaseModel):
     email: str
     password: str
 
-@app.post("/register")
-def register(user: User):
-    conn = get_db()
-    cur = conn.cursor()
+# register / login / create-user are async so bcrypt runs in the hashing
+# process pool (hashing.py) instead of holding a threadpool thread. They
+# borrow a connection only around their queries: a login waiting its turn
+# for a hashing process must not sit on one.
 
-    cur.execute("SELECT id FROM users WHERE email=%s", (user.email,))
-    if cur.fetchone():
+@app.post("/register", response_model=MessageOut)
+async def register(user: User, request: Request):
+    async with async_db.request_db() as conn:
+        exists = await async_db.fetchone(conn, "SELECT id FROM users WHERE email=%s", (user.email,))
+    if exists:
         raise HTTPException(400, "User exists")
 
-    cur.execute("""
-        INSERT INTO users (name, email, password, role)
-        VALUES (%s, %s, %s, %s)
-    """, (user.email.split("@")[0], user.email, hash_password(user.password), "user"))
-
+    hashed = await hashing.hash_password_async(request, user.password)
+
+    async with async_db.request_db() as conn:
+        user_id = await async_db.fetchval(conn, """
+            INSERT INTO users (name, email, password, role)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id
+        """, (user.email.split("@")[0], user.email, hashed, "user"))
+        await conn.commit()
+    if user_id is None:
+        raise HTTPException(400, "User exists")
 
-    conn.commit()
-    cur.close()
-    conn.close()
     return {"msg": "User created"}
 
-@app.post("/login")
-def login(user: User, response: Response):
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id,password FROM users WHERE email=%s", (user.email,))
-    row = cur.fetchone()
+@app.post("/login", response_model=MessageOut)
+async def login(user: User, request: Request, response: Response):
+    async with async_db.request_db() as conn:
+        row = await async_db.fetchone(conn, f"""
+            SELECT id, password, name, email, role, ({GENERATION_SQL})
+            FROM users WHERE email=%s
+        """, (user.email,))
+    if not row:
+        raise HTTPException(401, "Invalid credentials")
 
-    if not row or not verify_password(user.password, row[1]):
+    ok, new_hash = await hashing.verify_and_update_async(request, user.password, row[1])
+    if not ok:
         raise HTTPException(401, "Invalid credentials")
 
-    token = create_token({"user_id": row[0]})
+    if new_hash:
+        # Stored with another cost than BCRYPT_ROUNDS; unless the password
+        # changed meanwhile, keep the rehashed one
+        async with async_db.request_db() as conn:
+            await async_db.execute(
+                conn, "UPDATE users SET password=%s WHERE id=%s AND password=%s",
+                (new_hash, row[0], row[1]),
+            )
+            await conn.commit()
+
+    claims = {"user_id": row[0]}
+    if AUTH_CLAIMS_IN_TOKEN:
+        claims.update({"name": row[2], "email": row[3], "role": row[4], "gen": row[5]})
+
+    token = create_token(claims)
     response.set_cookie(
         key="access_token",
         value=token,
@@ -119,7 +187,7 @@ def login(user: User, response: Response):
     return {"msg": "Login success"}
 
 
-def get_current_user(request: Request):
+def _token_payload(request: Request):
     token = request.cookies.get("access_token")
 
     if not token:
@@ -129,62 +197,137 @@ def get_current_user(request: Request):
     if not payload:
         raise HTTPException(401, "Invalid token")
 
-    user_id = payload.get("user_id")
+    return payload
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id,name,email,role FROM users WHERE id=%s", (user_id,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
 
+def _user_dict(user, generation):
     if not user:
         raise HTTPException(401, "User not found")
 
-    return {"id": user[0], "name": user[1],"email": user[2], "role": user[3]}
+    user = {"id": user[0], "name": user[1],"email": user[2], "role": user[3]}
+    user_cache.set((generation, user["id"]), user)
+    return user
+
+
+def _cached_user(payload):
+    """The user behind a token without touching the database, or None when
+    this process's users generation is due for a re-read or the user is not
+    cached under it."""
+    if user_generation.stale():
+        return None
+    return cached_user(payload, user_generation.value)
+
+
+# No db_conn: a cache hit needs no connection, and a miss borrows one just
+# for its lookup instead of for the whole request (a streamed response
+# would otherwise keep it until the last byte is sent).
+
+def get_current_user(request: Request):
+    payload = _token_payload(request)
+    user = _cached_user(payload)
+    if user:
+        return user
+
+    with request_db() as conn:
+        cur = conn.cursor()
+        if user_generation.stale():
+            cur.execute(GENERATION_SQL)
+            user_generation.update(cur.fetchone()[0])
+        generation = user_generation.value
+
+        user = cached_user(payload, generation)
+        if not user:
+            cur.execute("SELECT id,name,email,role FROM users WHERE id=%s", (payload.get("user_id"),))
+            user = _user_dict(cur.fetchone(), generation)
+        cur.close()
+
+    return user
+
+
+async def get_current_user_async(request: Request):
+    payload = _token_payload(request)
+    user = _cached_user(payload)
+    if user:
+        return user
+
+    async with async_db.request_db() as conn:
+        if user_generation.stale():
+            user_generation.update((await async_db.read(conn, GENERATION_SQL))[0][0])
+        generation = user_generation.value
+
+        user = cached_user(payload, generation)
+        if user:
+            return user
+
+        rows = await async_db.read(
+            conn, "SELECT id,name,email,role FROM users WHERE id=%s", (payload.get("user_id"),)
+        )
+
+    return _user_dict(rows[0] if rows else None, generation)
 
-@app.get("/me")
-def read_me(current_user=Depends(get_current_user)):
+@app.get("/me", response_model=UserOut)
+async def read_me(current_user=Depends(get_current_user_async)):
     return current_user
 
-@app.post("/api/admin/create-user")
-def create_user(data: CreateUserIn, current_user=Depends(get_current_user)):
+@app.get("/api/admin/cache-stats", response_model=CacheStatsOut)
+def cache_stats(current_user=Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conn = get_db()
-    cur = conn.cursor()
+    return {
+        "user_cache": user_cache.stats(),
+        "response_cache": response_cache.stats(),
+    }
 
-    cur.execute("SELECT id FROM users WHERE email=%s", (data.email,))
-    if cur.fetchone():
-        raise HTTPException(400, "User already exists")
+@app.post("/api/admin/create-user", response_model=MessageOut)
+async def create_user(
+    data: CreateUserIn,
+    request: Request,
+    current_user=Depends(get_current_user_async)
+):
+    if current_user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
 
-    cur.execute("""
-        INSERT INTO users (name,email,password,role)
-        VALUES (%s,%s,%s,%s)
-    """, (data.name,data.email, hash_password(data.password), data.role))
+    async with async_db.request_db() as conn:
+        exists = await async_db.fetchone(conn, "SELECT id FROM users WHERE email=%s", (data.email,))
+    if exists:
+        raise HTTPException(400, "User already exists")
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    hashed = await hashing.hash_password_async(request, data.password)
+
+    async with async_db.request_db() as conn:
+        user_id = await async_db.fetchval(conn, """
+            INSERT INTO users (name,email,password,role)
+            VALUES (%s,%s,%s,%s)
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id
+        """, (data.name, data.email, hashed, data.role))
+        # users_bump_generation (auth.py): every worker's user cache drops
+        # this generation within USER_GENERATION_INTERVAL
+        await conn.commit()
+    if user_id is None:
+        raise HTTPException(400, "User already exists")
 
     return {"msg": "User created successfully"}
 
-@app.post("/api/expenses/submit")
-def submit_expense(data: ExpenseIn, current_user=Depends(get_current_user)):
+@app.post("/api/expenses/submit", response_model=MessageOut)
+async def submit_expense(
+    data: ExpenseIn,
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
+):
 
-    if data.head in ["Porter", "Urgent Delivery", "Pickup & Delivery","Connections"]:
+    if data.head in DELIVERY_HEADS:
         if not all([data.from_location, data.to_location, data.weight, data.amount, data.awb]):
             raise HTTPException(
                 400,
                 "From, To, Weight, Amount and AWB are mandatory for this expense type"
             )
 
-    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("""
-        INSERT INTO pending_expenses (
+    await cur.execute("""
+        INSERT INTO expense_items (
           expense_date, client, office_name, head, subhead,
           from_location, to_location, weight, amount, awb,
           remark, vehicle_type, created_by
@@ -207,596 +350,1086 @@ def submit_expense(data: ExpenseIn, current_user=Depends(get_current_user)):
         current_user["id"]
     ))
 
-    pending_id = cur.fetchone()[0]
+    pending_id = (await cur.fetchone())[0]
+
+    token = await create_approval_token(cur, pending_id)
+
+    # Delivered by worker.py once this transaction commits
+    await outbox.enqueue_async(cur, outbox.APPROVAL_EMAIL, {
+        "pending_id": pending_id,
+        "token": token,
+        "expense": data.model_dump(),
+        "submitted_by_name": current_user["name"],
+        "submitted_by_email": current_user["email"],
+    })
+
+    await conn.commit()
+    await invalidate_responses(conn)
+    await cur.close()
+
+    return {"msg": "Expense submitted for approval"}
 
-    approve_token = create_approval_token(cur, pending_id, "approve")
-    reject_token  = create_approval_token(cur, pending_id, "reject")
 
-    # ---------------- MAIL TRIGGER ----------------
-    cur.execute("""
-        SELECT email FROM users
-        WHERE role = 'admin'
-    """)
-    emails = [r[0] for r in cur.fetchall()]
 
-    approve_url = f"{BASE_URL}/review/approve/{approve_token}"
-    reject_url  = f"{BASE_URL}/review/reject/{reject_token}"
+async def create_approval_token(cur, pending_id: int):
+    """One token for both the approve and the reject link."""
+    token = approval_tokens.new_token()
 
+    await cur.execute(approval_tokens.INSERT_SQL, (token, pending_id, approval_tokens.TOKEN_TTL_HOURS))
 
+    return approval_tokens.encode(token)
+
+
+# ===================== BULK IMPORT =====================
+
+EXPENSE_COLUMNS = list(ExpenseIn.model_fields)
+_expense_list = TypeAdapter(list[ExpenseIn])
+
+
+def _parse_bulk_body(body: bytes, content_type: str):
     try:
-        send_approval_email(
-            emails,
-            approve_url,
-            reject_url,
-            data,
-            submitted_by_name=current_user["name"],
-            submitted_by_email=current_user["email"]
-        )
-    except Exception as e:
-        print("⚠️ Approval email failed:", e)
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(400, "Upload must be UTF-8")
+
+    # one row past the cap is enough to refuse the upload
+    if "csv" in content_type:
+        # blank spreadsheet cells mean "not set", like a missing JSON field
+        return [
+            {k: (v if v != "" else None) for k, v in row.items() if k is not None}
+            for row in itertools.islice(csv.DictReader(io.StringIO(text)), BULK_IMPORT_MAX_ROWS + 1)
+        ]
+
+    if "ndjson" in content_type or "jsonl" in content_type:
+        lines = (line for line in text.splitlines() if line.strip())
+        try:
+            return [json.loads(line) for line in itertools.islice(lines, BULK_IMPORT_MAX_ROWS + 1)]
+        except ValueError as e:
+            raise HTTPException(400, f"Invalid NDJSON: {e}")
+
+    raise HTTPException(415, "Send text/csv or application/x-ndjson")
+
+
+def _validate_bulk(rows):
+    """Validate every row and report errors for the whole batch at once."""
+    try:
+        expenses = _expense_list.validate_python(rows)
+    except ValidationError as e:
+        raise HTTPException(422, [
+            {"row": err["loc"][0] + 1, "field": ".".join(map(str, err["loc"][1:])), "error": err["msg"]}
+            for err in e.errors()[:BULK_IMPORT_MAX_ERRORS]
+        ])
+
+    missing = [
+        {"row": i, "error": "From, To, Weight, Amount and AWB are mandatory for this expense type"}
+        for i, e in enumerate(expenses, 1)
+        if e.head in DELIVERY_HEADS
+        and not all([e.from_location, e.to_location, e.weight, e.amount, e.awb])
+    ]
+    if missing:
+        raise HTTPException(422, missing[:BULK_IMPORT_MAX_ERRORS])
 
-    # ------------------------------------------------
+    return expenses
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
-    return {"msg": "Expense submitted for approval"}
+async def _read_bulk_body(request):
+    """The upload, refused with 413 as soon as it passes BULK_IMPORT_MAX_BYTES."""
+    too_big = HTTPException(413, f"Upload larger than {BULK_IMPORT_MAX_BYTES} bytes")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > BULK_IMPORT_MAX_BYTES:
+        raise too_big
 
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > BULK_IMPORT_MAX_BYTES:
+            raise too_big
+    return bytes(body)
 
 
-def create_approval_token(cur, pending_id: int, action: str):
-    token = str(uuid.uuid4())
-    expires = datetime.utcnow() + timedelta(hours=24)
+def _prepare_bulk(body, content_type):
+    """Upload -> COPY rows. CPU-bound (~0.6 s per 100k rows), so the async
+    handler runs it in the threadpool rather than on the event loop."""
+    rows = _parse_bulk_body(body, content_type)
+
+    if not rows:
+        raise HTTPException(400, "No rows in upload")
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(413, f"At most {BULK_IMPORT_MAX_ROWS} rows per upload")
+
+    return [
+        (i, *(getattr(e, c) for c in EXPENSE_COLUMNS))
+        for i, e in enumerate(_validate_bulk(rows), 1)
+    ]
 
-    cur.execute("""
-        INSERT INTO approval_tokens (token, pending_id, action, expires_at)
-        VALUES (%s,%s,%s,%s)
-    """, (token, pending_id, action, expires))
 
-    return token
+# Moves the staged rows into expense_items (as pending) and creates their approval
+# tokens and outbox emails in one statement.
+_BULK_MOVE_SQL = f"""
+WITH moved AS (
+    INSERT INTO expense_items ({", ".join(EXPENSE_COLUMNS)}, created_by)
+    SELECT {", ".join(EXPENSE_COLUMNS)}, %(user_id)s
+    FROM bulk_expenses
+    RETURNING id, {", ".join(EXPENSE_COLUMNS)},
+              uuid_send(gen_random_uuid()) AS token
+),
+token_rows AS (
+    INSERT INTO approval_tokens (token, pending_id, expires_at)
+    SELECT token, id, {approval_tokens.NOW_UTC} + %(token_ttl)s * interval '1 hour'
+    FROM moved
+)
+INSERT INTO email_outbox (kind, payload)
+SELECT %(kind)s, jsonb_build_object(
+    'pending_id', id,
+    -- approval_tokens.encode(): base64url without padding
+    'token', rtrim(translate(encode(token, 'base64'), '+/', '-_'), '='),
+    'expense', jsonb_build_object({", ".join(f"'{c}', {c}" for c in EXPENSE_COLUMNS)}),
+    'submitted_by_name', %(name)s::text,
+    'submitted_by_email', %(email)s::text
+)
+FROM moved
+"""
+
+
+@app.post("/api/expenses/bulk", response_model=BulkImportOut)
+async def bulk_submit_expenses(
+    request: Request,
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
+):
+    """Submit many expenses from a CSV (header row = ExpenseIn fields) or
+    NDJSON upload of at most BULK_IMPORT_MAX_BYTES / BULK_IMPORT_MAX_ROWS.
+    All rows are validated first; nothing is stored unless every row is
+    valid."""
+    rows = await run_in_threadpool(
+        _prepare_bulk, await _read_bulk_body(request), request.headers.get("content-type", "")
+    )
+
+    cur = conn.cursor()
+
+    # Staging table has the target's column types, so COPY does the parsing
+    await cur.execute("""
+        CREATE TEMP TABLE bulk_expenses (LIKE expense_items INCLUDING DEFAULTS)
+        ON COMMIT DROP
+    """)
+    try:
+        async with cur.copy(
+            f"COPY bulk_expenses (id, {', '.join(EXPENSE_COLUMNS)}) FROM STDIN"
+        ) as copy:
+            for row in rows:
+                await copy.write_row(row)
+    except psycopg.DataError as e:
+        raise HTTPException(422, f"Invalid value: {e.diag.message_primary} ({e.diag.context})")
+
+    await cur.execute(_BULK_MOVE_SQL, {
+        "user_id": current_user["id"],
+        "token_ttl": approval_tokens.TOKEN_TTL_HOURS,
+        "kind": outbox.APPROVAL_EMAIL,
+        "name": current_user["name"],
+        "email": current_user["email"],
+    })
+    count = cur.rowcount
+    await cur.execute(f"NOTIFY {outbox.NOTIFY_CHANNEL}")
+
+    await conn.commit()
+    await invalidate_responses(conn)
+    await cur.close()
+
+    return {"msg": f"{count} expenses submitted for approval", "count": count}
 
 
 # ===================== NEW APPROVAL LOGIC =====================
 
-def validate_token(cur, token: str, action: str):
-    cur.execute("""
-        SELECT id, pending_id, is_used, expires_at
-        FROM approval_tokens
-        WHERE token=%s AND action=%s
-    """, (token, action))
+# One statement per click: find the token, lock its expense, flip the
+# expense if it is still pending and the token is live, and mark every
+# token of that expense used (so the sibling approve/reject link dies too).
+# The expense row is locked before any token row, like _review_pending(),
+# so approve and reject clicked at once queue on it instead of
+# deadlocking; the loser sees the status the winner set.
+_REVIEW_BY_TOKEN_SQL = f"""
+WITH tok AS (
+    SELECT pending_id, used_at IS NOT NULL AS is_used,
+           expires_at <= {approval_tokens.NOW_UTC} AS expired
+    FROM approval_tokens
+    WHERE token = %(token)s AND (action IS NULL OR action = %(action)s)
+),
+item AS (
+    SELECT e.id, e.status
+    FROM expense_items e JOIN tok ON e.id = tok.pending_id
+    FOR UPDATE OF e
+),
+reviewed AS (
+    UPDATE expense_items e
+    SET status = %(status)s, reviewed_at = NOW()
+    FROM item, tok
+    WHERE e.id = item.id AND item.status = 'pending'
+      AND NOT tok.is_used AND NOT tok.expired
+    RETURNING e.id
+),
+used AS (
+    UPDATE approval_tokens SET used_at = {approval_tokens.NOW_UTC}
+    WHERE pending_id IN (SELECT id FROM reviewed) AND used_at IS NULL
+)
+SELECT tok.is_used, tok.expired, item.status, EXISTS (SELECT 1 FROM reviewed)
+FROM tok LEFT JOIN item ON true
+"""
+
+
+async def _review_by_token(conn, token: str, action: str):
+    """Apply an email link. Clicking it again, or after someone else made
+    the same decision, answers the same; only a conflicting decision or a
+    dead token is an error."""
+    status = REVIEW_STATUSES[action]
+
+    token = approval_tokens.decode(token)
+    if token is None:
+        raise HTTPException(400, "Invalid token")
+
+    row = await async_db.fetchone(
+        conn, _REVIEW_BY_TOKEN_SQL, {"token": token, "action": action, "status": status}
+    )
+    await conn.commit()
 
-    row = cur.fetchone()
     if not row:
         raise HTTPException(400, "Invalid token")
 
-    token_id, pending_id, is_used, expires_at = row
-    if is_used:
-        raise HTTPException(400, "Token already used")
-    if datetime.utcnow() > expires_at:
+    is_used, expired, current_status, changed = row
+    if changed:
+        await invalidate_responses(conn)
+        return {"status": status}
+    if current_status == status:
+        return {"status": status}
+    if current_status is None:
+        raise HTTPException(404, "Expense not found")
+    if current_status != "pending":
+        raise HTTPException(409, f"Expense already {current_status}")
+    if expired:
         raise HTTPException(400, "Token expired")
+    raise HTTPException(400, "Token already used")
 
-    return token_id, pending_id
 
+# Async: when many clicks queue on one expense's row lock, sync handlers
+# waiting for a pooled connection would fill the threadpool and starve the
+# ones trying to hand their connection back.
 
-@app.get("/review/approve/{token}")
-def approve_expense(token: str):
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        token_id, pending_id = validate_token(cur, token, "approve")
-
-        cur.execute("SELECT * FROM pending_expenses WHERE id=%s", (pending_id,))
-        row = cur.fetchone()
-        cols = [d[0] for d in cur.description]
-        data = dict(zip(cols, row))
-
-        cur.execute("""
-            INSERT INTO expenses (expense_date,client,office_name,head,subhead,
-            from_location,to_location,weight,amount,awb,remark,vehicle_type,created_by)
-            VALUES (%(expense_date)s,%(client)s,%(office_name)s,%(head)s,%(subhead)s,
-                    %(from_location)s,%(to_location)s,%(weight)s,%(amount)s,%(awb)s,
-                    %(remark)s,%(vehicle_type)s,%(created_by)s)
-        """, data)
-
-        cur.execute("DELETE FROM pending_expenses WHERE id=%s", (pending_id,))
-        cur.execute("UPDATE approval_tokens SET is_used=true, used_at=NOW() WHERE id=%s", (token_id,))
-        conn.commit()
-        return {"status": "approved"}
-    except:
-        conn.rollback()
-        raise
+@app.get("/review/approve/{token}", response_model=ReviewOut)
+async def approve_expense(token: str, conn=Depends(async_db_conn)):
+    return await _review_by_token(conn, token, "approve")
 
 
-@app.get("/review/reject/{token}")
-def reject_expense(token: str):
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        token_id, pending_id = validate_token(cur, token, "reject")
-
-        cur.execute("SELECT * FROM pending_expenses WHERE id=%s", (pending_id,))
-        row = cur.fetchone()
-        cols = [d[0] for d in cur.description]
-        data = dict(zip(cols, row))
-
-        cur.execute("""
-            INSERT INTO rejected_expenses (expense_date,client,office_name,head,subhead,
-            from_location,to_location,weight,amount,awb,remark,vehicle_type,created_by)
-            VALUES (%(expense_date)s,%(client)s,%(office_name)s,%(head)s,%(subhead)s,
-                    %(from_location)s,%(to_location)s,%(weight)s,%(amount)s,%(awb)s,
-                    %(remark)s,%(vehicle_type)s,%(created_by)s)
-        """, data)
-
-        cur.execute("DELETE FROM pending_expenses WHERE id=%s", (pending_id,))
-        cur.execute("UPDATE approval_tokens SET is_used=true, used_at=NOW() WHERE id=%s", (token_id,))
-        conn.commit()
-        return {"status": "rejected"}
-    except:
-        conn.rollback()
-        raise
-
-@app.get("/api/dashboard/kpis")
-def dashboard_kpis(
-    user: str | None = None,
-    office: str | None = None,
-    head: str | None = None,
-    subhead: str | None = None,
-    date: str | None = None,
-    current_user=Depends(get_current_user)
+@app.get("/review/reject/{token}", response_model=ReviewOut)
+async def reject_expense(token: str, conn=Depends(async_db_conn)):
+    return await _review_by_token(conn, token, "reject")
+
+@app.get("/api/dashboard/kpis", response_model=KpisOut)
+async def dashboard_kpis(
+    request: Request,
+    filters=Depends(queries.dashboard_filters),
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
 ):
-    conn = get_db()
-    cur = conn.cursor()
+    # Non-admins always see their own totals; only the dates are theirs to pick
+    filters = queries.scoped(filters, current_user)
 
-    conditions = []
-    values = []
+    return await cached_response(
+        request, conn, "kpis", role_scope(current_user), filters,
+        lambda: _dashboard_kpis(conn, filters)
+    )
 
-    if current_user["role"] == "admin":
-        # Apply filters ONLY for admin
-        if user not in (None, ""):
-            conditions.append("created_by = %s")
-            values.append(int(user))
 
-        if office not in (None, ""):
-            conditions.append("office_name = %s")
-            values.append(office)
+# Each dashboard part is a (sql, values) builder plus a function shaping the
+# rows, so /api/dashboard/summary can pipeline several of them at once.
 
-        if head not in (None, ""):
-            conditions.append("head = %s")
-            values.append(head)
+def _kpis_query(filters):
+    where, values = queries.where(filters)
 
-        if subhead not in (None, ""):
-            conditions.append("subhead = %s")
-            values.append(subhead)
+    # All five numbers from the rollup in one round trip
+    return f"""
+        SELECT
+            COALESCE(SUM(total) FILTER (WHERE status = 'approved'), 0),
+            COALESCE(SUM(cnt), 0),
+            COALESCE(SUM(cnt) FILTER (WHERE status = 'approved'), 0),
+            COALESCE(SUM(cnt) FILTER (WHERE status = 'rejected'), 0),
+            COALESCE(SUM(cnt) FILTER (WHERE status = 'pending'), 0)
+        FROM expense_rollup
+        WHERE {where}
+    """, values
 
-        if date not in (None, ""):
-            conditions.append("expense_date = %s")
-            values.append(date)
-    else:
-        # Normal user → always own data
-        conditions.append("created_by = %s")
-        values.append(current_user["id"])
-
-    where_clause = ""
-    if conditions:
-        where_clause = "WHERE " + " AND ".join(conditions)
-
-    # Approved amount
-    cur.execute(f"""
-        SELECT COALESCE(SUM(amount),0)
-        FROM expenses
-        {where_clause}
-    """, values)
-    total_expense = cur.fetchone()[0]
-
-    # Pending count
-    cur.execute(f"""
-        SELECT COUNT(*)
-        FROM pending_expenses
-        {where_clause}
-    """, values)
-    total_pending = cur.fetchone()[0]
-
-    # Approved count
-    cur.execute(f"""
-        SELECT COUNT(*)
-        FROM expenses
-        {where_clause}
-    """, values)
-    total_approved = cur.fetchone()[0]
-
-    # Rejected count
-    cur.execute(f"""
-        SELECT COUNT(*)
-        FROM rejected_expenses
-        {where_clause}
-    """, values)
-    total_rejected = cur.fetchone()[0]
 
-    cur.close()
-    conn.close()
+def _kpis_result(rows):
+    [(total_expense, total_uploaded, total_approved, total_rejected, total_pending)] = rows
 
     return {
         "total_expense": total_expense,
-        "total_uploaded": total_pending + total_approved + total_rejected,
+        "total_uploaded": total_uploaded,
         "total_approved": total_approved,
         "total_rejected": total_rejected,
         "total_pending": total_pending
     }
 
 
-@app.get("/api/dashboard/expenses/{status}")
-def user_expenses(status: str, current_user=Depends(get_current_user)):
-    conn = get_db()
-    cur = conn.cursor()
+async def _dashboard_kpis(conn, filters):
+    return _kpis_result(await async_db.read(conn, *_kpis_query(filters)))
+
+
+EXPENSE_STATUSES = ("approved", "pending", "rejected")
+
+
+def _encode_cursor(expense_date, expense_id):
+    raw = json.dumps([expense_date.isoformat() if expense_date else None, expense_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
 
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        expense_date, expense_id = json.loads(raw)
+        return (datetime.fromisoformat(expense_date).date() if expense_date else None), int(expense_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
+EXPENSE_ROW_FIELDS = ("date", "head", "subhead", "amount")
+
+
+def _started(stream):
+    """Run a streaming generator to its first (empty) chunk, which it yields
+    once it has borrowed its connection, so a busy pool is a 503 from the
+    handler rather than a broken body after the 200 went out."""
+    try:
+        next(stream)
+    except PoolTimeout:
+        raise HTTPException(503, "Database busy, please retry")
+    return stream
+
+
+def _stream_expenses(status, user_id):
+    # Named cursor: rows stay on the server and arrive itersize at a time.
+    # The generator holds the stream's only connection; the handler has
+    # none of its own (see get_current_user).
+    with get_db() as conn:
+        yield b""
+        cur = conn.cursor(name=f"user_expenses_{uuid.uuid4().hex}")
+        cur.itersize = EXPENSES_STREAM_BATCH
+        try:
+            cur.execute("""
+                SELECT expense_date, head, subhead, amount
+                FROM expense_items
+                WHERE created_by = %s AND status = %s
+                ORDER BY expense_date DESC, id DESC
+            """, (user_id, status))
+            for r in cur:
+                yield json_dumps(dict(zip(EXPENSE_ROW_FIELDS, r))) + b"\n"
+        finally:
+            cur.close()
+
+
+@app.get("/api/dashboard/expenses/{status}", response_model=ExpensePageOut)
+def user_expenses(
+    status: str,
+    cursor: str | None = None,
+    limit: int = EXPENSES_PAGE_SIZE,
+    format: str = "json",
+    current_user=Depends(get_current_user)
+):
+    """Newest first, keyset-paginated on (expense_date, id).
+
+    Returns {"items": [...], "next_cursor": ...}; pass next_cursor back as
+    ?cursor= for the next page, it is null on the last one. ?format=ndjson
+    streams every row instead, one JSON object per line.
+    """
     user_id = current_user["id"]
 
-    if status == "approved":
-        table = "expenses"
-    elif status == "pending":
-        table = "pending_expenses"
-    elif status == "rejected":
-        table = "rejected_expenses"
-    else:
+    if status not in EXPENSE_STATUSES:
         raise HTTPException(400, "Invalid status")
 
-    cur.execute(f"""
-        SELECT expense_date, head, subhead, amount
-        FROM {table}
-        WHERE created_by = %s
-        ORDER BY expense_date DESC
-    """, (user_id,))
+    if format == "ndjson":
+        return StreamingResponse(
+            _started(_stream_expenses(status, user_id)),
+            media_type="application/x-ndjson"
+        )
+    if format != "json":
+        raise HTTPException(400, "Invalid format")
+
+    limit = max(1, min(limit, EXPENSES_MAX_PAGE_SIZE))
+
+    with request_db() as conn:
+        cur = conn.cursor()
+        cur.execute(*_expense_page_query(user_id, status, limit, cursor))
+        rows = cur.fetchall()
+        cur.close()
+
+    return FastJSONResponse(_expense_page_result(rows, limit))
+
+
+def _expense_page_query(user_id, status, limit, cursor=None):
+    # Matches the (created_by, status, expense_date DESC, id DESC) index,
+    # where DESC puts NULL dates first.
+    after = ""
+    params = [user_id, status]
+    if cursor:
+        after_date, after_id = _decode_cursor(cursor)
+        if after_date is None:
+            after = "AND (expense_date IS NOT NULL OR id < %s)"
+            params.append(after_id)
+        else:
+            after = "AND (expense_date, id) < (%s, %s)"
+            params += [after_date, after_id]
+
+    # one extra row tells whether there is a next page
+    return f"""
+        SELECT expense_date, head, subhead, amount, id
+        FROM expense_items
+        WHERE created_by = %s AND status = %s {after}
+        ORDER BY expense_date DESC, id DESC
+        LIMIT %s
+    """, (*params, limit + 1)
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
 
-    return [
-        {
-            "date": r[0],
-            "head": r[1],
-            "subhead": r[2],
-            "amount": r[3]
-        } for r in rows
-    ]
+def _expense_page_result(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][0], rows[-1][4])
 
-@app.get("/api/dashboard/admin/filters")
-def admin_filters(
-    user: str | None = None,
-    office: str | None = None,
-    head: str | None = None,
-    subhead: str | None = None,
-    date: str | None = None,
-    current_user=Depends(get_current_user)
+    return {
+        "items": rows_to_dicts(EXPENSE_ROW_FIELDS, rows),
+        "next_cursor": next_cursor
+    }
+
+@app.get("/api/dashboard/admin/filters", response_model=FiltersOut)
+async def admin_filters(
+    request: Request,
+    filters=Depends(queries.dashboard_filters),
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
 ):
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conn = get_db()
-    cur = conn.cursor()
+    return await cached_response(
+        request, conn, "admin_filters", role_scope(current_user), filters,
+        lambda: _admin_filters(conn, filters)
+    )
+
+
+def _admin_filters_query(filters):
+    filter_clause, values = queries.where(filters)
 
     # ----------------------------
-    # Base WHERE (never breaks)
+    # One grouped scan of the rollup returns every facet. Users are always
+    # the full list; offices/heads/subheads cascade on the filters.
     # ----------------------------
-    where_clause = "WHERE 1=1"
-    values = []
-
-    if user not in (None, ""):
-        where_clause += " AND created_by = %s"
-        values.append(int(user))
+    return f"""
+        WITH facets AS (
+            SELECT
+                CASE
+                    WHEN GROUPING(created_by) = 0 THEN 'users'
+                    WHEN GROUPING(office_name) = 0 THEN 'offices'
+                    WHEN GROUPING(head) = 0 THEN 'heads'
+                    ELSE 'subheads'
+                END AS facet,
+                created_by,
+                COALESCE(office_name, head, subhead) AS value,
+                COALESCE(SUM(cnt) FILTER (WHERE {filter_clause}), 0) AS matches
+            FROM expense_rollup
+            WHERE status = 'approved'
+            GROUP BY GROUPING SETS ((created_by), (office_name), (head), (subhead))
+            HAVING SUM(cnt) > 0
+        )
+        SELECT f.facet, f.created_by, COALESCE(u.name, u.email, f.value), f.matches
+        FROM facets f
+        LEFT JOIN users u ON f.facet = 'users' AND u.id = f.created_by
+        WHERE (f.facet = 'users' AND u.id IS NOT NULL)
+           OR (f.facet <> 'users' AND f.value IS NOT NULL AND f.matches > 0)
+        ORDER BY f.facet, 3
+    """, values
+
+
+def _admin_filters_result(rows):
+    result = {"users": [], "offices": [], "heads": [], "subheads": []}
+    counts = {"users": {}, "offices": {}, "heads": {}, "subheads": {}}
+
+    for facet, user_id, label, matches in rows:
+        if facet == "users":
+            result["users"].append({"id": user_id, "label": label})
+            counts["users"][user_id] = matches
+        else:
+            result[facet].append(label)
+            counts[facet][label] = matches
+
+    result["counts"] = counts
+    return result
+
+
+async def _admin_filters(conn, filters):
+    return _admin_filters_result(await async_db.read(conn, *_admin_filters_query(filters)))
+
+PENDING_EXPENSE_FIELDS = (
+    "pending_id", "submitted_by_name", "submitted_by_email", "client",
+    "office", "head", "subhead", "amount", "expense_date",
+)
+
+
+_PENDING_EXPENSES_SQL = """
+    SELECT 
+        p.id,
+        u.name,
+        u.email,
+        p.client,
+        p.office_name,
+        p.head,
+        p.subhead,
+        p.amount,
+        p.expense_date
+    FROM expense_items p
+    JOIN users u ON u.id = p.created_by
+    WHERE p.status = 'pending'
+    ORDER BY p.id DESC
+"""
+
+
+@app.get("/api/admin/pending-expenses", response_model=list[PendingExpenseOut])
+def get_pending_expenses(current_user=Depends(get_current_user), conn=Depends(db_conn)):
+    if current_user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
 
-    if office not in (None, ""):
-        where_clause += " AND office_name = %s"
-        values.append(office)
+    cur = conn.cursor()
 
-    if head not in (None, ""):
-        where_clause += " AND head = %s"
-        values.append(head)
+    cur.execute(_PENDING_EXPENSES_SQL)
 
-    if subhead not in (None, ""):
-        where_clause += " AND subhead = %s"
-        values.append(subhead)
+    rows = cur.fetchall()
+    cur.close()
 
-    if date not in (None, ""):
-        where_clause += " AND expense_date = %s"
-        values.append(date)
+    return FastJSONResponse(rows_to_dicts(PENDING_EXPENSE_FIELDS, rows))
+
+REVIEW_STATUSES = {
+    "approve": "approved",
+    "reject": "rejected",
+}
+
+
+class BulkReviewIn(BaseModel):
+    action: str
+    ids: list[int] | None = None
+    # one value or a list, like the repeatable dashboard query parameters
+    user: str | list[str] | None = None
+    office: str | list[str] | None = None
+    head: str | list[str] | None = None
+    subhead: str | list[str] | None = None
+    date: str | None = None
+    date_from: str | None = None
+    date_to: str | None = None
+
+
+def _review_pending_query(action, conditions, values):
+    return f"""
+        WITH picked AS (
+            SELECT id FROM expense_items
+            WHERE status = 'pending' AND {" AND ".join(conditions)}
+            ORDER BY id
+            FOR UPDATE
+        ),
+        reviewed AS (
+            UPDATE expense_items e
+            SET status = %s, reviewed_at = NOW()
+            FROM picked
+            WHERE e.id = picked.id AND e.status = 'pending'
+            RETURNING e.id
+        ),
+        used AS (
+            UPDATE approval_tokens SET used_at = {approval_tokens.NOW_UTC}
+            WHERE pending_id IN (SELECT id FROM reviewed) AND used_at IS NULL
+        )
+        SELECT id FROM reviewed
+    """, (*values, REVIEW_STATUSES[action])
 
-    # ----------------------------
-    # USERS (always full list)
-    # ----------------------------
-    cur.execute("""
-        SELECT DISTINCT u.id, COALESCE(u.name, u.email)
-        FROM users u
-        JOIN expenses e ON e.created_by = u.id
-        ORDER BY COALESCE(u.name, u.email)
-    """)
-    users = [{"id": r[0], "label": r[1]} for r in cur.fetchall()]
 
-    # ----------------------------
-    # OFFICES (cascading)
-    # ----------------------------
-    cur.execute(f"""
-        SELECT DISTINCT office_name
-        FROM expenses
-        {where_clause}
-        AND office_name IS NOT NULL
-        ORDER BY office_name
-    """, values)
-    offices = [r[0] for r in cur.fetchall()]
+def _review_pending(cur, action, conditions, values):
+    """Approve or reject the matching pending expenses in place.
 
-    # ----------------------------
-    # HEADS (cascading)
-    # ----------------------------
-    cur.execute(f"""
-        SELECT DISTINCT head
-        FROM expenses
-        {where_clause}
-        AND head IS NOT NULL
-        ORDER BY head
-    """, values)
-    heads = [r[0] for r in cur.fetchall()]
+    One statement: lock the rows in id order (so overlapping batches cannot
+    deadlock), flip their status and mark their approval tokens used. Rows
+    another request already reviewed no longer match. Returns the ids that
+    were updated.
+    """
+    cur.execute(*_review_pending_query(action, conditions, values))
 
-    # ----------------------------
-    # SUBHEADS (cascading)
-    # ----------------------------
-    cur.execute(f"""
-        SELECT DISTINCT subhead
-        FROM expenses
-        {where_clause}
-        AND subhead IS NOT NULL
-        ORDER BY subhead
-    """, values)
-    subheads = [r[0] for r in cur.fetchall()]
+    return [r[0] for r in cur.fetchall()]
 
-    cur.close()
-    conn.close()
 
-    return {
-        "users": users,
-        "offices": offices,
-        "heads": heads,
-        "subheads": subheads
-    }
+@app.post("/api/admin/pending-expenses/bulk", response_model=BulkReviewOut)
+def admin_bulk_review(data: BulkReviewIn, current_user=Depends(get_current_user), conn=Depends(db_conn)):
+    """Approve or reject many pending expenses at once, atomically.
 
-@app.get("/api/admin/pending-expenses")
-def get_pending_expenses(current_user=Depends(get_current_user)):
+    Pass either ids, or dashboard-style filters (user, office, head,
+    subhead, date, date_from, date_to; the first four take one value or a
+    list) to act on every pending expense that matches. With ids the
+    result says, per id, whether it was reviewed or had already been
+    processed.
+    """
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conn = get_db()
-    cur = conn.cursor()
+    if data.action not in REVIEW_STATUSES:
+        raise HTTPException(400, "Invalid action")
 
-    cur.execute("""
-        SELECT 
-            p.id,
-            u.name,
-            u.email,
-            p.client,
-            p.office_name,
-            p.head,
-            p.subhead,
-            p.amount,
-            p.expense_date
-        FROM pending_expenses p
-        JOIN users u ON u.id = p.created_by
-        ORDER BY p.id DESC
-    """)
+    filters = queries.parse_filters(
+        data.user, data.office, data.head, data.subhead, data.date, data.date_from, data.date_to
+    )
+    if data.ids is None and not filters:
+        raise HTTPException(400, "Pass ids or at least one filter")
 
-    rows = cur.fetchall()
+    conditions = []
+    values = []
+    if data.ids is not None:
+        conditions.append("id = ANY(%s)")
+        values.append(data.ids)
+    where, values = queries.where(filters, conditions, values)
+
+    cur = conn.cursor()
+    reviewed = _review_pending(cur, data.action, [where], values)
+    conn.commit()
+    invalidate_responses_sync(conn)
     cur.close()
-    conn.close()
 
-    return [
-        {
-            "pending_id": r[0],
-            "submitted_by_name": r[1],
-            "submitted_by_email": r[2],
-            "client": r[3],
-            "office": r[4],
-            "head": r[5],
-            "subhead": r[6],
-            "amount": r[7],
-            "expense_date": r[8],
-        }
-        for r in rows
-    ]
+    status = REVIEW_STATUSES[data.action]
+    reviewed_set = set(reviewed)
+
+    return {
+        "reviewed": len(reviewed),
+        "results": [
+            {"id": i, "status": status if i in reviewed_set else "already_processed"}
+            for i in (data.ids if data.ids is not None else reviewed)
+        ],
+    }
 
-@app.post("/api/admin/pending-expenses/{pending_id}/approve")
-def admin_approve_expense(pending_id: int, current_user=Depends(get_current_user)):
+@app.post("/api/admin/pending-expenses/{pending_id}/approve", response_model=MessageOut)
+def admin_approve_expense(pending_id: int, current_user=Depends(get_current_user), conn=Depends(db_conn)):
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM pending_expenses WHERE id=%s", (pending_id,))
-    row = cur.fetchone()
-
-    if not row:
+    if not _review_pending(cur, "approve", ["id = %s"], [pending_id]):
         raise HTTPException(400, "Expense already processed")
 
-    cols = [d[0] for d in cur.description]
-    data = dict(zip(cols, row))
-
-    cur.execute("""
-        INSERT INTO expenses (
-            expense_date, client, office_name, head, subhead,
-            from_location, to_location, weight, amount, awb,
-            remark, vehicle_type, created_by
-        )
-        VALUES (
-            %(expense_date)s, %(client)s, %(office_name)s, %(head)s, %(subhead)s,
-            %(from_location)s, %(to_location)s, %(weight)s, %(amount)s, %(awb)s,
-            %(remark)s, %(vehicle_type)s, %(created_by)s
-        )
-    """, data)
-
-    cur.execute("DELETE FROM pending_expenses WHERE id=%s", (pending_id,))
     conn.commit()
+    invalidate_responses_sync(conn)
 
     cur.close()
-    conn.close()
 
     return {"msg": "Expense approved"}
 
-@app.post("/api/admin/pending-expenses/{pending_id}/reject")
-def admin_reject_expense(pending_id: int, current_user=Depends(get_current_user)):
+@app.post("/api/admin/pending-expenses/{pending_id}/reject", response_model=MessageOut)
+def admin_reject_expense(pending_id: int, current_user=Depends(get_current_user), conn=Depends(db_conn)):
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM pending_expenses WHERE id=%s", (pending_id,))
-    row = cur.fetchone()
-
-    if not row:
+    if not _review_pending(cur, "reject", ["id = %s"], [pending_id]):
         raise HTTPException(400, "Expense already processed")
 
-    cols = [d[0] for d in cur.description]
-    data = dict(zip(cols, row))
-
-    cur.execute("""
-        INSERT INTO rejected_expenses (
-            expense_date, client, office_name, head, subhead,
-            from_location, to_location, weight, amount, awb,
-            remark, vehicle_type, created_by
-        )
-        VALUES (
-            %(expense_date)s, %(client)s, %(office_name)s, %(head)s, %(subhead)s,
-            %(from_location)s, %(to_location)s, %(weight)s, %(amount)s, %(awb)s,
-            %(remark)s, %(vehicle_type)s, %(created_by)s
-        )
-    """, data)
-
-    cur.execute("DELETE FROM pending_expenses WHERE id=%s", (pending_id,))
     conn.commit()
+    invalidate_responses_sync(conn)
 
     cur.close()
-    conn.close()
 
     return {"msg": "Expense rejected"}
 
 
 
 
-@app.get("/api/dashboard/admin/pie/head")
-def admin_pie_head(
-    user: str | None = None,
-    office: str | None = None,
-    head: str | None = None,
-    subhead: str | None = None,
-    date: str | None = None,
-    top: int = 3,
+# ===================== EXPORTS =====================
+
+def _export_filename(fmt):
+    return f"expenses-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+
+
+def _export_job_dict(row):
+    job_id, fmt, status, row_count, error, created_at, finished_at = row
+    return {
+        "job_id": job_id,
+        "format": fmt,
+        "status": status,
+        "row_count": row_count,
+        "error": error,
+        "created_at": created_at,
+        "finished_at": finished_at,
+        "download_url": f"/api/admin/export/jobs/{job_id}/download" if status == "done" else None,
+    }
+
+
+@app.get("/api/admin/export", response_model=None, responses={202: {"model": ExportJobOut}})
+def export_expenses(
+    format: str = "csv",
+    status: str | None = None,
+    filters=Depends(queries.dashboard_filters),
+    background: bool = False,
     current_user=Depends(get_current_user)
 ):
+    """Export approved and rejected expenses (or ?status=approved|rejected)
+    matching the dashboard filters, as CSV or XLSX.
+
+    Up to EXPORT_INLINE_MAX_ROWS rows (EXPORT_INLINE_MAX_XLSX_ROWS for
+    XLSX) the file is the response. Bigger exports, or ?background=true,
+    are queued: the response is 202 with a job to poll, whose download_url
+    appears once the file is ready.
+    """
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conditions = []
-    values = []
+    if format not in exports.FORMATS:
+        raise HTTPException(400, "Invalid format")
+    if status not in (None, "", *exports.EXPORT_STATUSES):
+        raise HTTPException(400, "Invalid status")
 
-    if user not in (None, ""):
-        conditions.append("created_by = %s")
-        values.append(int(user))
+    filters = {**filters, "status": [status] if status else None}
+    headers = {"Content-Disposition": f'attachment; filename="{_export_filename(format)}"'}
+
+    # No db_conn: it would stay checked out until the download is sent,
+    # next to the CSV stream's own connection
+    with request_db() as conn:
+        cur = conn.cursor()
+
+        if background or exports.count_rows(cur, filters) > exports.inline_max_rows(format):
+            job_id = exports.create_job(cur, current_user["id"], format, filters)
+            conn.commit()
+            cur.close()
+            return FastJSONResponse(_export_job_dict(
+                (job_id, format, "queued", None, None, None, None)
+            ), status_code=202)
+
+        cur.close()
+
+        if format == "xlsx":
+            fd, path = tempfile.mkstemp(suffix=".xlsx")
+            os.close(fd)
+            try:
+                exports.write_file(conn, "xlsx", filters, path)
+            except BaseException:
+                os.remove(path)
+                raise
+            conn.rollback()
+            return FileResponse(
+                path,
+                media_type=exports.FORMATS["xlsx"],
+                headers=headers,
+                background=BackgroundTask(os.remove, path)
+            )
 
-    if office not in (None, ""):
-        conditions.append("office_name = %s")
-        values.append(office)
+    # streamed from a named cursor on a connection of its own
+    return StreamingResponse(
+        _started(exports.stream_csv(filters)),
+        media_type=exports.FORMATS["csv"],
+        headers=headers
+    )
 
-    if head not in (None, ""):
-        conditions.append("head = %s")
-        values.append(head)
 
-    if subhead not in (None, ""):
-        conditions.append("subhead = %s")
-        values.append(subhead)
+@app.get("/api/admin/export/jobs/{job_id}", response_model=ExportJobOut)
+def export_job_status(job_id: uuid.UUID, current_user=Depends(get_current_user), conn=Depends(db_conn)):
+    if current_user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
 
-    if date not in (None, ""):
-        conditions.append("expense_date = %s")
-        values.append(date)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, format, status, row_count, error, created_at, finished_at
+        FROM export_jobs WHERE id = %s
+    """, (str(job_id),))
+    row = cur.fetchone()
+    cur.close()
+
+    if not row:
+        raise HTTPException(404, "Export not found")
 
-    where_clause = ""
-    if conditions:
-        where_clause = "WHERE " + " AND ".join(conditions)
+    return _export_job_dict(row)
+
+
+@app.get("/api/admin/export/jobs/{job_id}/download")
+def export_job_download(job_id: uuid.UUID, current_user=Depends(get_current_user), conn=Depends(db_conn)):
+    if current_user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
 
-    conn = get_db()
     cur = conn.cursor()
+    cur.execute(
+        "SELECT format, file_path FROM export_jobs WHERE id = %s AND status = 'done'",
+        (str(job_id),)
+    )
+    row = cur.fetchone()
+    cur.close()
+
+    if not row or not os.path.exists(row[1]):
+        raise HTTPException(404, "Export not found or expired")
+
+    fmt, path = row
+    return FileResponse(path, media_type=exports.FORMATS[fmt], filename=_export_filename(fmt))
+
+
+@app.get("/api/dashboard/admin/pie/head", response_model=list[PieSliceOut])
+async def admin_pie_head(
+    request: Request,
+    filters=Depends(queries.dashboard_filters),
+    top: int = 3,
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
+):
+    if current_user["role"] != "admin":
+        raise HTTPException(403, "Admins only")
+
+    return await cached_response(
+        request, conn, "admin_pie_head", role_scope(current_user), {**filters, "top": top},
+        lambda: _admin_pie_head(conn, filters, top)
+    )
+
+
+def _admin_pie_query(column, filters, top):
+    where, values = queries.where(filters, ["status = 'approved'"])
 
-    cur.execute(f"""
-        SELECT head, SUM(amount)
-        FROM expenses
-        {where_clause}
-        GROUP BY head
-        ORDER BY SUM(amount) DESC
+    return f"""
+        SELECT {column}, SUM(total)
+        FROM expense_rollup
+        WHERE {where}
+        GROUP BY {column}
+        HAVING SUM(cnt) > 0
+        ORDER BY SUM(total) DESC
         LIMIT %s
-    """, (*values, top))
+    """, (*values, top)
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
 
+def _admin_pie_result(rows):
     return [{"label": r[0], "value": float(r[1])} for r in rows]
 
 
-@app.get("/api/dashboard/admin/pie/office")
-def admin_pie_office(
-    user: str | None = None,
-    office: str | None = None,
-    head: str | None = None,
-    subhead: str | None = None,
-    date: str | None = None,
+async def _admin_pie_head(conn, filters, top):
+    return _admin_pie_result(await async_db.read(conn, *_admin_pie_query("head", filters, top)))
+
+
+@app.get("/api/dashboard/admin/pie/office", response_model=list[PieSliceOut])
+async def admin_pie_office(
+    request: Request,
+    filters=Depends(queries.dashboard_filters),
     top: int = 3,
-    current_user=Depends(get_current_user)
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
 ):
     if current_user["role"] != "admin":
         raise HTTPException(403, "Admins only")
 
-    conditions = []
-    values = []
+    return await cached_response(
+        request, conn, "admin_pie_office", role_scope(current_user), {**filters, "top": top},
+        lambda: _admin_pie_office(conn, filters, top)
+    )
 
-    if user not in (None, ""):
-        conditions.append("created_by = %s")
-        values.append(int(user))
 
-    if office not in (None, ""):
-        conditions.append("office_name = %s")
-        values.append(office)
+async def _admin_pie_office(conn, filters, top):
+    return _admin_pie_result(await async_db.read(conn, *_admin_pie_query("office_name", filters, top)))
+
+
+# ----------------------------
+# Time series: totals and counts per day / week / month and per dimension,
+# aggregated from the rollup (indexed on expense_date). The response is
+# columnar: one shared bucket list, and per series arrays aligned to it.
+# ----------------------------
+TIMESERIES_INTERVALS = ("day", "week", "month")
+TIMESERIES_DIMENSIONS = {
+    "user": "created_by",
+    "office": "office_name",
+    "head": "head",
+    "subhead": "subhead",
+}
+TIMESERIES_MAX_BUCKETS = int(os.getenv("TIMESERIES_MAX_BUCKETS", "1000"))
+
+
+def _bucket_start(d, interval):
+    if interval == "month":
+        return d.replace(day=1)
+    if interval == "week":
+        return d - timedelta(days=d.weekday())  # date_trunc('week') is Monday
+    return d
+
+
+def _buckets(date_from, date_to, interval):
+    buckets = []
+    d = _bucket_start(date_from, interval)
+    while d <= date_to:
+        buckets.append(d)
+        if interval == "month":
+            d = d.replace(year=d.year + d.month // 12, month=d.month % 12 + 1)
+        else:
+            d += timedelta(days=7 if interval == "week" else 1)
+    return buckets
+
+
+@app.get("/api/dashboard/timeseries", response_model=TimeSeriesOut)
+async def dashboard_timeseries(
+    request: Request,
+    interval: str = "month",
+    by: str | None = None,
+    status: str = "approved",
+    filters=Depends(queries.dashboard_filters),
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
+):
+    """date_to defaults to today, date_from to one year before date_to."""
+    if interval not in TIMESERIES_INTERVALS:
+        raise HTTPException(400, f"interval must be one of {', '.join(TIMESERIES_INTERVALS)}")
+    if by not in (None, "") and by not in TIMESERIES_DIMENSIONS:
+        raise HTTPException(400, f"by must be one of {', '.join(TIMESERIES_DIMENSIONS)}")
+    if status not in EXPENSE_STATUSES:
+        raise HTTPException(400, f"status must be one of {', '.join(EXPENSE_STATUSES)}")
+
+    # Non-admins always see their own data; only the dates are theirs to pick
+    filters = queries.scoped(filters, current_user)
+    end = filters.get("date_to") or datetime.now().date()
+    start = filters.get("date_from") or end - timedelta(days=365)
+    if start > end:
+        raise HTTPException(400, "date_from is after date_to")
+
+    buckets = _buckets(start, end, interval)
+    if len(buckets) > TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(400, f"More than {TIMESERIES_MAX_BUCKETS} buckets; use a wider interval")
+
+    filters = {**filters, "status": [status], "date_from": start, "date_to": end}
+
+    return await cached_response(
+        request, conn, "timeseries", role_scope(current_user), {**filters, "interval": interval, "by": by},
+        lambda: _dashboard_timeseries(conn, interval, by, filters, buckets)
+    )
 
-    if head not in (None, ""):
-        conditions.append("head = %s")
-        values.append(head)
 
-    if subhead not in (None, ""):
-        conditions.append("subhead = %s")
-        values.append(subhead)
+def _timeseries_query(interval, by, filters):
+    where, values = queries.where(filters)
+
+    dimension = TIMESERIES_DIMENSIONS[by] if by else "NULL"
+    # Grouping on the bare column is noticeably cheaper than on date_trunc()
+    bucket = "expense_date" if interval == "day" else f"date_trunc('{interval}', expense_date::timestamp)::date"
+
+    # Index-only scan of expense_rollup_status_date_cover_idx
+    return f"""
+        SELECT {bucket}, {dimension}, SUM(cnt), SUM(total)
+        FROM expense_rollup
+        WHERE {where}
+        GROUP BY 1, 2
+        HAVING SUM(cnt) > 0
+    """, values
+
+
+async def _dashboard_timeseries(conn, interval, by, filters, buckets):
+    rows = await async_db.read(conn, *_timeseries_query(interval, by, filters))
+
+    position = {b: i for i, b in enumerate(buckets)}
+    series = {}
+    for bucket, key, cnt, total in rows:
+        s = series.get(key)
+        if s is None:
+            s = series[key] = {
+                "key": key,
+                "counts": [0] * len(buckets),
+                "totals": [0.0] * len(buckets),
+            }
+        i = position[bucket]
+        s["counts"][i] = cnt
+        s["totals"][i] = float(total)
+
+    if by == "user" and series:
+        labels = dict(await async_db.read(
+            conn,
+            "SELECT id, COALESCE(name, email) FROM users WHERE id = ANY(%s)",
+            ([k for k in series if k is not None],),
+        ))
+        for key, s in series.items():
+            s["label"] = labels.get(key)
 
-    if date not in (None, ""):
-        conditions.append("expense_date = %s")
-        values.append(date)
+    return {
+        "interval": interval,
+        "by": by or None,
+        "buckets": buckets,
+        "series": [series[k] for k in sorted(series, key=lambda k: (k is None, k))],
+    }
 
-    where_clause = ""
-    if conditions:
-        where_clause = "WHERE " + " AND ".join(conditions)
 
-    conn = get_db()
-    cur = conn.cursor()
+# ----------------------------
+# Everything the dashboard shows on load in one request: one auth check,
+# one pooled connection, and the queries pipelined in one snapshot.
+# ----------------------------
+SUMMARY_PARTS = ("me", "kpis", "filters", "pie_head", "pie_office", "expenses")
+SUMMARY_ADMIN_PARTS = ("filters", "pie_head", "pie_office")
+SUMMARY_DEFAULTS = {
+    "admin": ("me", "kpis", "filters", "pie_head", "pie_office"),
+    "user": ("me", "kpis", "expenses"),
+}
+
+
+@app.get("/api/dashboard/summary", response_model=DashboardSummaryOut)
+async def dashboard_summary(
+    request: Request,
+    fields: str | None = None,
+    filters=Depends(queries.dashboard_filters),
+    head_top: int = 3,
+    office_top: int = 3,
+    limit: int = EXPENSES_PAGE_SIZE,
+    current_user=Depends(get_current_user_async),
+    conn=Depends(async_db_conn)
+):
+    """?fields=kpis,pie_head picks parts (default: what the dashboard shows
+    for the user's role). expenses is the first page of each status list;
+    follow next_cursor on /api/dashboard/expenses/{status}."""
+    is_admin = current_user["role"] == "admin"
+
+    if fields:
+        requested = {f.strip() for f in fields.split(",")} - {""}
+        unknown = requested - set(SUMMARY_PARTS)
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        if not is_admin and requested & set(SUMMARY_ADMIN_PARTS):
+            raise HTTPException(403, "Admins only")
+        fields = tuple(f for f in SUMMARY_PARTS if f in requested)
+    else:
+        fields = SUMMARY_DEFAULTS["admin" if is_admin else "user"]
 
-    cur.execute(f"""
-        SELECT office_name, SUM(amount)
-        FROM expenses
-        {where_clause}
-        GROUP BY office_name
-        ORDER BY SUM(amount) DESC
-        LIMIT %s
-    """, (*values, top))
+    limit = max(1, min(limit, EXPENSES_MAX_PAGE_SIZE))
+    params = {
+        **filters, "fields": ",".join(fields),
+        "head_top": head_top, "office_top": office_top, "limit": limit,
+    }
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    # "me" and own expenses make the payload per user; without them admins
+    # share entries, like the single endpoints
+    per_user = "me" in fields or "expenses" in fields
+    scope = f"user:{current_user['id']}" if per_user else role_scope(current_user)
+    return await cached_response(
+        request, conn, "summary", scope, params,
+        lambda: _dashboard_summary(conn, current_user, fields, filters, head_top, office_top, limit)
+    )
 
-    return [
-        {"label": r[0], "value": float(r[1])}
-        for r in rows
-    ]
+
+async def _dashboard_summary(conn, current_user, fields, filters, head_top, office_top, limit):
+    # (key, status or None, (sql, values), shape rows)
+    parts = []
+    if "kpis" in fields:
+        parts.append(("kpis", None, _kpis_query(queries.scoped(filters, current_user)), _kpis_result))
+    if "filters" in fields:
+        parts.append(("filters", None, _admin_filters_query(filters), _admin_filters_result))
+    if "pie_head" in fields:
+        parts.append(("pie_head", None, _admin_pie_query("head", filters, head_top), _admin_pie_result))
+    if "pie_office" in fields:
+        parts.append(("pie_office", None, _admin_pie_query("office_name", filters, office_top), _admin_pie_result))
+    if "expenses" in fields:
+        for status in EXPENSE_STATUSES:
+            parts.append((
+                "expenses", status,
+                _expense_page_query(current_user["id"], status, limit),
+                lambda rows: _expense_page_result(rows, limit),
+            ))
+
+    results = await async_db.read_snapshot(conn, [statement for _, _, statement, _ in parts])
+
+    payload = {"me": current_user} if "me" in fields else {}
+    for (key, status, _, shape), rows in zip(parts, results):
+        if status is None:
+            payload[key] = shape(rows)
+        else:
+            payload.setdefault(key, {})[status] = shape(rows)
+
+    return payload
@@ -0,0 +1,164 @@
+"""Prometheus metrics, served at /metrics.
+
+Under gunicorn every worker is its own process, so metrics go through
+prometheus_client's multiprocess mode: set PROMETHEUS_MULTIPROC_DIR to an
+empty directory shared by all workers (gunicorn.conf.py does this and, at
+startup, removes the files of processes that have exited). Any process
+started with the same directory, such as `python worker.py` or
+`python exports.py worker` on the same host, shows up in the same /metrics
+output. Without the variable, each process just reports its own numbers.
+
+Every request also collects its SQL statements and their timings; when a
+request takes longer than SLOW_REQUEST_MS they are printed with it, slowest
+first.
+"""
+import contextvars
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# statements printed per slow request
+SLOW_REQUEST_TOP_QUERIES = 5
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency",
+    ["method", "route", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run per request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request",
+    ["route"],
+)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Pooled connections checked out",
+    ["pool"], multiprocess_mode="livesum",
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time waiting for a pooled connection",
+    ["pool"],
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Requests that found no free connection",
+    ["pool"],
+)
+EMAIL_SEND_SECONDS = Histogram(
+    "email_send_duration_seconds", "Email provider API call latency",
+)
+EMAIL_SEND_FAILURES = Counter(
+    "email_send_failures_total", "Failed email provider API calls",
+    ["reason"],
+)
+OUTBOX_DEAD = Counter(
+    "outbox_dead_messages_total", "Outbox messages given up on",
+    ["kind"],
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups; hit ratio = hit / (hit + miss)",
+    ["cache", "result"],
+)
+
+
+# ---------------- per-request SQL ----------------
+# The middleware puts a fresh list in _queries for every request; the
+# timing cursors (database.py / async_db.py) append (sql, seconds) to it.
+# Sync handlers run in a thread with a copy of the context, which still
+# points at the same list.
+
+_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def record_query(sql, seconds):
+    queries = _queries.get()
+    if queries is not None:
+        queries.append((sql, seconds))
+
+
+class timed:
+    """with metrics.timed(sql): ... records one statement."""
+
+    def __init__(self, sql):
+        self.sql = sql
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record_query(self.sql, time.perf_counter() - self.start)
+
+
+def _route(scope):
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _log_slow(method, route, elapsed, queries):
+    db_time = sum(s for _, s in queries)
+    print(
+        f"⚠️ Slow request {method} {route}: {elapsed * 1000:.0f} ms, "
+        f"{len(queries)} queries, {db_time * 1000:.0f} ms in SQL"
+    )
+    for sql, seconds in sorted(queries, key=lambda q: -q[1])[:SLOW_REQUEST_TOP_QUERIES]:
+        print(f"    {seconds * 1000:8.1f} ms  {' '.join(str(sql).split())[:300]}")
+
+
+class MetricsMiddleware:
+    """ASGI middleware: latency per route template, SQL per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = []
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _queries.reset(token)
+
+            route = _route(scope)
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(route).observe(len(queries))
+            REQUEST_DB_SECONDS.labels(route).observe(sum(s for _, s in queries))
+
+            if elapsed * 1000 > SLOW_REQUEST_MS:
+                _log_slow(scope["method"], route, elapsed, queries)
+
+
+# ---------------- exposition ----------------
+
+def render():
+    """(body, content type) for the /metrics response."""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
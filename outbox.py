@@ -0,0 +1,266 @@
+import json
+import os
+from types import SimpleNamespace
+
+import mail_transport
+import metrics
+from database import get_db
+from email_utils import send_approval_email, send_digest_email
+
+BASE_URL = os.getenv("BASE_URL", "")
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Retry n waits OUTBOX_BACKOFF_BASE * 2**(n-1) seconds, capped at OUTBOX_BACKOFF_MAX.
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+# Sent messages are deleted this long after sending; dead ones are kept
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+OUTBOX_PURGE_BATCH = int(os.getenv("OUTBOX_PURGE_BATCH", "1000"))
+
+# "instant": one email per expense. "digest": approval emails are held until
+# the oldest one is DIGEST_WINDOW seconds old, then sent together with at most
+# DIGEST_MAX_EXPENSES expenses per email.
+APPROVAL_EMAIL_MODE = os.getenv("APPROVAL_EMAIL_MODE", "instant")
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "300"))
+DIGEST_MAX_EXPENSES = int(os.getenv("DIGEST_MAX_EXPENSES", "50"))
+DIGEST_MAX_CLAIM = int(os.getenv("DIGEST_MAX_CLAIM", "1000"))
+
+NOTIFY_CHANNEL = "email_outbox"
+
+APPROVAL_EMAIL = "approval_email"
+
+# status: pending -> sent, or pending -> dead once attempts run out
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS email_outbox(
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx
+    ON email_outbox (next_attempt_at) WHERE status = 'pending';
+"""
+
+SENT_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS email_outbox_sent_idx
+    ON email_outbox (sent_at) WHERE status = 'sent';
+"""
+
+_ENQUEUE_SQL = "INSERT INTO email_outbox (kind, payload) VALUES (%s, %s::jsonb)"
+_NOTIFY_SQL = f"NOTIFY {NOTIFY_CHANNEL}"
+
+
+# ---------------- producers ----------------
+# Call these with the cursor of the transaction that writes the business
+# row, so the email exists if and only if that transaction commits.
+
+def enqueue(cur, kind, payload):
+    cur.execute(_ENQUEUE_SQL, (kind, json.dumps(payload, default=str)))
+    cur.execute(_NOTIFY_SQL)
+
+
+async def enqueue_async(cur, kind, payload):
+    await cur.execute(_ENQUEUE_SQL, (kind, json.dumps(payload, default=str)))
+    await cur.execute(_NOTIFY_SQL)
+
+
+# ---------------- dispatcher ----------------
+
+def _approval_item(payload):
+    # one token behind both links; messages queued before migration 9 carry one per action
+    approve_token = payload.get("token") or payload["approve_token"]
+    reject_token = payload.get("token") or payload["reject_token"]
+    return {
+        "approve_url": f"{BASE_URL}/review/approve/{approve_token}",
+        "reject_url": f"{BASE_URL}/review/reject/{reject_token}",
+        "expense": SimpleNamespace(**payload["expense"]),
+        "submitted_by_name": payload["submitted_by_name"],
+        "submitted_by_email": payload["submitted_by_email"],
+    }
+
+
+def _send_approval(payload, admin_emails):
+    item = _approval_item(payload)
+    send_approval_email(
+        admin_emails,
+        item["approve_url"],
+        item["reject_url"],
+        item["expense"],
+        submitted_by_name=item["submitted_by_name"],
+        submitted_by_email=item["submitted_by_email"],
+    )
+
+
+HANDLERS = {
+    APPROVAL_EMAIL: _send_approval,
+}
+
+
+def backoff(attempts):
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+def _mark_sent(cur, msg_id, attempts):
+    cur.execute("""
+        UPDATE email_outbox
+        SET status = 'sent', attempts = %s, sent_at = NOW(), last_error = NULL
+        WHERE id = %s
+    """, (attempts, msg_id))
+
+
+def _mark_failed(cur, msg_id, kind, attempts, error):
+    # a message the provider refused would only be refused again
+    rejected = isinstance(error, mail_transport.MailRejected)
+    if rejected or attempts >= OUTBOX_MAX_ATTEMPTS:
+        reason = "rejected by the provider" if rejected else f"dead after {attempts} attempts"
+        print(f"⚠️ Outbox message {msg_id} {reason}:", error)
+        metrics.OUTBOX_DEAD.labels(kind).inc()
+        cur.execute("""
+            UPDATE email_outbox
+            SET status = 'dead', attempts = %s, last_error = %s
+            WHERE id = %s
+        """, (attempts, str(error), msg_id))
+    else:
+        cur.execute("""
+            UPDATE email_outbox
+            SET attempts = %s, last_error = %s,
+                next_attempt_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+        """, (attempts, str(error), backoff(attempts), msg_id))
+
+
+def _defer(cur, msg_id, error):
+    """Provider circuit open: try again when it closes, without using an attempt."""
+    cur.execute("""
+        UPDATE email_outbox
+        SET last_error = %s, next_attempt_at = NOW() + make_interval(secs => %s)
+        WHERE id = %s
+    """, (str(error), error.retry_after, msg_id))
+
+
+def _admin_emails(cur):
+    cur.execute("SELECT email FROM users WHERE role = 'admin'")
+    return [r[0] for r in cur.fetchall()]
+
+
+def _dispatch_digest(cur):
+    cur.execute("""
+        SELECT MIN(created_at) <= NOW() - make_interval(secs => %s)
+        FROM email_outbox
+        WHERE status = 'pending' AND kind = %s AND next_attempt_at <= NOW()
+    """, (DIGEST_WINDOW, APPROVAL_EMAIL))
+    if not cur.fetchone()[0]:
+        return 0
+
+    cur.execute("""
+        SELECT id, payload, attempts
+        FROM email_outbox
+        WHERE status = 'pending' AND kind = %s AND next_attempt_at <= NOW()
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (APPROVAL_EMAIL, DIGEST_MAX_CLAIM))
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+
+    admin_emails = _admin_emails(cur)
+
+    for i in range(0, len(rows), DIGEST_MAX_EXPENSES):
+        chunk = rows[i:i + DIGEST_MAX_EXPENSES]
+        try:
+            if not admin_emails:
+                raise RuntimeError("no admin recipients")
+            send_digest_email(admin_emails, [_approval_item(r[1]) for r in chunk])
+        except mail_transport.CircuitOpen as e:
+            for msg_id, _, _ in chunk:
+                _defer(cur, msg_id, e)
+        except Exception as e:
+            for msg_id, _, attempts in chunk:
+                _mark_failed(cur, msg_id, APPROVAL_EMAIL, attempts + 1, e)
+        else:
+            for msg_id, _, attempts in chunk:
+                _mark_sent(cur, msg_id, attempts + 1)
+
+    return len(rows)
+
+
+def dispatch_batch(conn, batch_size=OUTBOX_BATCH_SIZE):
+    """Send up to batch_size due messages and return how many were claimed.
+
+    Rows are claimed with SKIP LOCKED, so several dispatchers can drain the
+    outbox side by side without sending anything twice. In digest mode
+    approval emails are claimed separately and grouped.
+    """
+    cur = conn.cursor()
+
+    held_kinds = [APPROVAL_EMAIL] if APPROVAL_EMAIL_MODE == "digest" else []
+
+    claimed = _dispatch_digest(cur) if held_kinds else 0
+
+    cur.execute("""
+        SELECT id, kind, payload, attempts
+        FROM email_outbox
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+          AND kind <> ALL(%s)
+        ORDER BY next_attempt_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (held_kinds, batch_size))
+    rows = cur.fetchall()
+
+    if rows:
+        admin_emails = _admin_emails(cur)
+
+    for msg_id, kind, payload, attempts in rows:
+        attempts += 1
+        try:
+            if not admin_emails:
+                raise RuntimeError("no admin recipients")
+            HANDLERS[kind](payload, admin_emails)
+        except mail_transport.CircuitOpen as e:
+            _defer(cur, msg_id, e)
+        except Exception as e:
+            _mark_failed(cur, msg_id, kind, attempts, e)
+        else:
+            _mark_sent(cur, msg_id, attempts)
+
+    conn.commit()
+    cur.close()
+    return claimed + len(rows)
+
+
+# ---------------- retention ----------------
+
+def purge_sent(batch_size=OUTBOX_PURGE_BATCH):
+    """Delete messages sent more than OUTBOX_RETENTION_HOURS ago.
+
+    Batched like approval_tokens.sweep(): short transactions, rows a
+    dispatcher holds are skipped. Returns how many messages were deleted.
+    """
+    total = 0
+    while True:
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                DELETE FROM email_outbox
+                WHERE id = ANY(ARRAY(
+                    SELECT id FROM email_outbox
+                    WHERE status = 'sent' AND sent_at < NOW() - %s * interval '1 hour'
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ))
+            """, (OUTBOX_RETENTION_HOURS, batch_size))
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+
+        total += deleted
+        if deleted < batch_size:
+            return total
@@ -0,0 +1,164 @@
+"""Monthly partitions of expense_items.
+
+expense_items is range-partitioned by expense_date, one partition per
+month (expense_items_2026_01 holds January 2026) plus expense_items_default
+for NULL dates and months that have no partition yet.
+
+    python partitions.py ensure           # create partitions up to PARTITION_MONTHS_AHEAD
+    python partitions.py list             # partitions with their row counts
+    python partitions.py detach 2024-01   # archive a month out of the live table
+    python partitions.py attach 2024-01   # bring an archived month back
+
+Detaching removes the month from the live table and from the dashboard
+rollup; the detached table keeps its data and can be dumped and dropped.
+Detach and attach change what the dashboard shows, so the CLI invalidates
+cached responses after committing either.
+Run `ensure` from cron (and it runs at app startup) so new months get
+their partition before data arrives.
+"""
+import argparse
+import os
+from datetime import date
+
+import rollup
+from cache import invalidate_responses_sync
+from database import get_db
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+PARENT = "expense_items"
+DEFAULT_PARTITION = f"{PARENT}_default"
+
+_LOCK_ID = 727_002
+
+
+def _month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def _next_month(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_{month.year:04}_{month.month:02}"
+
+
+def _parse_month(value):
+    year, month = value.split("-")
+    return date(int(year), int(month), 1)
+
+
+def _exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return cur.fetchone()[0]
+
+
+def create_partition(cur, month):
+    """Create and attach the partition for month, if it does not exist.
+
+    Rows for that month that already landed in the default partition are
+    moved into the new one first, otherwise ATTACH would refuse.
+    """
+    name = partition_name(month)
+    if _exists(cur, name):
+        return False
+
+    start, end = month, _next_month(month)
+
+    cur.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    # Moving rows within the partition tree directly does not fire the
+    # parent's rollup triggers, which is right: the totals do not change.
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE expense_date >= %s AND expense_date < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    cur.execute(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+        (start, end),
+    )
+    return True
+
+
+def ensure(cur, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create partitions for every month with data and the months ahead."""
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_ID,))
+
+    cur.execute(f"""
+        SELECT DISTINCT date_trunc('month', expense_date)::date
+        FROM {DEFAULT_PARTITION}
+        WHERE expense_date IS NOT NULL
+    """)
+    months = {r[0] for r in cur.fetchall()}
+
+    month = _month_start(date.today())
+    for _ in range(months_ahead + 1):
+        months.add(month)
+        month = _next_month(month)
+
+    return [m for m in sorted(months) if create_partition(cur, m)]
+
+
+def detach(cur, month):
+    name = partition_name(month)
+    cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+    rollup.apply_table(cur, name, -1)
+
+
+def attach(cur, month):
+    name = partition_name(month)
+    cur.execute(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+        (month, _next_month(month)),
+    )
+    rollup.apply_table(cur, name, 1)
+
+
+def list_partitions(cur):
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), s.n_live_tup
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (PARENT,))
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage expense_items partitions")
+    parser.add_argument("command", choices=["ensure", "list", "detach", "attach"])
+    parser.add_argument("month", nargs="?", help="YYYY-MM, for detach / attach")
+    args = parser.parse_args()
+
+    if args.command in ("detach", "attach") and not args.month:
+        parser.error(f"{args.command} needs a month (YYYY-MM)")
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        if args.command == "ensure":
+            created = ensure(cur)
+            print(f"created {len(created)} partitions")
+        elif args.command == "list":
+            for name, bound, rows in list_partitions(cur):
+                print(f"{name:28} {rows or 0:>10} rows  {bound}")
+        elif args.command == "detach":
+            detach(cur, _parse_month(args.month))
+            print(f"detached {partition_name(_parse_month(args.month))}")
+        else:
+            attach(cur, _parse_month(args.month))
+            print(f"attached {partition_name(_parse_month(args.month))}")
+        conn.commit()
+        cur.close()
+
+        if args.command in ("detach", "attach"):
+            invalidate_responses_sync(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Dashboard filters and the WHERE clauses built from them.
+
+Every dashboard and export endpoint takes the same filters. They are parsed
+once, by the dashboard_filters dependency, and turned into SQL by where():
+
+    filters=Depends(queries.dashboard_filters)
+    ...
+    clause, values = queries.where(filters, ["status = 'approved'"])
+
+user / office / head / subhead may be repeated (?office=a&office=b) and
+always compile to `column = ANY(%s)`, so the SQL text depends only on
+which filters are set, never on their values. Async handlers run it
+through async_db.read(): psycopg PREPAREs each distinct text once per
+pooled connection, and later requests with the same filter shape skip
+parsing and planning.
+"""
+from datetime import datetime
+
+from fastapi import HTTPException, Query
+
+# filter name -> rollup / expense_items column, matched with = ANY(%s)
+FILTER_COLUMNS = {
+    "status": "status",
+    "user": "created_by",
+    "office": "office_name",
+    "head": "head",
+    "subhead": "subhead",
+}
+
+DATE_CONDITIONS = {
+    "date": "expense_date = %s",
+    "date_from": "expense_date >= %s",
+    "date_to": "expense_date <= %s",
+}
+
+
+def parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value).date()
+    except ValueError:
+        raise HTTPException(400, f"{name} must be YYYY-MM-DD")
+
+
+def _parse_list(values, name, cast=str):
+    if isinstance(values, str):
+        values = [values]
+    values = [v for v in values or [] if v not in (None, "")]
+    try:
+        return [cast(v) for v in values] or None
+    except ValueError:
+        raise HTTPException(400, f"Invalid {name}")
+
+
+def parse_filters(user=None, office=None, head=None, subhead=None,
+                  date=None, date_from=None, date_to=None):
+    """Validate raw query values; only the filters that are set are kept.
+
+    user / office / head / subhead take a list or a single string.
+    """
+    filters = {
+        "user": _parse_list(user, "user", int),
+        "office": _parse_list(office, "office"),
+        "head": _parse_list(head, "head"),
+        "subhead": _parse_list(subhead, "subhead"),
+    }
+    for name, value in (("date", date), ("date_from", date_from), ("date_to", date_to)):
+        if value not in (None, ""):
+            filters[name] = parse_date(value, name)
+
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+def dashboard_filters(
+    user: list[str] | None = Query(None),
+    office: list[str] | None = Query(None),
+    head: list[str] | None = Query(None),
+    subhead: list[str] | None = Query(None),
+    date: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+):
+    """FastAPI dependency: the dashboard filters of the current request."""
+    return parse_filters(user, office, head, subhead, date, date_from, date_to)
+
+
+def scoped(filters, current_user):
+    """Admins filter freely; everyone else only ever sees their own rows,
+    within the dates they asked for."""
+    if current_user["role"] == "admin":
+        return filters
+    scoped = {name: filters[name] for name in DATE_CONDITIONS if name in filters}
+    scoped["user"] = [current_user["id"]]
+    return scoped
+
+
+def where(filters, conditions=(), values=()):
+    """filters -> ("cond AND cond ...", [values]); "TRUE" when empty.
+
+    conditions / values are prepended, for fixed parts such as a status.
+    """
+    conditions = list(conditions)
+    values = list(values)
+
+    for name, column in FILTER_COLUMNS.items():
+        if filters.get(name):
+            conditions.append(f"{column} = ANY(%s)")
+            values.append(list(filters[name]))
+
+    for name, condition in DATE_CONDITIONS.items():
+        if filters.get(name) not in (None, ""):
+            conditions.append(condition)
+            values.append(filters[name])
+
+    return " AND ".join(conditions) or "TRUE", values
@@ -0,0 +1,166 @@
+"""Incrementally maintained dashboard rollup.
+
+expense_rollup holds count and sum(amount) per
+(created_by, office_name, head, subhead, expense_date, status). Statement
+triggers on expense_items apply every insert/update/delete as a delta
+(an approval is -1 pending, +1 approved), so the dashboard aggregates over
+a few rows per group instead of scanning the expenses.
+
+    python rollup.py check     # report groups that drifted from the source
+    python rollup.py rebuild   # recompute the whole rollup from the source
+"""
+import argparse
+
+from database import get_db
+
+SOURCE_TABLE = "expense_items"
+
+KEY_COLUMNS = "created_by, office_name, head, subhead, expense_date, status"
+
+TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS expense_rollup(
+    created_by INT,
+    office_name TEXT,
+    head TEXT,
+    subhead TEXT,
+    expense_date DATE,
+    status TEXT NOT NULL,
+    cnt BIGINT NOT NULL DEFAULT 0,
+    total NUMERIC NOT NULL DEFAULT 0,
+    UNIQUE NULLS NOT DISTINCT ({KEY_COLUMNS})
+);
+"""
+
+INSTALL_SQL = f"""
+{TABLE_SQL}
+
+CREATE OR REPLACE FUNCTION expense_rollup_apply() RETURNS trigger AS $$
+BEGIN
+    -- ORDER BY keeps row-lock order stable between concurrent writers
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO expense_rollup AS r ({KEY_COLUMNS}, cnt, total)
+        SELECT created_by, office_name, head, subhead, expense_date, status,
+               -COUNT(*), -COALESCE(SUM(amount), 0)
+        FROM old_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT ({KEY_COLUMNS})
+        DO UPDATE SET cnt = r.cnt + EXCLUDED.cnt, total = r.total + EXCLUDED.total;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO expense_rollup AS r ({KEY_COLUMNS}, cnt, total)
+        SELECT created_by, office_name, head, subhead, expense_date, status,
+               COUNT(*), COALESCE(SUM(amount), 0)
+        FROM new_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT ({KEY_COLUMNS})
+        DO UPDATE SET cnt = r.cnt + EXCLUDED.cnt, total = r.total + EXCLUDED.total;
+    END IF;
+
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS {table}_rollup_ins ON {table};
+CREATE TRIGGER {table}_rollup_ins AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION expense_rollup_apply();
+
+DROP TRIGGER IF EXISTS {table}_rollup_upd ON {table};
+CREATE TRIGGER {table}_rollup_upd AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION expense_rollup_apply();
+
+DROP TRIGGER IF EXISTS {table}_rollup_del ON {table};
+CREATE TRIGGER {table}_rollup_del AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION expense_rollup_apply();
+"""
+
+_AGGREGATE_SQL = """
+    SELECT {key}, COUNT(*) AS cnt, COALESCE(SUM(amount), 0) AS total
+    FROM {table}
+    GROUP BY {key}
+"""
+
+
+def install(cur):
+    """Create the rollup table and the triggers on expense_items, then rebuild."""
+    cur.execute(INSTALL_SQL)
+    cur.execute(TRIGGERS_SQL.format(table=SOURCE_TABLE))
+    rebuild(cur)
+
+
+def rebuild(cur):
+    # SHARE mode blocks writers (not readers) so the rebuild sees a
+    # consistent source and no trigger delta is lost in between.
+    cur.execute(f"LOCK TABLE {SOURCE_TABLE} IN SHARE MODE")
+    cur.execute("DELETE FROM expense_rollup")
+    cur.execute(f"""
+        INSERT INTO expense_rollup ({KEY_COLUMNS}, cnt, total)
+        {_AGGREGATE_SQL.format(key=KEY_COLUMNS, table=SOURCE_TABLE)}
+    """)
+    return cur.rowcount
+
+
+def apply_table(cur, table, sign):
+    """Add (sign=1) or subtract (sign=-1) every row of table to the rollup.
+
+    For partitions attached or detached by hand, which the triggers on the
+    parent do not see.
+    """
+    cur.execute(f"""
+        INSERT INTO expense_rollup AS r ({KEY_COLUMNS}, cnt, total)
+        SELECT {KEY_COLUMNS}, %s * cnt, %s * total
+        FROM ({_AGGREGATE_SQL.format(key=KEY_COLUMNS, table=table)}) src
+        ORDER BY {KEY_COLUMNS}
+        ON CONFLICT ({KEY_COLUMNS})
+        DO UPDATE SET cnt = r.cnt + EXCLUDED.cnt, total = r.total + EXCLUDED.total
+    """, (sign, sign))
+
+
+def check(cur):
+    """Return groups whose rollup count/total differs from the source."""
+    cur.execute(f"""
+        SELECT {KEY_COLUMNS}, SUM(rollup_cnt), SUM(source_cnt),
+               SUM(rollup_total), SUM(source_total)
+        FROM (
+            SELECT {KEY_COLUMNS}, cnt AS rollup_cnt, 0 AS source_cnt,
+                   total AS rollup_total, 0 AS source_total
+            FROM expense_rollup
+            UNION ALL
+            SELECT {KEY_COLUMNS}, 0, cnt, 0, total
+            FROM ({_AGGREGATE_SQL.format(key=KEY_COLUMNS, table=SOURCE_TABLE)}) src
+        ) x
+        GROUP BY {KEY_COLUMNS}
+        HAVING SUM(rollup_cnt) <> SUM(source_cnt) OR SUM(rollup_total) <> SUM(source_total)
+    """)
+    return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the expense_rollup table")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    args = parser.parse_args()
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        if args.command == "rebuild":
+            groups = rebuild(cur)
+            conn.commit()
+            print(f"rebuilt expense_rollup: {groups} groups")
+        else:
+            drift = check(cur)
+            conn.rollback()
+            for row in drift:
+                print(row)
+            print(f"{len(drift)} groups out of sync")
+        cur.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Response models for the endpoints in main.py.
+
+They document every response in the OpenAPI schema. Small responses are
+validated and serialized through them by FastAPI; handlers that return
+large row lists send a fast_json.FastJSONResponse instead, which skips
+both steps.
+"""
+from datetime import date, datetime
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class MessageOut(BaseModel):
+    msg: str
+
+
+class UserOut(BaseModel):
+    id: int
+    name: str | None
+    email: str
+    role: str
+
+
+class CacheStatsOut(BaseModel):
+    user_cache: dict
+    response_cache: dict
+
+
+class BulkImportOut(BaseModel):
+    msg: str
+    count: int
+
+
+class ReviewOut(BaseModel):
+    status: str
+
+
+class KpisOut(BaseModel):
+    total_expense: float
+    total_uploaded: int
+    total_approved: int
+    total_rejected: int
+    total_pending: int
+
+
+class ExpenseRowOut(BaseModel):
+    date: date | None
+    head: str | None
+    subhead: str | None
+    amount: float | None
+
+
+class ExpensePageOut(BaseModel):
+    items: list[ExpenseRowOut]
+    next_cursor: str | None
+
+
+class UserOptionOut(BaseModel):
+    id: int
+    label: str | None
+
+
+class FiltersOut(BaseModel):
+    users: list[UserOptionOut]
+    offices: list[str]
+    heads: list[str]
+    subheads: list[str]
+    # facet -> option (user id, office, ...) -> approved expenses matching the filters
+    counts: dict[str, dict[str, int]]
+
+
+class PieSliceOut(BaseModel):
+    label: str | None
+    value: float
+
+
+class PendingExpenseOut(BaseModel):
+    pending_id: int
+    submitted_by_name: str | None
+    submitted_by_email: str
+    client: str | None
+    office: str | None
+    head: str | None
+    subhead: str | None
+    amount: float | None
+    expense_date: date | None
+
+
+class BulkReviewResultOut(BaseModel):
+    id: int
+    status: str
+
+
+class BulkReviewOut(BaseModel):
+    reviewed: int
+    results: list[BulkReviewResultOut]
+
+
+class ExportJobOut(BaseModel):
+    job_id: UUID
+    format: str
+    status: str
+    row_count: int | None
+    error: str | None
+    created_at: datetime | None
+    finished_at: datetime | None
+    download_url: str | None
+
+
+class TimeSeriesSeriesOut(BaseModel):
+    # office / head / subhead name, user id, or null without `by`
+    key: str | int | None
+    label: str | None = None
+    # aligned with TimeSeriesOut.buckets
+    counts: list[int]
+    totals: list[float]
+
+
+class TimeSeriesOut(BaseModel):
+    interval: str
+    by: str | None
+    buckets: list[date]
+    series: list[TimeSeriesSeriesOut]
+
+
+class DashboardSummaryOut(BaseModel):
+    # only the parts asked for with ?fields= are present
+    me: UserOut | None = None
+    kpis: KpisOut | None = None
+    filters: FiltersOut | None = None
+    pie_head: list[PieSliceOut] | None = None
+    pie_office: list[PieSliceOut] | None = None
+    # status -> first page
+    expenses: dict[str, ExpensePageOut] | None = None
@@ -1,30 +1,30 @@
 let headChart = null;
 let officeChart = null;
 
-async function fetchMe(){
-  const r = await fetch("/me");
-  return r.json();
-}
-
+// Everything shown on load comes from one /api/dashboard/summary request;
+// the server picks the parts for the user's role.
 window.onload = async () => {
-  const me = await fetchMe();
-  await loadKPIs();
+  const res = await fetch("/api/dashboard/summary", { cache: "no-cache" });
+  const data = await res.json();
+  const me = data.me;
 
-  await attachPendingClickIfAdmin();
+  renderKPIs(data.kpis);
+
+  attachPendingClickIfAdmin(me);
 
   if (me.role === "admin") {
     document.getElementById("admin-section").classList.remove("hide");
 
-    await loadAdminFilters();
-    await loadHeadPie();
-    await loadOfficePie();
+    renderAdminFilters(data.filters);
+    renderHeadPie(data.pie_head);
+    renderOfficePie(data.pie_office);
 
   } else {
     document.getElementById("user-section").classList.remove("hide");
 
-    await loadTable("approved", "approved-table");
-    await loadTable("pending", "pending-table");
-    await loadTable("rejected", "rejected-table");
+    loadTable("approved", "approved-table", data.expenses.approved);
+    loadTable("pending", "pending-table", data.expenses.pending);
+    loadTable("rejected", "rejected-table", data.expenses.rejected);
   }
 };
 
@@ -35,18 +35,34 @@ function logout(){
   window.location.href = "/static/login.html";
 }
 
-async function loadKPIs(){
-  const params = new URLSearchParams({
+function filterParams(extra){
+  return new URLSearchParams({
     user: document.getElementById("f-user")?.value || "",
     office: document.getElementById("f-office")?.value || "",
     head: document.getElementById("f-head")?.value || "",
     subhead: document.getElementById("f-subhead")?.value || "",
-    date: document.getElementById("f-date")?.value || ""
+    date: document.getElementById("f-date")?.value || "",
+    ...extra
+  });
+}
+
+// Admin filter change: KPIs and both pies in one request
+async function loadFiltered(){
+  const params = filterParams({
+    fields: "kpis,pie_head,pie_office",
+    head_top: document.getElementById("head-top").value,
+    office_top: document.getElementById("office-top").value
   });
 
-  const res = await fetch(`/api/dashboard/kpis?${params}`);
-  const d = await res.json();
+  const res = await fetch(`/api/dashboard/summary?${params}`, { cache: "no-cache" });
+  const data = await res.json();
+
+  renderKPIs(data.kpis);
+  renderHeadPie(data.pie_head);
+  renderOfficePie(data.pie_office);
+}
 
+function renderKPIs(d){
   const kpis = [
     ["Total Expense", d.total_expense],
     ["Total Uploaded", d.total_uploaded],
@@ -74,21 +90,19 @@ async function loadKPIs(){
 }
 
 
-async function loadTable(status, tableId){
-  const res = await fetch(`/api/dashboard/expenses/${status}`);
-  const data = await res.json();
-
+// Infinite scroll: each table shows firstPage (from the summary), then
+// fetches the next page whenever the sentinel under it scrolls into view.
+function loadTable(status, tableId, firstPage){
+  const table = document.getElementById(tableId);
   const emptyBox = document.getElementById(`${status}-empty`);
 
-  if(data.length === 0){
-    document.getElementById(tableId).innerHTML = "";
-    emptyBox.classList.remove("hide");
-    return;
-  }
+  const sentinel = document.createElement("div");
+  table.after(sentinel);
 
-  emptyBox.classList.add("hide");
+  let cursor = null;
+  let loading = false;
 
-  let html = `
+  table.innerHTML = `
     <tr>
       <th>Date</th>
       <th>Head</th>
@@ -97,24 +111,64 @@ async function loadTable(status, tableId){
     </tr>
   `;
 
-  data.forEach(r => {
-    html += `
-      <tr>
-        <td>${r.date || ""}</td>
-        <td>${r.head}</td>
-        <td>${r.subhead}</td>
-        <td>${r.amount}</td>
-      </tr>
-    `;
-  });
+  async function loadPage(){
+    if (loading) return;
+    loading = true;
+
+    // on failure the sentinel stays observed, so scrolling tries again
+    try {
+      const params = new URLSearchParams({ cursor });
+      const res = await fetch(`/api/dashboard/expenses/${status}?${params}`);
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      showPage(await res.json());
+    } catch (err) {
+      console.error(`Failed to load ${status} expenses`, err);
+    } finally {
+      loading = false;
+    }
+  }
 
-  document.getElementById(tableId).innerHTML = html;
-}
+  function showPage(data){
+    if (cursor === null && data.items.length === 0) {
+      table.innerHTML = "";
+      emptyBox.classList.remove("hide");
+    } else {
+      emptyBox.classList.add("hide");
+    }
 
-async function loadAdminFilters(){
-  const res = await fetch("/api/dashboard/admin/filters");
-  const data = await res.json();
+    let html = "";
+    data.items.forEach(r => {
+      html += `
+        <tr>
+          <td>${r.date || ""}</td>
+          <td>${r.head}</td>
+          <td>${r.subhead}</td>
+          <td>${r.amount}</td>
+        </tr>
+      `;
+    });
+    table.insertAdjacentHTML("beforeend", html);
+
+    cursor = data.next_cursor;
+
+    if (!cursor) {
+      observer.disconnect();
+      sentinel.remove();
+    } else {
+      // re-observing re-checks visibility, in case a page did not fill the screen
+      observer.unobserve(sentinel);
+      observer.observe(sentinel);
+    }
+  }
 
+  const observer = new IntersectionObserver(entries => {
+    if (entries[0].isIntersecting) loadPage();
+  }, { rootMargin: "300px" });
+
+  showPage(firstPage);
+}
+
+function renderAdminFilters(data){
   // User filter
   const userSel = document.getElementById("f-user");
   userSel.innerHTML = `<option value="">All Users</option>`;
@@ -144,19 +198,7 @@ async function loadAdminFilters(){
   });
 }
 
-async function loadHeadPie(){
-  const params = new URLSearchParams({
-    user: document.getElementById("f-user").value,
-    office: document.getElementById("f-office").value,
-    head: document.getElementById("f-head").value,
-    subhead: document.getElementById("f-subhead").value,
-    date: document.getElementById("f-date").value,
-    top: document.getElementById("head-top").value
-  });
-
-  const res = await fetch(`/api/dashboard/admin/pie/head?${params}`);
-  const data = await res.json();
-
+function renderHeadPie(data){
   const labels = data.map(d => d.label);
   const values = data.map(d => d.value);
 
@@ -188,27 +230,11 @@ async function loadHeadPie(){
   "office-top"
 ].forEach(id => {
   document.getElementById(id)
-    .addEventListener("change", () => {
-      loadHeadPie();
-      loadOfficePie();
-      loadKPIs();
-    });
+    .addEventListener("change", loadFiltered);
 });
 
 
-  async function loadOfficePie(){
-  const params = new URLSearchParams({
-    user: document.getElementById("f-user").value,
-    office: document.getElementById("f-office").value,
-    head: document.getElementById("f-head").value,
-    subhead: document.getElementById("f-subhead").value,
-    date: document.getElementById("f-date").value,
-    top: document.getElementById("office-top").value
-  });
-
-  const res = await fetch(`/api/dashboard/admin/pie/office?${params}`);
-  const data = await res.json();
-
+function renderOfficePie(data){
   const labels = data.map(d => d.label);
   const values = data.map(d => d.value);
 
@@ -230,10 +256,8 @@ async function loadHeadPie(){
   );
 }
 
-async function attachPendingClickIfAdmin() {
+function attachPendingClickIfAdmin(me) {
   try {
-    const me = await fetchMe();
-
     if (me.role === "admin") {
       const pendingCard = document.getElementById("pendingCard");
 
@@ -1,5 +1,19 @@
 const tableBody = document.querySelector("#pendingTable tbody");
 const emptyMessage = document.getElementById("emptyMessage");
+const selectAll = document.getElementById("selectAll");
+const selectedCount = document.getElementById("selectedCount");
+const bulkApproveBtn = document.getElementById("bulkApprove");
+const bulkRejectBtn = document.getElementById("bulkReject");
+
+selectAll.addEventListener("change", () => {
+    tableBody.querySelectorAll(".row-select").forEach(cb => {
+        cb.checked = selectAll.checked;
+    });
+    updateSelection();
+});
+
+bulkApproveBtn.onclick = () => handleBulkAction("approve");
+bulkRejectBtn.onclick = () => handleBulkAction("reject");
 
 // Load pending expenses on page load
 document.addEventListener("DOMContentLoaded", loadPendingExpenses);
@@ -7,6 +21,8 @@ document.addEventListener("DOMContentLoaded", loadPendingExpenses);
 async function loadPendingExpenses() {
     tableBody.innerHTML = "";
     emptyMessage.style.display = "none";
+    selectAll.checked = false;
+    updateSelection();
 
     try {
         const res = await fetch("/api/admin/pending-expenses", {
@@ -29,7 +45,10 @@ async function loadPendingExpenses() {
         data.forEach(exp => {
             const tr = document.createElement("tr");
 
+            tr.dataset.id = exp.pending_id;
+
             tr.innerHTML = `
+                <td><input type="checkbox" class="row-select"></td>
                 <td>${exp.submitted_by_name}</td>
                 <td>${exp.client}</td>
                 <td>${exp.office}</td>
@@ -43,6 +62,8 @@ async function loadPendingExpenses() {
                 </td>
             `;
 
+            tr.querySelector(".row-select").onchange = updateSelection;
+
             const approveBtn = tr.querySelector(".btn-approve");
             const rejectBtn  = tr.querySelector(".btn-reject");
 
@@ -92,6 +113,7 @@ async function handleAction(pendingId, action, rowElement) {
 
         // Remove row from table
         rowElement.remove();
+        updateSelection();
 
         // Show empty message if no rows left
         if (!tableBody.children.length) {
@@ -103,3 +125,67 @@ async function handleAction(pendingId, action, rowElement) {
         alert("Server error while processing request.");
     }
 }
+
+function selectedRows() {
+    return [...tableBody.querySelectorAll(".row-select:checked")]
+        .map(cb => cb.closest("tr"));
+}
+
+function updateSelection() {
+    const count = selectedRows().length;
+    selectedCount.textContent = `${count} selected`;
+    bulkApproveBtn.disabled = count === 0;
+    bulkRejectBtn.disabled = count === 0;
+}
+
+// One request for the whole selection; the server reviews the rows atomically
+// and reports per id whether it was reviewed or already processed elsewhere.
+async function handleBulkAction(action) {
+    const rows = selectedRows();
+    if (!rows.length) return;
+
+    if (!confirm(`${action === "approve" ? "Approve" : "Reject"} ${rows.length} expenses?`)) return;
+
+    bulkApproveBtn.disabled = true;
+    bulkRejectBtn.disabled = true;
+
+    try {
+        const res = await fetch("/api/admin/pending-expenses/bulk", {
+            method: "POST",
+            credentials: "include",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({
+                action,
+                ids: rows.map(tr => Number(tr.dataset.id))
+            })
+        });
+
+        const data = await res.json();
+
+        if (!res.ok) {
+            alert(data.detail || "Action failed");
+            updateSelection();
+            return;
+        }
+
+        // Rows reviewed here or already processed elsewhere are both done
+        rows.forEach(tr => tr.remove());
+
+        const skipped = data.results.length - data.reviewed;
+        if (skipped) {
+            alert(`${skipped} expenses had already been processed.`);
+        }
+
+        selectAll.checked = false;
+        updateSelection();
+
+        if (!tableBody.children.length) {
+            emptyMessage.style.display = "block";
+        }
+
+    } catch (err) {
+        console.error(err);
+        alert("Server error while processing request.");
+        updateSelection();
+    }
+}
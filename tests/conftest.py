@@ -0,0 +1,88 @@
+"""Shared fixtures.
+
+The tests need a Postgres database they are free to wipe; name it in
+TEST_DATABASE_URL, which then stands in for DATABASE_URL for the whole run:
+
+    TEST_DATABASE_URL=postgresql://localhost/expense_test python -m pytest tests
+
+Without it, every test that needs the database is skipped. Besides
+requirements.txt the tests need pytest and httpx (FastAPI's TestClient
+and ASGI transport).
+"""
+import os
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # before anything imports database.py, which reads it once
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+# EXPLAIN needs realistic row counts to choose the plans production gets
+TEST_SEED_ROWS = int(os.getenv("TEST_SEED_ROWS", "200000"))
+
+
+@pytest.fixture(scope="session")
+def migrated_db():
+    """An empty schema with every migration applied."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    import migrations
+    import partitions
+    from database import get_db
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP SCHEMA public CASCADE")
+        cur.execute("CREATE SCHEMA public")
+        conn.commit()
+        migrations.migrate(conn)
+        partitions.ensure(cur)
+        conn.commit()
+        cur.close()
+
+
+@pytest.fixture(scope="session")
+def seeded_db(migrated_db):
+    """migrated_db filled by bench.seed; returns the seeded user ids."""
+    from bench.seed import seed
+    from database import get_db
+
+    user_ids = seed(rows=TEST_SEED_ROWS)
+
+    # what autovacuum does in production; index-only scans depend on it
+    with get_db() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("VACUUM ANALYZE")
+        cur.close()
+        conn.autocommit = False
+
+    return user_ids
+
+
+@pytest.fixture
+def sendgrid_stub(monkeypatch):
+    """A running tests.sendgrid_stub.SendGridStub that mail_transport sends
+    to, with a fresh transport, rate limiter and circuit breaker."""
+    import mail_transport
+    from tests.sendgrid_stub import SendGridStub
+
+    stub = SendGridStub()
+    stub.start()
+
+    monkeypatch.setattr(mail_transport, "MAIL_BACKEND", "sendgrid")
+    monkeypatch.setattr(mail_transport, "SENDGRID_API_URL", stub.url)
+    monkeypatch.setattr(mail_transport, "SENDGRID_API_KEY", "stub")
+    monkeypatch.setattr(mail_transport, "_transport", None)
+    monkeypatch.setattr(mail_transport, "_limiter", mail_transport.RateLimiter(0))
+    monkeypatch.setattr(mail_transport, "_breaker", mail_transport.CircuitBreaker(
+        mail_transport.MAIL_BREAKER_FAILURES, mail_transport.MAIL_BREAKER_RESET,
+    ))
+
+    yield stub
+
+    if mail_transport._transport is not None:
+        mail_transport._transport.session.close()
+    stub.stop()
@@ -0,0 +1,116 @@
+"""A local stand-in for the SendGrid API.
+
+The sendgrid_stub fixture (conftest.py) runs one per test on a free port
+and points mail_transport at it; tests set .status to the reply they want
+and read back the .payloads it accepted. It also runs on its own, to
+exercise worker.py by hand:
+
+    python -m tests.sendgrid_stub --port 8025 --delay 2 --fail-rate 0.2 &
+    SENDGRID_API_URL=http://127.0.0.1:8025/v3/mail/send SENDGRID_API_KEY=stub \
+        python worker.py --once
+
+With --cert (a PEM holding key and certificate) it serves HTTPS, so the
+cost of TLS handshakes shows up; point REQUESTS_CA_BUNDLE at the same file.
+"""
+import argparse
+import json
+import random
+import ssl
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.stub.count("connections")
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = stub.reply(json.loads(body))
+
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, fmt, *a):
+        if self.server.stub.verbose:
+            super().log_message(fmt, *a)
+
+
+class SendGridStub:
+    """Replies .status (202 by default) to every send, after delay
+    seconds; a fail_rate share of them get a 503 instead."""
+
+    def __init__(self, port=0, delay=0, fail_rate=0, cert=None, verbose=False):
+        self.status = 202
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+        self.payloads = []
+        self.stats = defaultdict(int)
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.stub = self
+        scheme = "http"
+        if cert:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(cert)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            scheme = "https"
+        self.url = f"{scheme}://127.0.0.1:{self.server.server_port}/v3/mail/send"
+        self.thread = None
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def reply(self, payload):
+        time.sleep(self.delay)
+        status = 503 if random.random() < self.fail_rate else self.status
+        with self.lock:
+            self.stats["requests"] += 1
+            if status in (200, 202):
+                self.stats["accepted"] += 1
+                self.stats["recipients"] += sum(len(p["to"]) for p in payload.get("personalizations", []))
+                self.payloads.append(payload)
+            else:
+                self.stats["failed"] += 1
+        return status
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--delay", type=float, default=0, help="seconds per request")
+    parser.add_argument("--fail-rate", type=float, default=0, help="share of 503 replies")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--cert", help="PEM with key and certificate: serve HTTPS")
+    args = parser.parse_args()
+
+    stub = SendGridStub(args.port, args.delay, args.fail_rate, args.cert, args.verbose)
+    print(f"SendGrid stub on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(stub.stats))
+
+
+if __name__ == "__main__":
+    main()
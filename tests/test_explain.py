@@ -0,0 +1,182 @@
+"""EXPLAIN the hot queries on the seeded database.
+
+Every query is built by the code that runs it in production (main.py's
+query builders, exports.rows_query()), so what is checked is what ships.
+Each case lists the indexes its plan must use; partition indexes count as
+the index they were created from. No case may read a populated
+expense_items partition sequentially, and an export of a date range may
+only touch that range's partitions.
+"""
+from datetime import timedelta
+
+import pytest
+
+import exports
+import main
+import partitions
+import queries
+from database import get_db
+
+# Seq scans of partitions this small are fine, e.g. the empty ones created
+# ahead for the coming months.
+SMALL_PARTITION_ROWS = 1000
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+ROLLUP_KEY = "<expense_rollup unique key>"
+
+# name -> (build(sample) -> (sql, params), [indexes; a set means any of them])
+CASES = {
+    "review by token": (
+        lambda s: (main._REVIEW_BY_TOKEN_SQL, {"token": s["token"], "action": "approve", "status": "approved"}),
+        ["approval_tokens_pkey", "expense_items_id_idx"],
+    ),
+    "pending list": (
+        lambda s: (main._PENDING_EXPENSES_SQL, None),
+        [{"expense_items_pending_idx", "expense_items_id_idx"}],
+    ),
+    "review pending by id": (
+        lambda s: main._review_pending_query("approve", ["id = ANY(%s)"], [[s["pending_id"]]]),
+        [{"expense_items_pending_idx", "expense_items_id_idx"}],
+    ),
+    **{
+        f"user_expenses {status}": (
+            lambda s, status=status: main._expense_page_query(s["user_id"], status, main.EXPENSES_PAGE_SIZE),
+            ["expense_items_user_status_date_idx"],
+        )
+        for status in main.EXPENSE_STATUSES
+    },
+    "user_expenses next page": (
+        lambda s: main._expense_page_query(
+            s["user_id"], "approved", main.EXPENSES_PAGE_SIZE, main._encode_cursor(s["date"], s["pending_id"])
+        ),
+        ["expense_items_user_status_date_idx"],
+    ),
+    "kpis by user": (lambda s: main._kpis_query(s["by_user"]), [ROLLUP_KEY]),
+    "kpis by office": (lambda s: main._kpis_query(s["by_office"]), ["expense_rollup_office_idx"]),
+    "kpis by head+subhead": (lambda s: main._kpis_query(s["by_head"]), ["expense_rollup_head_subhead_idx"]),
+    "kpis by date": (lambda s: main._kpis_query(s["by_date"]), ["expense_rollup_date_idx"]),
+    "pie head by office": (
+        lambda s: main._admin_pie_query("head", s["by_office"], 3), ["expense_rollup_office_idx"],
+    ),
+    "pie office by user": (lambda s: main._admin_pie_query("office_name", s["by_user"], 3), [ROLLUP_KEY]),
+    "timeseries month": (
+        lambda s: main._timeseries_query("month", None, s["approved quarter"]), ["expense_rollup_status_date_cover_idx"],
+    ),
+    "timeseries by office": (
+        lambda s: main._timeseries_query("month", "office", s["approved quarter"]), ["expense_rollup_status_date_cover_idx"],
+    ),
+    # reads the whole rollup by design; planned so it fails when it stops compiling
+    "filter facets": (lambda s: main._admin_filters_query(s["by_office"]), []),
+    "export by user and quarter": (
+        lambda s: exports.rows_query({**s["by_user"], **s["quarter"]}),
+        ["expense_items_user_status_date_idx"],
+    ),
+}
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def _months(date_from, date_to):
+    month = partitions._month_start(date_from)
+    while month <= date_to:
+        yield month
+        month = partitions._next_month(month)
+
+
+@pytest.fixture(scope="module")
+def db(seeded_db):
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT token FROM approval_tokens LIMIT 1")
+        token = cur.fetchone()[0]
+        cur.execute("SELECT MAX(id) FROM expense_items WHERE status = 'pending'")
+        pending_id = cur.fetchone()[0]
+        cur.execute("""
+            SELECT created_by, office_name, head, subhead, expense_date
+            FROM expense_items
+            -- the whole quarter before it has partitions
+            WHERE status = 'approved' AND expense_date BETWEEN CURRENT_DATE - 180 AND CURRENT_DATE - 30
+            LIMIT 1
+        """)
+        user_id, office, head, subhead, date = cur.fetchone()
+
+        # index -> the index it was created from, table -> (root table, rows)
+        cur.execute("""
+            SELECT c.relname, COALESCE(pg_partition_root(i.indexrelid), i.indexrelid)::regclass::text
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        """)
+        index_root = dict(cur.fetchall())
+        cur.execute("""
+            SELECT conindid::regclass::text FROM pg_constraint
+            WHERE conrelid = 'expense_rollup'::regclass AND contype = 'u'
+        """)
+        index_root[cur.fetchone()[0]] = ROLLUP_KEY
+        cur.execute("""
+            SELECT relname, COALESCE(pg_partition_root(oid), oid)::regclass::text, reltuples
+            FROM pg_class WHERE relkind = 'r'
+        """)
+        tables = {name: (root, rows) for name, root, rows in cur.fetchall()}
+
+        sample = {
+            "token": token,
+            "pending_id": pending_id,
+            "user_id": user_id,
+            "date": date,
+            "by_user": queries.parse_filters(user=[str(user_id)]),
+            "by_office": queries.parse_filters(office=[office]),
+            "by_head": queries.parse_filters(head=[head], subhead=[subhead]),
+            "by_date": queries.parse_filters(date=date.isoformat()),
+            "approved quarter": {"status": ["approved"], "date_from": date - timedelta(days=90), "date_to": date},
+            "quarter": {"date_from": date - timedelta(days=90), "date_to": date},
+        }
+
+        def explain(sql, params):
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            return list(_plan_nodes(cur.fetchone()[0][0]["Plan"]))
+
+        yield sample, explain, index_root, tables
+        conn.rollback()
+        cur.close()
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_hot_query_plan(db, name):
+    sample, explain, index_root, tables = db
+    build, expected = CASES[name]
+    sql, params = build(sample)
+    nodes = explain(sql, params)
+
+    used = {index_root.get(n["Index Name"]) for n in nodes if n["Node Type"] in INDEX_NODES}
+    for index in expected:
+        choices = index if isinstance(index, set) else {index}
+        assert used & choices, f"{name}: none of {sorted(choices)} used, only {sorted(filter(None, used))}"
+
+    item_partitions = {
+        n["Relation Name"] for n in nodes
+        if tables.get(n.get("Relation Name"), (None,))[0] == partitions.PARENT
+    }
+    seq_scanned = {
+        n["Relation Name"] for n in nodes
+        if n["Node Type"] == "Seq Scan" and n["Relation Name"] in item_partitions
+        and tables[n["Relation Name"]][1] > SMALL_PARTITION_ROWS
+    }
+    assert not seq_scanned, f"{name}: sequential scan of {sorted(seq_scanned)}"
+
+
+def test_export_prunes_partitions(db):
+    sample, explain, _, tables = db
+    quarter = sample["quarter"]
+    nodes = explain(*exports.rows_query({**sample["by_user"], **quarter}))
+
+    scanned = {
+        n["Relation Name"] for n in nodes
+        if tables.get(n.get("Relation Name"), (None,))[0] == partitions.PARENT
+    }
+    in_range = {partitions.partition_name(m) for m in _months(quarter["date_from"], quarter["date_to"])}
+    assert scanned, "the export reads no expense_items partition"
+    assert scanned <= in_range, f"partitions outside the date range read: {sorted(scanned - in_range)}"
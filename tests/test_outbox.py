@@ -0,0 +1,111 @@
+"""outbox.dispatch_batch() against the SendGrid stub: what each provider
+answer does to an approval email's outbox row."""
+import pytest
+
+import mail_transport
+import outbox
+from database import get_db
+
+ADMIN_EMAIL = "outbox-admin@example.com"
+
+PAYLOAD = {
+    "pending_id": 1,
+    "token": "outbox-test-token",
+    "expense": {
+        "expense_date": "2026-01-15", "client": "client-1", "office_name": "office-1",
+        "head": "Fuel", "subhead": "subhead-1", "from_location": None, "to_location": None,
+        "weight": None, "amount": 100.0, "awb": None, "remark": None, "vehicle_type": None,
+    },
+    "submitted_by_name": "outbox-user",
+    "submitted_by_email": "outbox-user@example.com",
+}
+
+
+@pytest.fixture
+def message(migrated_db, monkeypatch):
+    """The id of a due approval email, alone in the outbox."""
+    monkeypatch.setattr(outbox, "APPROVAL_EMAIL_MODE", "instant")
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM email_outbox")
+        cur.execute("""
+            INSERT INTO users (name, email, password, role)
+            VALUES ('outbox-admin', %s, '-', 'admin')
+            ON CONFLICT (email) DO NOTHING
+        """, (ADMIN_EMAIL,))
+        outbox.enqueue(cur, outbox.APPROVAL_EMAIL, PAYLOAD)
+        cur.execute("SELECT MAX(id) FROM email_outbox")
+        msg_id = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    return msg_id
+
+
+def _dispatch():
+    with get_db() as conn:
+        return outbox.dispatch_batch(conn)
+
+
+def _row(msg_id):
+    """status, attempts, seconds until next_attempt_at, last_error, sent_at"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT status, attempts, EXTRACT(EPOCH FROM next_attempt_at - NOW())::float,
+                   last_error, sent_at
+            FROM email_outbox WHERE id = %s
+        """, (msg_id,))
+        row = cur.fetchone()
+        conn.rollback()
+        cur.close()
+    return row
+
+
+def test_accepted_is_sent(sendgrid_stub, message):
+    assert _dispatch() == 1
+
+    status, attempts, _, last_error, sent_at = _row(message)
+    assert (status, attempts, last_error) == ("sent", 1, None)
+    assert sent_at is not None
+
+    [payload] = sendgrid_stub.payloads
+    [to] = [p["to"] for p in payload["personalizations"]]
+    assert {"email": ADMIN_EMAIL} in to
+    assert f"/review/approve/{PAYLOAD['token']}" in payload["content"][0]["value"]
+
+
+def test_server_error_retries_later(sendgrid_stub, message):
+    sendgrid_stub.status = 503
+
+    _dispatch()
+
+    status, attempts, wait, last_error, _ = _row(message)
+    assert (status, attempts) == ("pending", 1)
+    assert wait == pytest.approx(outbox.backoff(1), abs=5)
+    assert "503" in last_error
+
+
+def test_rejected_is_dead(sendgrid_stub, message):
+    sendgrid_stub.status = 400
+
+    _dispatch()
+
+    status, attempts, _, last_error, sent_at = _row(message)
+    assert (status, attempts) == ("dead", 1)
+    assert "400" in last_error
+    assert sent_at is None
+
+
+def test_circuit_open_defers_without_an_attempt(sendgrid_stub, message, monkeypatch):
+    breaker = mail_transport.CircuitBreaker(1, 120)
+    breaker.record(False)
+    monkeypatch.setattr(mail_transport, "_breaker", breaker)
+
+    _dispatch()
+
+    status, attempts, wait, last_error, _ = _row(message)
+    assert (status, attempts) == ("pending", 0)
+    assert wait == pytest.approx(120, abs=5)
+    assert "mail provider unavailable" in last_error
+    assert sendgrid_stub.stats["requests"] == 0
@@ -0,0 +1,32 @@
+"""partitions.py's CLI."""
+import sys
+from datetime import date
+
+import pytest
+
+import partitions
+from cache import response_cache
+from database import get_db
+
+
+def _response_generation():
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT last_value FROM response_cache_generation")
+        generation = cur.fetchone()[0]
+        conn.rollback()
+        cur.close()
+    return generation
+
+
+def test_detach_and_attach_invalidate_cached_responses(migrated_db, monkeypatch):
+    if not response_cache.enabled:
+        pytest.skip("response cache disabled")
+    # the month after this one: partitions.ensure() created it empty
+    month = partitions._next_month(date.today()).strftime("%Y-%m")
+
+    for command in ("detach", "attach"):
+        before = _response_generation()
+        monkeypatch.setattr(sys, "argv", ["partitions.py", command, month])
+        partitions.main()
+        assert _response_generation() > before, command
@@ -0,0 +1,23 @@
+"""Response cache keys."""
+from datetime import date
+
+from cache import _filters_key
+
+
+def test_list_filter_order_shares_a_key():
+    assert _filters_key({"office": ["A", "B"]}) == _filters_key({"office": ["B", "A"]})
+    assert _filters_key({"user": [2, 10, 2]}) == _filters_key({"user": [10, 2]})
+
+
+def test_empty_filters_share_a_key():
+    assert _filters_key({"office": None, "date": ""}) == _filters_key({})
+
+
+def test_different_filters_keep_their_keys():
+    keys = {
+        _filters_key({"office": ["A"]}),
+        _filters_key({"office": ["A", "B"]}),
+        _filters_key({"head": ["A"]}),
+        _filters_key({"date": date(2026, 1, 1)}),
+    }
+    assert len(keys) == 4
@@ -0,0 +1,92 @@
+"""Concurrent clicks on the approve and reject links of one expense.
+
+Reviewers double-click, and approve and reject can be clicked at once from
+two inboxes. Exactly one click may decide; every other click of the same
+decision answers the same, the other decision gets a 409, and the
+expense's tokens are all used up by that one decision.
+"""
+import asyncio
+
+import httpx
+
+import approval_tokens
+import async_db
+import main
+from database import get_db
+
+CLICKS = 100
+
+
+def _pending_with_token():
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT e.id, t.token
+            FROM expense_items e
+            JOIN approval_tokens t ON t.pending_id = e.id
+            WHERE e.status = 'pending' AND t.action IS NULL AND t.used_at IS NULL
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+        conn.rollback()
+        cur.close()
+    assert row, "no pending expense with unused tokens in the seed"
+    pending_id, token = row
+    return pending_id, approval_tokens.encode(bytes(token))
+
+
+async def _click_all(token):
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            async def click(n):
+                action = ("approve", "reject")[n % 2]
+                resp = await client.get(f"/review/{action}/{token}")
+                body = resp.json()
+                return action, resp.status_code, body.get("status") or body.get("detail")
+
+            return await asyncio.gather(*(click(n) for n in range(CLICKS)))
+    finally:
+        # the pool belongs to this event loop
+        await async_db.close_pool()
+
+
+def test_concurrent_clicks_decide_once(seeded_db, monkeypatch):
+    pending_id, token = _pending_with_token()
+
+    changes = []
+    invalidate = main.invalidate_responses
+
+    async def counting_invalidate(conn):
+        changes.append(1)
+        await invalidate(conn)
+
+    # called only by the click whose UPDATE flipped the expense
+    monkeypatch.setattr(main, "invalidate_responses", counting_invalidate)
+
+    results = asyncio.run(_click_all(token))
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status FROM expense_items WHERE id = %s", (pending_id,))
+        status = cur.fetchone()[0]
+        cur.execute("""
+            SELECT COUNT(*) FILTER (WHERE used_at IS NULL), COUNT(DISTINCT used_at)
+            FROM approval_tokens WHERE pending_id = %s
+        """, (pending_id,))
+        unused, used_at_values = cur.fetchone()
+        conn.rollback()
+        cur.close()
+
+    assert status in ("approved", "rejected")
+    assert len(changes) == 1
+    assert unused == 0
+    assert used_at_values == 1
+
+    winner = "approve" if status == "approved" else "reject"
+    for action, code, answer in results:
+        if action == winner:
+            assert (code, answer) == (200, status)
+        else:
+            assert (code, answer) == (409, f"Expense already {status}")
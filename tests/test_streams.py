@@ -0,0 +1,122 @@
+"""Streamed responses hold one pooled connection, and only while streaming."""
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import database
+import main
+from database import PoolTimeout, get_db
+
+EMAIL = "stream-user@example.com"
+ROWS = 3
+
+
+def _login(monkeypatch, role):
+    """A TestClient logged in as a user with ROWS approved expenses."""
+    monkeypatch.setattr(auth, "SECRET", "test-secret")
+    # the role may have just changed: look the user up again
+    monkeypatch.setattr(auth.user_generation, "value", None)
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO users (name, email, password, role) VALUES ('stream-user', %s, '-', %s)
+            ON CONFLICT (email) DO UPDATE SET role = EXCLUDED.role
+            RETURNING id
+        """, (EMAIL, role))
+        user_id = cur.fetchone()[0]
+        cur.execute("DELETE FROM expense_items WHERE created_by = %s", (user_id,))
+        cur.execute("""
+            INSERT INTO expense_items (status, expense_date, client, office_name, head, subhead, amount, created_by)
+            SELECT 'approved', CURRENT_DATE, 'client-1', 'office-1', 'Fuel', 'subhead-1', n, %s
+            FROM generate_series(1, %s) n
+        """, (user_id, ROWS))
+        conn.commit()
+        cur.close()
+
+    client = TestClient(main.app)
+    client.cookies.set("access_token", auth.create_token({"user_id": user_id}))
+    return client, user_id
+
+
+@pytest.fixture
+def client(migrated_db, monkeypatch):
+    return _login(monkeypatch, "user")[0]
+
+
+@pytest.fixture
+def admin_export(migrated_db, monkeypatch):
+    """An admin's TestClient and the URL of an inline CSV export of their
+    own expenses."""
+    client, user_id = _login(monkeypatch, "admin")
+    return client, f"/api/admin/export?format=csv&user={user_id}"
+
+
+@pytest.fixture
+def held(monkeypatch):
+    """Track how many pooled connections are checked out at once."""
+    state = {"now": 0, "max": 0}
+    checkout, checkin = database._checkout, database._checkin
+
+    def counting_checkout():
+        conn = checkout()
+        state["now"] += 1
+        state["max"] = max(state["max"], state["now"])
+        return conn
+
+    def counting_checkin(conn):
+        state["now"] -= 1
+        checkin(conn)
+
+    monkeypatch.setattr(database, "_checkout", counting_checkout)
+    monkeypatch.setattr(database, "_checkin", counting_checkin)
+    return state
+
+
+def test_ndjson_stream_holds_one_connection(client, held):
+    with client.stream("GET", "/api/dashboard/expenses/approved?format=ndjson") as resp:
+        assert resp.status_code == 200
+        lines = list(resp.iter_lines())
+
+    assert len(lines) == ROWS
+    assert held == {"now": 0, "max": 1}
+
+
+def test_ndjson_stream_busy_pool_is_503(client, monkeypatch):
+    client.get("/api/dashboard/expenses/approved")  # caches the user: only the stream needs the pool
+
+    def busy():
+        raise PoolTimeout("no database connection available")
+
+    monkeypatch.setattr(database, "_checkout", busy)
+
+    resp = client.get("/api/dashboard/expenses/approved?format=ndjson")
+    assert resp.status_code == 503
+
+
+def test_csv_export_holds_one_connection(admin_export, held):
+    client, url = admin_export
+    with client.stream("GET", url) as resp:
+        assert resp.status_code == 200
+        lines = list(resp.iter_lines())
+
+    assert len(lines) == 1 + ROWS  # header
+    assert held == {"now": 0, "max": 1}
+
+
+def test_csv_export_busy_pool_is_503(admin_export, monkeypatch):
+    client, url = admin_export
+    checkout = database._checkout
+    checkouts = []
+
+    def busy_after_count():
+        # the count and the user lookup get theirs, the stream does not
+        checkouts.append(1)
+        if len(checkouts) > 2:
+            raise PoolTimeout("no database connection available")
+        return checkout()
+
+    monkeypatch.setattr(database, "_checkout", busy_after_count)
+
+    resp = client.get(url)
+    assert resp.status_code == 503
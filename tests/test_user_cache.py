@@ -0,0 +1,110 @@
+"""The per-process user cache behind get_current_user(_async)."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+import async_db
+import auth
+import cache
+import main
+from database import get_db
+
+EMAIL = "cache-user@example.com"
+
+
+@pytest.fixture
+def token(migrated_db, monkeypatch):
+    """A session cookie for a plain user, with this process's users
+    generation not read yet."""
+    monkeypatch.setattr(auth, "SECRET", "test-secret")
+    monkeypatch.setattr(auth.user_generation, "value", None)
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO users (name, email, password, role) VALUES ('cache-user', %s, '-', 'user')
+            ON CONFLICT (email) DO UPDATE SET role = 'user'
+            RETURNING id
+        """, (EMAIL,))
+        user_id = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    return auth.create_token({"user_id": user_id})
+
+
+def _set_role(role):
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET role = %s WHERE email = %s", (role, EMAIL))
+        conn.commit()
+        cur.close()
+
+
+def _users_generation():
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(auth.GENERATION_SQL)
+        generation = cur.fetchone()[0]
+        conn.rollback()
+        cur.close()
+    return generation
+
+
+def _run(token, steps):
+    """Run steps(me) in one event loop; me() GETs /me and returns its role."""
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        try:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test", cookies={"access_token": token}
+            ) as client:
+
+                async def me():
+                    resp = await client.get("/me")
+                    assert resp.status_code == 200, resp.text
+                    return resp.json()["role"]
+
+                return await steps(me)
+        finally:
+            await async_db.close_pool()
+
+    return asyncio.run(run())
+
+
+def test_cache_hit_borrows_no_connection(token, monkeypatch):
+    @asynccontextmanager
+    async def no_connection():
+        raise AssertionError("a cached user needed a database connection")
+        yield
+
+    async def steps(me):
+        await me()
+        monkeypatch.setattr(async_db, "request_db", no_connection)
+        return await me()
+
+    assert _run(token, steps) == "user"
+
+
+def test_role_change_is_seen_once_the_generation_is_reread(token, monkeypatch):
+    monkeypatch.setattr(auth.user_generation, "interval", 3600)
+
+    async def steps(me):
+        before = await me()
+        _set_role("admin")
+        cached = await me()
+        monkeypatch.setattr(auth.user_generation, "interval", 0)
+        return before, cached, await me()
+
+    assert _run(token, steps) == ("user", "user", "admin")
+
+
+def test_response_cache_bumps_keep_the_users_generation(migrated_db):
+    generation = _users_generation()
+
+    with get_db() as conn:
+        cache.invalidate_responses_sync(conn)
+        conn.commit()
+
+    assert _users_generation() == generation
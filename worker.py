@@ -0,0 +1,102 @@
+"""Background worker: drains the email outbox and sweeps what has expired.
+
+Run it as its own process next to the web workers:
+
+    python worker.py           # loop forever
+    python worker.py --once    # drain what is due and exit
+
+It wakes up on NOTIFY from new submissions and otherwise polls every
+OUTBOX_POLL_INTERVAL seconds to pick up retries that became due. Every
+TOKEN_SWEEP_INTERVAL seconds it also deletes dead approval tokens (see
+approval_tokens.py) and outbox messages sent more than
+OUTBOX_RETENTION_HOURS ago. Errors, such as the database restarting, are
+logged and retried with a growing delay, up to WORKER_BACKOFF_MAX seconds.
+"""
+import argparse
+import os
+import select
+import time
+
+import psycopg2
+
+import approval_tokens
+import outbox
+from database import DATABASE_URL, get_db
+
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+# Longest wait between attempts while the database or mail keeps failing
+WORKER_BACKOFF_MAX = float(os.getenv("WORKER_BACKOFF_MAX", "300"))
+
+
+def drain():
+    total = 0
+    while True:
+        with get_db() as conn:
+            claimed = outbox.dispatch_batch(conn)
+        total += claimed
+        if claimed < outbox.OUTBOX_BATCH_SIZE:
+            return total
+
+
+def listen():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {outbox.NOTIFY_CHANNEL}")
+    cur.close()
+    return conn
+
+
+def run():
+    conn = None
+    next_sweep = 0
+    failures = 0
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = listen()
+                drain()
+                if time.monotonic() >= next_sweep:
+                    try:
+                        approval_tokens.sweep()
+                    except Exception as e:
+                        print("⚠️ Approval token sweep failed:", e)
+                    try:
+                        outbox.purge_sent()
+                    except Exception as e:
+                        print("⚠️ Outbox purge failed:", e)
+                    next_sweep = time.monotonic() + approval_tokens.TOKEN_SWEEP_INTERVAL
+                if select.select([conn], [], [], OUTBOX_POLL_INTERVAL)[0]:
+                    conn.poll()
+                    conn.notifies.clear()
+                failures = 0
+            except Exception as e:
+                # e.g. the database restarting: wait, then listen again
+                failures += 1
+                delay = min(OUTBOX_POLL_INTERVAL * 2 ** (failures - 1), WORKER_BACKOFF_MAX)
+                print(f"⚠️ Outbox worker failed, retrying in {delay:g}s:", e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                time.sleep(delay)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="drain due messages, sweep tokens and sent messages, and exit")
+    args = parser.parse_args()
+
+    if args.once:
+        print(f"dispatched {drain()} outbox messages")
+        print(f"deleted {approval_tokens.sweep()} dead approval tokens")
+        print(f"deleted {outbox.purge_sent()} sent outbox messages")
+    else:
+        run()
+
+
+if __name__ == "__main__":
+    main()